@@ -0,0 +1,162 @@
+"""Fingerprinted, precompressed static files.
+
+`flask build-assets` copies every file under static/ into static/build/
+with a hash of its content in the name (scripts/app.js becomes
+scripts/app.1f2e3d4c5b6a.js), and writes gzip copies of the text files next
+to them, plus brotli copies if the `brotli` package is installed. Stylesheet
+url(/static/...) references are rewritten to the hashed names too.
+build/manifest.json maps each original name to its hashed one.
+
+Once the manifest exists, url_for('static', filename='scripts/app.js')
+points at the hashed copy. It is served with a year-long
+`Cache-Control: immutable`: any change gives the file a new name, so a
+browser never has to ask about it again. Browsers that accept br or gzip
+get the precompressed copy with Content-Encoding set. Without a manifest,
+in a fresh development checkout, static files are served as they always were.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+
+from extensions import AppLocal
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# Text formats worth compressing; images are compressed already.
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.txt', '.webmanifest'}
+CSS_URL = re.compile(r'''url\((['"]?)/static/([^'")]+)\1\)''')
+
+
+def fingerprint(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def build(static_folder, directory='build'):
+    """Write the hashed and compressed copies of `static_folder` into its `directory`.
+
+    Replaces what was there before. Returns the manifest."""
+
+    out = os.path.join(static_folder, directory)
+    shutil.rmtree(out, ignore_errors=True)
+
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and os.path.join(root, d) != out)
+        sources.extend(os.path.relpath(os.path.join(root, name), static_folder)
+                       for name in sorted(files) if not name.startswith('.'))
+    # Stylesheets last, so the files they refer to already have their hashed names.
+    sources.sort(key=lambda name: name.endswith('.css'))
+
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_folder, name), 'rb') as fh:
+            content = fh.read()
+        if name.endswith('.css'):
+            content = _rewrite_css(content, manifest, directory)
+
+        stem, ext = os.path.splitext(name)
+        hashed = '%s.%s%s' % (stem, fingerprint(content), ext)
+        manifest[name.replace(os.sep, '/')] = hashed.replace(os.sep, '/')
+
+        path = os.path.join(out, hashed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        if ext in COMPRESSIBLE:
+            _write_compressed(path, content)
+
+    with open(os.path.join(out, MANIFEST), 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    return manifest
+
+
+def _rewrite_css(content, manifest, directory):
+    def replace(match):
+        hashed = manifest.get(match.group(2))
+        if hashed is None:
+            return match.group(0)
+        return 'url(%s/static/%s/%s%s)' % (match.group(1), directory, hashed, match.group(1))
+
+    return CSS_URL.sub(replace, content.decode()).encode()
+
+
+def _write_compressed(path, content):
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content, quality=11)))
+    for suffix, compressed in variants:
+        # Tiny files can come out bigger.
+        if len(compressed) < len(content):
+            with open(path + suffix, 'wb') as fh:
+                fh.write(compressed)
+
+
+class Assets(object):
+    """Points url_for('static') at the hashed files and serves them for good."""
+
+    # Preferred first.
+    ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self):
+        self.manifest = {}
+        self.encodings = {}  # hashed path under static/ -> suffixes of its compressed copies
+
+    def init_app(self, app):
+        self.directory = app.config['ASSETS_DIR']
+        self.max_age = app.config['ASSETS_MAX_AGE']
+        self.manifest = {}
+        self.encodings = {}
+
+        manifest_path = os.path.join(app.static_folder, self.directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as fh:
+                manifest = json.load(fh)
+            for name, hashed in manifest.items():
+                path = '%s/%s' % (self.directory, hashed)
+                self.manifest[name] = path
+                self.encodings[path] = {encoding: suffix for encoding, suffix in self.ENCODINGS
+                                        if os.path.exists(os.path.join(app.static_folder, path + suffix))}
+
+        app.url_defaults(self._hashed_url)
+        static_view = app.view_functions['static']
+
+        def static(filename):
+            if filename not in self.encodings:
+                return static_view(filename=filename)
+            return self._send(app.static_folder, filename)
+
+        app.view_functions['static'] = static
+
+    def _hashed_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def _send(self, static_folder, filename):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = next((encoding for encoding, _ in self.ENCODINGS
+                         if encoding in self.encodings[filename] and request.accept_encodings[encoding]), None)
+
+        if encoding is None:
+            response = send_from_directory(static_folder, filename, mimetype=mimetype, max_age=self.max_age)
+        else:
+            response = send_from_directory(static_folder, filename + self.encodings[filename][encoding],
+                                           mimetype=mimetype, max_age=self.max_age)
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+assets = AppLocal('assets', Assets)
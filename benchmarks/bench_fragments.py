@@ -0,0 +1,95 @@
+"""Template render time for 100-item pages, with and without the fragment cache.
+
+Seeds one user offering and requesting 100 items that all match one search
+term, then times just the template rendering (not the queries) of their
+profile page and of a 100-result search page:
+
+    python benchmarks/bench_fragments.py --requests 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import before_render_template, template_rendered
+
+import routes
+from app import create_app
+from config import ProductionConfig
+from models import db, User, Item, OfferedItem, RequestedItem, SearchTerm
+
+ITEMS = 100
+
+
+def seed():
+    user = User(username='bench', email='bench@example.com', password='x')
+    others = [User(username='trader%d' % n, email='trader%d@example.com' % n, password='x') for n in range(5)]
+    for n in range(ITEMS):
+        item = Item(title='Bench Widget %03d' % n, condition='Used', image_url='https://example.com/%d.jpg' % n)
+        db.session.add_all([OfferedItem(user=user, item=item), RequestedItem(user=user, item=item)])
+        db.session.add_all(OfferedItem(user=other, item=item) for other in others[:n % 6])
+    db.session.add(SearchTerm(term='bench widget', last_refreshed=datetime.now(), item_count=ITEMS))
+    db.session.commit()
+    return user.id
+
+
+def time_renders(app, user_id, url, requests):
+    timings = []
+    started = {}
+
+    def before(sender, template, context, **extra):
+        started['at'] = time.perf_counter()
+
+    def after(sender, template, context, **extra):
+        timings.append((time.perf_counter() - started['at']) * 1000)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['curr_user'] = user_id
+    with before_render_template.connected_to(before, app), template_rendered.connected_to(after, app):
+        for _ in range(requests + 1):
+            assert client.get(url).status_code == 200
+    # The first render fills the cache; report the rest.
+    return timings[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench_fragments.db')
+
+    print('%-10s %-8s %10s %10s' % ('page', 'cache', 'p50 ms', 'p95 ms'))
+    for size in (0, 4096):
+        class BenchConfig(ProductionConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + database
+            SECRET_KEY = 'bench'
+            FRAGMENT_CACHE_SIZE = size
+            SEARCH_REFRESH_TTL = 86400
+
+        app = create_app(BenchConfig)
+        with app.app_context():
+            db.create_all()
+            user_id = db.session.scalar(db.select(User.id).where(User.username == 'bench')) or seed()
+
+        # Search pages normally show 10 results.
+        original = routes.search_items
+        routes.search_items = lambda term, limit=10: original(term, limit=ITEMS)
+        try:
+            for page, url in (('profile', '/user/%d' % user_id), ('search', '/items/search?q=bench widget')):
+                timings = time_renders(app, user_id, url, args.requests)
+                print('%-10s %-8s %10.2f %10.2f' % (page, 'on' if size else 'off', statistics.median(timings),
+                                                   statistics.quantiles(timings, n=20)[-1]))
+        finally:
+            routes.search_items = original
+
+
+if __name__ == '__main__':
+    main()
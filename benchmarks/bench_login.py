@@ -0,0 +1,82 @@
+"""Login throughput at different password-hashing pool sizes.
+
+Runs User.authenticate() from a fixed number of concurrent client threads
+(standing in for gthread workers) against a throwaway SQLite database:
+
+    python benchmarks/bench_login.py --pool-sizes 1 2 4 8 --clients 16 --rounds 12
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from models import db, User
+from passwords import password_hasher
+
+
+def run(app, clients, logins_per_client):
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients)
+
+    def client():
+        barrier.wait()
+        for _ in range(logins_per_client):
+            start = time.perf_counter()
+            with app.app_context():
+                assert User.authenticate('bench', 'password')
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return len(latencies) / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=4, help='logins per client')
+    parser.add_argument('--rounds', type=int, default=12)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_login.db')
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    app.config['PASSWORD_HASH_QUEUE'] = args.clients
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = None
+    db.init_app(app)
+    hasher = password_hasher.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        User.signup(username='bench', email='bench@example.com', password='password')
+        db.session.commit()
+
+    print('cost %d, %d clients, %d cpus' % (args.rounds, args.clients, os.cpu_count()))
+    print('%-6s %10s %10s %10s' % ('pool', 'logins/s', 'p50 ms', 'p95 ms'))
+    for size in args.pool_sizes:
+        hasher.shutdown()
+        hasher.workers = size
+        throughput, p50, p95 = run(app, args.clients, args.logins)
+        print('%-6d %10.1f %10.1f %10.1f' % (size, throughput, p50, p95))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Matching engine latency on a synthetic listing graph.
+
+Builds a MatchIndex directly (no database) from random offered/requested
+listings with skewed item popularity, then times direct_matches() and
+trade_cycles() for random users:
+
+    python benchmarks/bench_matching.py --listings 1000000 --users 100000 --items 200000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matching import MatchIndex
+
+
+def build(rng, listings, users, items):
+    index = MatchIndex()
+    # Item ids drawn from a Pareto-ish curve so a few items are very popular.
+    weights = [1.0 / (rank + 1) ** 0.8 for rank in range(items)]
+    picks = rng.choices(range(items), weights=weights, k=listings)
+    for n, item_id in enumerate(picks):
+        user_id = rng.randrange(users)
+        if n % 2:
+            index.add_offer(user_id, item_id)
+        else:
+            index.add_request(user_id, item_id)
+    return index
+
+
+def time_calls(fn, user_ids):
+    timings = []
+    found = 0
+    for user_id in user_ids:
+        start = time.perf_counter()
+        found += bool(fn(user_id))
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1], found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--listings', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    index = build(rng, args.listings, args.users, args.items)
+    print('built %d listings over %d users / %d items in %.1fs'
+          % (args.listings, args.users, args.items, time.perf_counter() - start))
+
+    user_ids = [rng.randrange(args.users) for _ in range(args.queries)]
+    print('%-22s %10s %10s %10s' % ('query', 'p50 ms', 'p95 ms', 'hits'))
+    for name, fn in (
+        ('direct_matches', index.direct_matches),
+        ('trade_cycles len<=3', lambda user_id: index.trade_cycles(user_id, max_length=3)),
+        ('trade_cycles len<=4', lambda user_id: index.trade_cycles(user_id, max_length=4)),
+    ):
+        p50, p95, found = time_calls(fn, user_ids)
+        print('%-22s %10.3f %10.3f %10d' % (name, p50, p95, found))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""findItemsAdvanced parsing: the SDK's response objects vs the streaming parser.
+
+Parses the recorded fixture (15 items) and a full 100-item page built from
+it, reporting time per page and peak memory for each path:
+
+    python benchmarks/bench_parse.py --repeat 200
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ebaysdk.finding import Connection as finding
+from ebaysdk.response import Response, ResponseDataObject
+
+from ebay_24 import Ebay_24, iter_listings
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'tests', 'fixtures', 'find_items_advanced.xml')
+
+
+def full_page(body, size):
+    """The fixture's items repeated to `size` entries."""
+    items = re.findall(rb'<item>.*?</item>', body, re.S)
+    page = b''.join(items[n % len(items)] for n in range(size))
+    start = body.index(b'<item>')
+    end = body.rindex(b'</item>') + len(b'</item>')
+    return body[:start] + page + body[end:]
+
+
+def sdk_parse(api, ebay, body):
+    """What execute() and parse() do with a response body."""
+    api.verb = 'findItemsAdvanced'
+    api._resp_body_errors = []
+    api.response = Response(ResponseDataObject({'content': body}, []), verb=api.verb,
+                            list_nodes=api.base_list_nodes, datetime_nodes=api.datetime_nodes)
+    api._get_resp_body_errors()
+    return ebay.parse(api.response)
+
+
+def stream_parse(body):
+    return list(iter_listings(BytesIO(body)))
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(FIXTURE, 'rb') as fh:
+        fixture = fh.read()
+    api = finding(appid='bench', config_file=None)
+    ebay = Ebay_24('bench', 'switch')
+
+    print('%-18s %-7s %10s %10s %8s' % ('response', 'parser', 'p50 ms', 'peak KiB', 'items'))
+    for name, body in (('fixture (15)', fixture), ('full page (100)', full_page(fixture, 100))):
+        assert stream_parse(body) == sdk_parse(api, ebay, body)
+        for label, fn in (('sdk', lambda: sdk_parse(api, ebay, body)), ('stream', lambda: stream_parse(body))):
+            p50, peak = measure(fn, args.repeat)
+            print('%-18s %-7s %10.3f %10.1f %8d' % (name, label, p50, peak, len(fn())))
+
+
+if __name__ == '__main__':
+    main()
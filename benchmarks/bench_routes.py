@@ -0,0 +1,200 @@
+"""Latency, throughput and query counts for the main routes on seeded data.
+
+Drives the real Flask app through its test client against a database filled
+by seed_data.py, with eBay replaced by a stub that answers instantly. Each
+scenario logs in as random seeded users; query counts come from the
+Server-Timing header the SQL instrumentation adds. Results are printed (or
+written with --out) as JSON, tagged with the current git commit, so runs on
+different commits can be diffed:
+
+    python benchmarks/bench_routes.py --rows 100000 --requests 500 --out before.json
+    python benchmarks/bench_routes.py --url postgresql:///trade_bay_bench --rows 10000000
+
+An empty database is seeded with --rows first; a seeded one is reused as is.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import bench_search
+import seed_data
+
+SCENARIOS = ['search', 'profile', 'pending_trades', 'initiate_trade', 'accept_trade']
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class StubEbay(object):
+    """Stands in for Ebay_24: a page of made-up listings for any term, no network."""
+
+    def __init__(self, api_key, term, cache=None, **kwargs):
+        self.term = term
+
+    def fetch(self):
+        return [{'title': '%s listing %d' % (self.term, n), 'condition': 'Used', 'image_url': None}
+                for n in range(10)]
+
+    def fetch_many(self, keywords=None, pages=1, per_page=100, max_workers=4):
+        return iter(self.fetch())
+
+
+def percentile(timings, p):
+    return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+
+class Runner(object):
+    def __init__(self, app, db, rng):
+        from models import User, OfferedItem, Trade
+
+        self.app = app
+        self.client = app.test_client()
+        self.rng = rng
+        self.user_ids = db.session.scalars(db.select(User.id)).all()
+        # (offered_item.id, user_id) pairs to build trades from.
+        self.offers = db.session.execute(db.select(OfferedItem.id, OfferedItem.user_id)).tuples().all()
+        # Pending trades with the user they were offered to, to accept each one once.
+        self.pending = db.session.execute(
+            db.select(Trade.id, Trade.recipient_id)
+            .where(Trade.status == 'Pending')
+        ).tuples().all()
+        rng.shuffle(self.pending)
+        self.terms = bench_search.queries(rng, 1000)
+
+    def login(self, user_id):
+        with self.client.session_transaction() as session:
+            session['curr_user'] = user_id
+
+    def search(self):
+        self.login(self.rng.choice(self.user_ids))
+        return self.client.get('/items/search', query_string={'q': self.rng.choice(self.terms)})
+
+    def profile(self):
+        self.login(self.rng.choice(self.user_ids))
+        return self.client.get('/user/%d' % self.rng.choice(self.user_ids))
+
+    def pending_trades(self):
+        self.login(self.rng.choice(self.user_ids))
+        return self.client.get('/user/pending-trades')
+
+    def initiate_trade(self):
+        mine, theirs = self.rng.choice(self.offers), self.rng.choice(self.offers)
+        while theirs[1] == mine[1]:
+            theirs = self.rng.choice(self.offers)
+        self.login(mine[1])
+        return self.client.post('/initiate-trade', json={'your_item_id': mine[0], 'their_item_id': theirs[0]})
+
+    def accept_trade(self):
+        if not self.pending:
+            raise SystemExit('Ran out of pending trades to accept; seed more rows or send fewer requests.')
+        trade_id, user_id = self.pending.pop()
+        self.login(user_id)
+        return self.client.post('/accept-trade/%d' % trade_id)
+
+    def run(self, name, requests, warmup):
+        scenario = getattr(self, name)
+        for _ in range(warmup):
+            scenario()
+
+        timings, queries, errors = [], [], 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            began = time.perf_counter()
+            response = scenario()
+            timings.append((time.perf_counter() - began) * 1000)
+            errors += response.status_code >= 500
+            match = QUERIES.search(', '.join(response.headers.getlist('Server-Timing')))
+            if match:
+                queries.append(int(match.group(1)))
+        elapsed = time.perf_counter() - start
+
+        timings.sort()
+        return {
+            'requests': requests,
+            'errors': errors,
+            'throughput_rps': round(requests / elapsed, 1),
+            'latency_ms': {'p50': round(percentile(timings, 0.5), 2),
+                           'p95': round(percentile(timings, 0.95), 2),
+                           'p99': round(percentile(timings, 0.99), 2)},
+            'queries': {'mean': round(statistics.mean(queries), 2) if queries else None,
+                        'max': max(queries) if queries else None},
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='database URL (default: temporary SQLite file)')
+    parser.add_argument('--rows', type=int, default=100000, help='rows to seed an empty database with')
+    parser.add_argument('--requests', type=int, default=300, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--inline-ingest', action='store_true',
+                        help='refresh searches inside the request (through the eBay stub) instead of queueing them')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='write the JSON report here instead of printing it')
+    args = parser.parse_args()
+
+    url = args.url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_routes.db')
+    # app.py reads these at import time.
+    os.environ['SUPABASE_DB_URL'] = url
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ['INGEST_INLINE'] = 'true' if args.inline_ingest else 'false'
+
+    import ingest
+    ingest.Ebay_24 = StubEbay
+    from app import app
+    from models import db, User
+
+    app.config['DEBUG_TB_ENABLED'] = False
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        db.create_all()
+        if db.session.execute(db.select(User.id).limit(1)).first() is None:
+            seed_data.seed(args.rows, rng, log=lambda line: print(line, file=sys.stderr))
+        runner = Runner(app, db, rng)
+        dialect = db.engine.dialect.name
+
+    # Outside any app context, so each request gets its own, as in production.
+    results = {}
+    for name in args.scenarios:
+        results[name] = runner.run(name, args.requests, args.warmup)
+        print('%-16s p50 %8.2f ms' % (name, results[name]['latency_ms']['p50']), file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'database': dialect,
+        'users': len(runner.user_ids),
+        'offered_items': len(runner.offers),
+        'seed': args.seed,
+        'inline_ingest': args.inline_ingest,
+        'python': sys.version.split()[0],
+        'scenarios': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
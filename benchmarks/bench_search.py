@@ -0,0 +1,106 @@
+"""Item search latency as the item table grows.
+
+Compares the old unindexed `ILIKE '%term%'` scan with search_items() at
+several table sizes:
+
+    python benchmarks/bench_search.py --sizes 10000 100000 1000000
+    python benchmarks/bench_search.py --url postgresql:///trade_bay_bench --sizes 10000 10000000
+
+Defaults to a throwaway SQLite file. Rows are added on top of what is
+already there, so sizes should be increasing.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from models import db, Item
+from search import search_items
+
+BRANDS = ['Nintendo', 'Sony', 'Microsoft', 'Apple', 'Samsung', 'Canon', 'Nikon', 'Bose',
+          'Lego', 'Fender', 'Gibson', 'Dyson', 'KitchenAid', 'Patagonia', 'Levis', 'Garmin']
+PRODUCTS = ['Console', 'Controller', 'Headphones', 'Camera', 'Lens', 'Guitar', 'Amplifier',
+            'Jacket', 'Watch', 'Tablet', 'Phone', 'Speaker', 'Mixer', 'Vacuum', 'Set', 'Charger']
+EXTRAS = ['Black', 'White', 'Red', 'Blue', 'Bundle', 'Boxed', 'Refurbished', 'Vintage',
+          'Limited Edition', 'Large', 'Small', 'Travel', 'Pro', 'Mini', 'Max', 'Kit']
+CONDITIONS = ['New', 'Used', 'Open box', 'For parts or not working']
+
+
+def make_title(rng, n):
+    return '%s %s %s %s-%05d' % (rng.choice(BRANDS), rng.choice(PRODUCTS),
+                                 rng.choice(EXTRAS), rng.choice('ABCDEFGHJK'), n % 100000)
+
+
+def seed(rng, start, stop, batch=10000):
+    for first in range(start, stop, batch):
+        rows = [{'title': make_title(rng, n), 'condition': CONDITIONS[n % 4] + ' #%d' % n,
+                 'image_url': None} for n in range(first, min(first + batch, stop))]
+        db.session.execute(db.insert(Item), rows)
+        db.session.commit()
+
+
+def queries(rng, count):
+    """A mix of selective (model number) and broad (brand + product) searches."""
+    terms = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            terms.append('%s-%05d' % (rng.choice('ABCDEFGHJK'), rng.randrange(100000)))
+        else:
+            terms.append('%s %s' % (rng.choice(BRANDS).lower(), rng.choice(PRODUCTS).lower()))
+    return terms
+
+
+def scan(term, limit=10):
+    return Item.query.filter(Item.title.ilike(f'%{term}%')).limit(limit).all()
+
+
+def time_queries(fn, terms):
+    timings = []
+    for term in terms:
+        start = time.perf_counter()
+        fn(term)
+        db.session.rollback()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='database URL (default: temporary SQLite file)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    url = args.url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_search.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+
+    rng = random.Random(args.seed)
+    terms = queries(rng, args.queries)
+
+    with app.app_context():
+        db.create_all()
+        print('%-10s %-8s %10s %10s' % ('rows', 'path', 'p50 ms', 'p95 ms'))
+        rows = Item.query.count()
+        for size in args.sizes:
+            if size > rows:
+                seed(rng, rows, size)
+                rows = size
+            for name, fn in (('scan', scan), ('indexed', search_items)):
+                p50, p95 = time_queries(fn, terms)
+                print('%-10d %-8s %10.2f %10.2f' % (rows, name, p50, p95))
+
+
+if __name__ == '__main__':
+    main()
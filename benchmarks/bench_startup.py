@@ -0,0 +1,72 @@
+"""Worker boot time: importing the app in each worker vs forking a preloaded one.
+
+"import" starts a fresh interpreter that imports app.py and serves one
+request, as every gunicorn worker does without --preload. "fork" imports
+the app once, then forks children that each serve one request, as workers
+do with --preload. Times are from process start (or fork) to the response:
+
+    python benchmarks/bench_startup.py --repeat 10
+    python benchmarks/bench_startup.py --root /path/to/older/checkout
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVE_ONE = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, %r)
+from app import app
+app.test_client().get('/health')
+print(time.perf_counter() - start)
+"""
+
+
+def time_imports(root, env, repeat):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', SERVE_ONE % root], env=env, cwd=root)
+        timings.append(float(output.decode().split()[-1]) * 1000)
+    return timings
+
+
+def time_forks(root, repeat):
+    sys.path.insert(0, root)
+    from app import app
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            app.test_client().get('/health')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default=ROOT, help='checkout to measure (default: this one)')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench_startup.db')
+    os.environ.update(SUPABASE_DB_URL='sqlite:///' + database, SECRET_KEY='bench', FLASK_ENV='production')
+
+    print('%-8s %10s %10s' % ('boot', 'p50 ms', 'max ms'))
+    for name, timings in (('import', time_imports(args.root, dict(os.environ), args.repeat)),
+                          ('fork', time_forks(args.root, args.repeat))):
+        print('%-8s %10.1f %10.1f' % (name, statistics.median(timings), max(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Seeded synthetic dataset: users, items, offered/requested lists and trades.
+
+`--rows` is the total across all tables, split roughly 2% users, 30% items,
+30% offered, 30% requested and 8% trades (10M rows gives 200k users with 15
+offers each). Item popularity is skewed so a few items are on many lists.
+The same seed always produces the same data:
+
+    python benchmarks/seed_data.py --rows 100000
+    python benchmarks/seed_data.py --url postgresql:///trade_bay_bench --rows 10000000
+
+The database must have no users yet. Every user's password is "password".
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from flask import Flask
+
+import bench_search
+from models import db, User, Item, OfferedItem, RequestedItem, Trade
+
+PASSWORD = 'password'
+SHARES = {'users': 0.02, 'items': 0.30, 'offered': 0.30, 'requested': 0.30, 'trades': 0.08}
+STATUSES = ['Pending'] * 12 + ['Accepted'] * 5 + ['Rejected'] * 3
+
+
+def plan(rows):
+    """How many rows of each kind make up `rows` in total."""
+    counts = {name: int(rows * share) for name, share in SHARES.items()}
+    counts['users'] = max(counts['users'], 10)
+    return counts
+
+
+def _insert(model, rows):
+    if rows:
+        db.session.execute(db.insert(model), rows)
+        db.session.commit()
+
+
+def _id_range(model):
+    low, high = db.session.execute(db.select(db.func.min(model.id), db.func.max(model.id))).one()
+    return low, high
+
+
+def seed_users(count, batch):
+    # Hashing once keeps seeding fast; the cost factor doesn't matter for these tests.
+    password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode()
+    for first in range(0, count, batch):
+        _insert(User, [{'username': 'user%d' % n, 'email': 'user%d@example.com' % n, 'password': password}
+                       for n in range(first, min(first + batch, count))])
+
+
+def seed_lists(rng, model, count, users, items, batch):
+    """`count` entries spread evenly over users, each user's items distinct."""
+    per_user = max(1, count // (users[1] - users[0] + 1))
+    item_count = items[1] - items[0] + 1
+    rows = []
+    written = 0
+    for user_id in range(users[0], users[1] + 1):
+        # Squaring a uniform draw favours low ids: a long tail of unpopular items.
+        picked = {items[0] + int(item_count * rng.random() ** 2) for _ in range(per_user)}
+        rows.extend({'user_id': user_id, 'item_id': item_id} for item_id in sorted(picked))
+        if len(rows) >= batch:
+            _insert(model, rows)
+            written += len(rows)
+            rows = []
+        if written + len(rows) >= count:
+            break
+    _insert(model, rows)
+
+
+def seed_trades(rng, count, requested, batch):
+    """`count` trades shaped like the ones initiate_trade makes.
+
+    Each starts from a requested row: its user is the initiator, giving one
+    of their own offers, and the recipient is another user offering the
+    requested item. Requests nobody else offers are skipped."""
+    offerers = defaultdict(list)  # item id -> ids of users offering it
+    offers = defaultdict(list)    # user id -> ids of their offered rows
+    for row_id, user_id, item_id in db.session.execute(
+            db.select(OfferedItem.id, OfferedItem.user_id, OfferedItem.item_id)
+            .execution_options(yield_per=batch)):
+        offerers[item_id].append(user_id)
+        offers[user_id].append(row_id)
+
+    now = datetime.now()
+    written = 0
+    # Give up on a dataset where hardly any request can become a trade.
+    for _ in range(20 * count // batch + 1):
+        if written >= count:
+            break
+        ids = {rng.randint(*requested) for _ in range(batch)}
+        rows = []
+        for row_id, user_id, item_id in db.session.execute(
+                db.select(RequestedItem.id, RequestedItem.user_id, RequestedItem.item_id)
+                .where(RequestedItem.id.in_(ids))):
+            recipients = [other for other in offerers.get(item_id, ()) if other != user_id]
+            if not recipients or not offers.get(user_id):
+                continue
+            rows.append({
+                'item_offered_id': rng.choice(offers[user_id]),
+                'item_requested_id': row_id,
+                'recipient_id': rng.choice(recipients),
+                'status': rng.choice(STATUSES),
+                'created_at': now - timedelta(seconds=rng.randrange(90 * 24 * 3600)),
+            })
+        rows = rows[:count - written]
+        _insert(Trade, rows)
+        written += len(rows)
+    return written
+
+
+def seed(rows, rng, batch=10000, log=print):
+    """Fill the current app's database with about `rows` rows. Returns the counts."""
+    if db.session.execute(db.select(User.id).limit(1)).first() is not None:
+        raise SystemExit('The database already has users; seed an empty one.')
+
+    counts = plan(rows)
+    steps = [
+        ('users', lambda: seed_users(counts['users'], batch)),
+        ('items', lambda: bench_search.seed(rng, 0, counts['items'], batch)),
+        ('offered', lambda: seed_lists(rng, OfferedItem, counts['offered'], _id_range(User),
+                                       _id_range(Item), batch)),
+        ('requested', lambda: seed_lists(rng, RequestedItem, counts['requested'], _id_range(User),
+                                         _id_range(Item), batch)),
+        ('trades', lambda: seed_trades(rng, counts['trades'], _id_range(RequestedItem), batch)),
+    ]
+    for name, step in steps:
+        start = time.perf_counter()
+        written = step()
+        # Trades are only made where a real offer pair exists, so there can be fewer.
+        if written is not None:
+            counts[name] = written
+        log('%-10s %10d rows in %.1fs' % (name, counts[name], time.perf_counter() - start))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='database URL (default: temporary SQLite file)')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    url = args.url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_data.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        seed(args.rows, random.Random(args.seed), args.batch)
+    print('seeded %s' % url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""Response cache for eBay searches.
+
+Entries are keyed on the normalized search term. A fresh entry is served
+as-is; an entry past its TTL but still inside the stale window is served
+immediately while a background thread refreshes it (stale-while-revalidate).
+Misses go through a SingleFlight so only one upstream call per term is in
+flight at a time.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from extensions import AppLocal
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+def normalize_term(term):
+    """Normalize a search term so equivalent searches share one cache entry."""
+
+    return ' '.join(term.casefold().split())
+
+
+class MemoryBackend(object):
+    """Bounded in-process LRU store."""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return `(value, stored_at)` for `key`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend(object):
+    """LRU store in a SQLite file, shared by every worker on the host.
+
+    Values must be JSON serializable.
+    """
+
+    def __init__(self, path, max_size=1024):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, or with a
+        # forked worker, so each thread of each process opens its own on first use.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entry ('
+                ' key TEXT PRIMARY KEY,'
+                ' value TEXT NOT NULL,'
+                ' stored_at REAL NOT NULL,'
+                ' accessed_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT value, stored_at FROM cache_entry WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE cache_entry SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, stored_at, accessed_at)'
+            ' VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), stored_at, time.time())
+        )
+        conn.execute(
+            'DELETE FROM cache_entry WHERE key IN ('
+            ' SELECT key FROM cache_entry ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_size,)
+        )
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache_entry')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key into one.
+
+    The first caller for a key runs the function; everyone who arrives while
+    it is running waits and gets the same result (or exception). With
+    `lock_dir` set, the run also holds an exclusive lock file for the key so
+    only one process on the host calls upstream at a time.
+    """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def _run(self, key, fn):
+        if self.lock_dir is None or fcntl is None:
+            return fn()
+
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock'
+        with open(os.path.join(self.lock_dir, name), 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                return fn()
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class ResponseCache(object):
+    """TTL cache with stale-while-revalidate in front of a slow loader."""
+
+    def __init__(self, backend=None, ttl=300, stale_ttl=3600, clock=time.time, flight=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.flight = flight if flight is not None else SingleFlight()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from the app's `EBAY_CACHE_*` settings."""
+
+        config = app.config
+        if config.get('EBAY_CACHE_PATH'):
+            self.backend = SQLiteBackend(config['EBAY_CACHE_PATH'], max_size=config['EBAY_CACHE_SIZE'])
+        else:
+            self.backend = MemoryBackend(max_size=config['EBAY_CACHE_SIZE'])
+
+        self.ttl = config['EBAY_CACHE_TTL']
+        self.stale_ttl = config['EBAY_CACHE_STALE_TTL']
+        self.flight = SingleFlight(lock_dir=config.get('EBAY_CACHE_LOCK_DIR'))
+
+    def get_or_load(self, term, loader):
+        """Return the cached value for `term`, calling `loader()` on a miss.
+
+        `loader` may run on a background thread, so it must not depend on
+        request or app context. A None result is never cached.
+        """
+
+        key = normalize_term(term)
+        entry = self.backend.get(key)
+
+        if entry is not None:
+            value, stored_at = entry
+            age = self.clock() - stored_at
+            if age < self.ttl:
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._refresh_in_background(key, loader)
+                return value
+
+        return self._load(key, loader)
+
+    def invalidate(self, term):
+        self.backend.delete(normalize_term(term))
+
+    def _load(self, key, loader):
+        return self.flight.do(key, lambda: self._load_once(key, loader))
+
+    def _load_once(self, key, loader):
+        # Another worker may have filled a shared backend while we waited for the lock.
+        entry = self.backend.get(key)
+        if entry is not None and self.clock() - entry[1] < self.ttl:
+            return entry[0]
+
+        value = loader()
+        if value is not None:
+            self.backend.set(key, value, self.clock())
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        thread = threading.Thread(target=self._refresh, args=(key, loader), daemon=True)
+        thread.start()
+
+    def _refresh(self, key, loader):
+        try:
+            self._load(key, loader)
+        except Exception:
+            # Keep serving the stale entry; the next stale hit retries.
+            log.exception("Background refresh failed for %r", key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+ebay_cache = AppLocal('ebay_cache', ResponseCache)
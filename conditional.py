@@ -0,0 +1,92 @@
+"""Conditional GETs for pages that are expensive to render.
+
+A view decorated with @conditional(validator) gets an ETag built from what
+`validator` returns: a few version counters and timestamps, fetched with
+one small query instead of the several the page itself needs. When the
+browser sends that ETag back in If-None-Match, it gets 304 Not Modified
+before the view runs. The validator returns None when it can't vouch for
+the page (nobody logged in, a refresh about to be queued, and so on), and
+the view then runs as usual without an ETag.
+
+Every page includes the nav bar, so validators include the viewer's
+User.version along with whatever the page itself shows. It is read from
+the database whenever g.user came from the identity cache, which may not
+have seen a change made through another worker yet.
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+
+from identity import identity_cache
+from models import db, User
+
+# The same in every worker forked from a preloaded app, and new on each
+# deploy, so pages rendered by an older template are never reused.
+STARTED = repr(time.time())
+
+
+def make_etag(parts):
+    salt = current_app.config.get('ETAG_SALT') or STARTED
+    return hashlib.sha1(repr((salt, request.full_path, parts)).encode()).hexdigest()
+
+
+def conditional(validator, max_age_setting=None):
+    """Answer GETs of the decorated view with 304 when `validator` says nothing changed.
+
+    `validator` takes the view's arguments. Pages are private to the
+    viewer; browsers revalidate them on every visit, or reuse them for the
+    number of seconds in the `max_age_setting` config key."""
+
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # A pending flash message would be lost on a 304.
+            parts = None if session.get('_flashes') else validator(*args, **kwargs)
+            if parts is None:
+                return view(*args, **kwargs)
+
+            etag = make_etag(parts)
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            max_age = current_app.config[max_age_setting] if max_age_setting else 0
+            response.headers['Cache-Control'] = 'private, max-age=%d' % max_age if max_age else 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorate
+
+
+def user_versions(*user_ids):
+    """Version counters of the viewer and `user_ids`; None if nobody is logged in or a user is missing.
+
+    Other users are loaded whole in one query, so if the page has to be
+    rendered after all the view finds them in the session. The viewer's
+    version comes from g.user if it was just loaded, and from the same query
+    if the identity cache served it."""
+
+    if g.user == None:
+        return None
+
+    ids = set(user_ids) - {g.user.id}
+    versions = {g.user.id: g.user.version}
+    wanted = ids | {g.user.id} if identity_cache.is_cached(g.user) else ids
+    users = []
+    if wanted:
+        # The version column, not user.version: a user already in the session keeps its old values.
+        for user, version in db.session.execute(db.select(User, User.version).where(User.id.in_(wanted))):
+            versions[user.id] = version
+            users.append(user)
+    if not ids <= versions.keys():
+        return None
+    # The session only holds weak references; keep the users for the rest of the request.
+    g._validated_users = users
+    return tuple(sorted(versions.items()))
@@ -0,0 +1,144 @@
+"""Settings for each environment.
+
+create_app() picks one by name (`development`, `testing` or `production`),
+defaulting to FLASK_ENV. Values come from environment variables, read when
+this module is imported.
+"""
+
+import os
+
+
+def _bool(name, default):
+    return os.getenv(name, 'true' if default else 'false').lower() == 'true'
+
+
+class Config(object):
+    SQLALCHEMY_DATABASE_URI = os.getenv('SUPABASE_DB_URL', 'postgresql:///trade_bay')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.getenv('SECRET_KEY')
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # Connection pool per worker process (POOL_TIMEOUT and POOL_RECYCLE in seconds),
+    # and a limit on any one statement (0 for none). DB_PGBOUNCER is for a
+    # PgBouncer in transaction mode: no app-side pool, timeout set per transaction.
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = _bool('DB_POOL_PRE_PING', True)
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+    DB_PGBOUNCER = _bool('DB_PGBOUNCER', False)
+
+    # Optional read replica for @read_only views (see database.py). For
+    # DB_REPLICA_STICKY seconds after a browser's request wrote, its reads stay on the primary.
+    DATABASE_REPLICA_URL = os.getenv('REPLICA_DB_URL')
+    DB_REPLICA_STICKY = int(os.getenv('DB_REPLICA_STICKY', 5))
+
+    EBAY_API_KEY = os.getenv('api_key')
+
+    # eBay search cache. Set EBAY_CACHE_PATH to share one SQLite cache between workers,
+    # and EBAY_CACHE_LOCK_DIR so only one worker at a time calls eBay for a given term.
+    EBAY_CACHE_TTL = int(os.getenv('EBAY_CACHE_TTL', 300))
+    EBAY_CACHE_STALE_TTL = int(os.getenv('EBAY_CACHE_STALE_TTL', 3600))
+    EBAY_CACHE_SIZE = int(os.getenv('EBAY_CACHE_SIZE', 256))
+    EBAY_CACHE_PATH = os.getenv('EBAY_CACHE_PATH')
+    EBAY_CACHE_LOCK_DIR = os.getenv('EBAY_CACHE_LOCK_DIR')
+
+    # eBay retries and circuit breaker: RETRIES extra tries per call with jittered
+    # exponential BACKOFF (seconds, capped at MAX_BACKOFF); after BREAKER_THRESHOLD
+    # failed calls in a row, calls fail fast for BREAKER_RESET seconds.
+    EBAY_RETRIES = int(os.getenv('EBAY_RETRIES', 2))
+    EBAY_BACKOFF = float(os.getenv('EBAY_BACKOFF', 0.2))
+    EBAY_MAX_BACKOFF = float(os.getenv('EBAY_MAX_BACKOFF', 2))
+    EBAY_BREAKER_THRESHOLD = int(os.getenv('EBAY_BREAKER_THRESHOLD', 5))
+    EBAY_BREAKER_RESET = float(os.getenv('EBAY_BREAKER_RESET', 30))
+
+    # Background eBay ingestion. Searches for a term fetched within SEARCH_REFRESH_TTL
+    # seconds don't queue a refresh. INGEST_INLINE runs refreshes inside the request,
+    # for development without a `flask ingest-worker` process.
+    SEARCH_REFRESH_TTL = int(os.getenv('SEARCH_REFRESH_TTL', 3600))
+    INGEST_INLINE = _bool('INGEST_INLINE', False)
+    INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', 3))
+    # Result pages the worker fetches per term; more than one are fetched in parallel.
+    INGEST_PAGES = int(os.getenv('INGEST_PAGES', 3))
+
+    # Seconds a browser may reuse a search page without asking (other pages are revalidated
+    # on every visit, see conditional.py). ETAG_SALT, e.g. the release id, keeps ETags valid
+    # across restarts; by default they change whenever the app is started.
+    SEARCH_CACHE_MAX_AGE = int(os.getenv('SEARCH_CACHE_MAX_AGE', 60))
+    ETAG_SALT = os.getenv('ETAG_SALT')
+
+    # Rendered template fragments ({% cache %}, see fragments.py) kept per worker, or shared
+    # by the workers on a host in a SQLite file at FRAGMENT_CACHE_PATH. A size of 0 disables it.
+    FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 2048))
+    FRAGMENT_CACHE_PATH = os.getenv('FRAGMENT_CACHE_PATH')
+
+    # Where `flask build-assets` puts the hashed static files, under the static folder, and
+    # how long browsers keep them (see assets.py).
+    ASSETS_DIR = 'build'
+    ASSETS_MAX_AGE = int(os.getenv('ASSETS_MAX_AGE', 365 * 24 * 3600))
+
+    # bcrypt work factor and the size of the pool hashing runs on.
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 4))
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 16))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 0.5))
+
+    # Matching engine: how often each worker rebuilds its index from the database,
+    # and the longest trade cycle a client may ask for.
+    MATCH_INDEX_TTL = int(os.getenv('MATCH_INDEX_TTL', 300))
+    MATCH_MAX_CYCLE_LENGTH = int(os.getenv('MATCH_MAX_CYCLE_LENGTH', 5))
+
+    # Share of title words two items need in common for `flask merge-duplicates` to merge them.
+    ITEM_MERGE_THRESHOLD = float(os.getenv('ITEM_MERGE_THRESHOLD', 0.8))
+
+    # Per-request SQL stats: log requests slower than SQL_SLOW_REQUEST_MS or running more
+    # than SQL_QUERY_WARN statements, and any statement repeated SQL_REPEAT_WARN times.
+    # SQL_STRICT turns query-budget overruns and repeats into errors (on under tests).
+    SQL_SLOW_REQUEST_MS = int(os.getenv('SQL_SLOW_REQUEST_MS', 500))
+    SQL_QUERY_WARN = int(os.getenv('SQL_QUERY_WARN', 30))
+    SQL_REPEAT_WARN = int(os.getenv('SQL_REPEAT_WARN', 5))
+    SQL_STRICT = _bool('SQL_STRICT', False)
+
+    # Directory where each worker writes its metrics for /metrics to merge (unset: this process only).
+    METRICS_DIR = os.getenv('METRICS_DIR')
+
+    # Live trade events (/user/events): how often each worker polls for new ones, how often
+    # an idle stream sends a keep-alive, how long browsers wait to reconnect, and how long
+    # events are kept for reconnecting browsers to catch up on (all seconds but RETRY_MS).
+    # Each worker holds at most EVENTS_MAX_STREAMS streams open; gunicorn.conf.py adds
+    # that many threads to each worker for them.
+    EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', 1))
+    EVENTS_HEARTBEAT = float(os.getenv('EVENTS_HEARTBEAT', 15))
+    EVENTS_RETRY_MS = int(os.getenv('EVENTS_RETRY_MS', 3000))
+    EVENTS_RETENTION = int(os.getenv('EVENTS_RETENTION', 86400))
+    EVENTS_MAX_STREAMS = int(os.getenv('EVENTS_MAX_STREAMS', 8))
+
+    # Seconds to reuse a loaded user across requests in the same worker (0 disables).
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 0))
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    DATABASE_REPLICA_URL = None
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 4))
+    SQL_STRICT = _bool('SQL_STRICT', True)
+    # Each test starts from an empty database, where ids and versions repeat.
+    FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 0))
+
+
+class ProductionConfig(Config):
+    pass
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
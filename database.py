@@ -0,0 +1,134 @@
+"""Engine settings and read-replica routing.
+
+init_app() turns the DB_* settings into Flask-SQLAlchemy engine options
+(pool size, overflow, recycle, pre-ping, statement timeout) for the
+primary, and builds an engine with the same settings for
+DATABASE_REPLICA_URL if it is set. It has to run before db.init_app().
+With DB_PGBOUNCER the app keeps no pool of its own (PgBouncer is the pool)
+and the statement timeout is set per transaction, since PgBouncer in
+transaction mode can't pass connection options through.
+
+Views marked @read_only send their SELECTs to the replica. Everything else
+goes to the primary: writes, SELECT ... FOR UPDATE, other raw SQL, and any
+read after the request has written. For DB_REPLICA_STICKY seconds after a
+request that wrote, the same browser reads from the primary too, so users
+see their own changes despite replication lag.
+"""
+
+import time
+
+from flask import g, has_request_context, current_app, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm.context import FromStatement
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.elements import TextClause
+
+REPLICA = 'replica'
+STICKY_KEY = '_primary_until'
+
+
+def read_only(view):
+    """Let the view's reads go to the read replica."""
+
+    view.read_only = True
+    return view
+
+
+def engine_options(config, url):
+    """Keyword arguments for create_engine() for `url`, from the DB_* settings."""
+
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        # A local file: Flask-SQLAlchemy picks the pool, and there's no statement timeout.
+        return {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+
+    if config['DB_PGBOUNCER']:
+        # PgBouncer (transaction mode) does the pooling; see prepare_engine() for the timeout.
+        return {'poolclass': NullPool}
+
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % timeout}
+    return options
+
+
+def init_app(app):
+    config = app.config
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(engine_options(config, config['SQLALCHEMY_DATABASE_URI']),
+                                               **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        # Not a Flask-SQLAlchemy bind: no model lives there, and create_all() must not touch it.
+        app.extensions[REPLICA] = create_engine(replica_url, **engine_options(config, replica_url))
+
+    app.before_request(_choose_route)
+    app.after_request(_remember_write)
+
+
+def engines(app):
+    """Every engine the app uses, the replica included. Needs an app context."""
+
+    found = list(app.extensions['sqlalchemy'].engines.values())
+    if REPLICA in app.extensions:
+        found.append(app.extensions[REPLICA])
+    return found
+
+
+def prepare_engine(engine, config):
+    """Per-engine setup that can't be expressed as create_engine() options."""
+
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and config['DB_PGBOUNCER'] and engine.dialect.name == 'postgresql':
+        # SET LOCAL lasts until the transaction ends, so it never leaks to
+        # whichever client PgBouncer hands the server connection to next.
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql('SET LOCAL statement_timeout = %d' % timeout)
+
+
+class RoutingSession(Session):
+    """Session that sends a read-only view's SELECTs to the replica engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or getattr(clause, 'is_dml', False):
+                # Later reads in this request must see the write.
+                g._db_wrote = True
+                g._db_route = None
+            elif g.get('_db_route') == REPLICA and _is_read(clause):
+                return current_app.extensions[REPLICA]
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_read(clause):
+    if isinstance(clause, FromStatement):
+        clause = clause.element
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return getattr(clause, 'is_select', False) and clause._for_update_arg is None
+
+
+def _choose_route():
+    g._db_wrote = False
+    g._db_route = None
+    if REPLICA not in current_app.extensions:
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if getattr(view, 'read_only', False) and session.get(STICKY_KEY, 0) < time.time():
+        g._db_route = REPLICA
+
+
+def _remember_write(response):
+    sticky = current_app.config.get('DB_REPLICA_STICKY', 0)
+    if g.get('_db_wrote') and sticky and REPLICA in current_app.extensions:
+        session[STICKY_KEY] = time.time() + sticky
+    return response
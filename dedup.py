@@ -0,0 +1,153 @@
+"""Finding and merging near-duplicate items.
+
+Item fingerprints already fold titles that differ only in case,
+punctuation or word order. Listings such as "Nintendo Switch OLED White"
+and "Nintendo Switch OLED White Edition" still become separate items,
+which splits the people offering and requesting them.
+
+find_duplicates() groups those with MinHash and locality-sensitive
+hashing. Each title becomes a short signature of `num_perm` minimum hashes
+over its words. The signature is cut into `bands`, and only items sharing
+a whole band, and the same condition, are compared. Candidates are then
+checked against the real word-set Jaccard similarity. This finds the
+similar pairs without comparing every item with every other one.
+
+merge() folds each group into its lowest id with a handful of bulk
+statements. `flask merge-duplicates` runs both.
+"""
+
+import random
+import zlib
+from collections import defaultdict
+from datetime import datetime
+
+from models import db, title_tokens, User, Item, OfferedItem, RequestedItem, Trade
+
+# A Mersenne prime larger than any crc32, for the (a * x + b) % PRIME permutations.
+PRIME = (1 << 61) - 1
+
+
+class MinHasher(object):
+    """MinHash signatures over sets of words, with `num_perm` fixed hash permutations."""
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(num_perm)]
+
+    def signature(self, words):
+        hashes = [zlib.crc32(word.encode()) for word in words]
+        return tuple(min((a * value + b) % PRIME for value in hashes) for a, b in self.permutations)
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+
+def find_duplicates(rows, threshold=0.8, num_perm=64, bands=16):
+    """Group the `(id, title, condition)` rows whose titles are near-duplicates.
+
+    Two items are duplicates when their conditions match and their titles
+    share at least `threshold` of their words. Duplicates of duplicates end
+    up in the same group. Returns lists of ids, sorted, one per group with
+    more than one item."""
+
+    if num_perm % bands:
+        raise ValueError("num_perm must be a multiple of bands")
+    rows_per_band = num_perm // bands
+    hasher = MinHasher(num_perm)
+
+    words = {}
+    buckets = defaultdict(list)
+    for item_id, title, condition in rows:
+        words[item_id] = frozenset(title_tokens(title))
+        if not words[item_id]:
+            continue
+        condition = ' '.join(title_tokens(condition or ''))
+        signature = hasher.signature(words[item_id])
+        for band in range(bands):
+            key = signature[band * rows_per_band:(band + 1) * rows_per_band]
+            buckets[condition, band, key].append(item_id)
+
+    parent = {}
+
+    def root(item_id):
+        while parent.get(item_id, item_id) != item_id:
+            item_id = parent[item_id]
+        return item_id
+
+    checked = set()
+    for candidates in buckets.values():
+        for i, first in enumerate(candidates):
+            for second in candidates[i + 1:]:
+                if (first, second) in checked:
+                    continue
+                checked.add((first, second))
+                if jaccard(words[first], words[second]) >= threshold:
+                    first_root, second_root = root(first), root(second)
+                    if first_root != second_root:
+                        parent[max(first_root, second_root)] = min(first_root, second_root)
+
+    groups = defaultdict(list)
+    for item_id in parent:
+        groups[root(item_id)].append(item_id)
+    for item_id in groups:
+        groups[item_id].append(item_id)
+    return sorted(sorted(set(group)) for group in groups.values())
+
+
+def merge(groups, connection=None):
+    """Fold each group of item ids into its lowest id.
+
+    Offered and requested rows are re-pointed at the surviving item. Where
+    a user already listed it, their duplicate row is removed instead, and
+    trades referring to that row move to the one that stays. The caller
+    commits. Returns the number of items removed."""
+
+    connection = connection or db.session
+    survivors = {item_id: min(group) for group in groups for item_id in group if item_id != min(group)}
+    if not survivors:
+        return 0
+
+    users = set()
+    for model, trade_column in ((OfferedItem, Trade.item_offered_id), (RequestedItem, Trade.item_requested_id)):
+        users |= _repoint(connection, model, trade_column, survivors)
+
+    # Invalidate the cached pages and fragments showing the merged items.
+    _execute(connection, db.update(Item).where(Item.id.in_(set(survivors.values())))
+             .values(updated_at=datetime.now()))
+    if users:
+        _execute(connection, db.update(User).where(User.id.in_(users)).values(version=User.version + 1))
+    _execute(connection, db.delete(Item).where(Item.id.in_(survivors)))
+    return len(survivors)
+
+
+def _repoint(connection, model, trade_column, survivors):
+    """Move `model` rows from the merged items to their survivors. Returns the users affected."""
+
+    rows = connection.execute(
+        db.select(model.id, model.user_id, model.item_id)
+        .where(model.item_id.in_(set(survivors) | set(survivors.values())))
+        .order_by(model.id)
+    ).all()
+
+    kept = {}      # (user id, surviving item id) -> id of the row that stays
+    replaced = {}  # id of a row to remove -> id of the row that stays
+    for row_id, user_id, item_id in rows:
+        key = (user_id, survivors.get(item_id, item_id))
+        if key in kept:
+            replaced[row_id] = kept[key]
+        else:
+            kept[key] = row_id
+
+    if replaced:
+        _execute(connection, db.update(Trade).where(trade_column.in_(replaced))
+                 .values({trade_column: db.case(replaced, value=trade_column)}))
+        _execute(connection, db.delete(model).where(model.id.in_(replaced)))
+    _execute(connection, db.update(model).where(model.item_id.in_(survivors))
+             .values(item_id=db.case(survivors, value=model.item_id)))
+
+    return {user_id for _, user_id, item_id in rows if item_id in survivors}
+
+
+def _execute(connection, statement):
+    connection.execute(statement.execution_options(synchronize_session=False))
@@ -1,65 +1,283 @@
 import os
-import datetime
+import logging
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
 from ebaysdk.exception import ConnectionError
+from lxml import etree
+
+from extensions import AppLocal
+from resilience import UpstreamGuard
 from ebaysdk.finding import Connection as finding
-from models import Item
 
 from dotenv import load_dotenv
 load_dotenv()
 API_KEY=os.getenv('api_key')
+# Point these at a stand-in server for offline testing.
+EBAY_DOMAIN=os.getenv('EBAY_DOMAIN', 'svcs.ebay.com')
+EBAY_HTTPS=os.getenv('EBAY_HTTPS', 'true').lower() != 'false'
+# Seconds to wait for a connection, and then for each read, on every eBay call.
+EBAY_CONNECT_TIMEOUT=float(os.getenv('EBAY_CONNECT_TIMEOUT', 3))
+EBAY_TIMEOUT=float(os.getenv('EBAY_TIMEOUT', 10))
+# 'stream' reads responses with iter_listings(); 'sdk' uses the SDK's response objects and parse().
+EBAY_PARSER=os.getenv('EBAY_PARSER', 'stream')
+
+NS = '{http://www.ebay.com/marketplace/search/v1/services}'
+
+# Each thread keeps its own finding connections (and their HTTP sessions),
+# so repeat calls reuse an open socket instead of connecting again.
+_local = threading.local()
+
+# Retries and circuit breaker shared by every Ebay_24 in the process; the app configures it.
+ebay_guard = AppLocal('ebay_guard', lambda: UpstreamGuard('EBAY'))
+
+log = logging.getLogger(__name__)
+
+# fetch_many's thread pools, by size. They live as long as the process, so
+# their threads, and the connections each keeps in _local, serve every call.
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(max_workers):
+    # Built on first use rather than at import, so a pool is never inherited across a fork.
+    with _executors_lock:
+        if max_workers not in _executors:
+            _executors[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ebay')
+        return _executors[max_workers]
+
+
+def _forget_executors():
+    global _executors_lock
+    # The pools' threads don't exist in a forked child.
+    _executors.clear()
+    _executors_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_executors)
+
+
+class KeepAliveFinding(finding):
+    """finding.Connection that leaves its HTTP session open between calls.
+
+    The SDK closes the session after every response, which throws away the
+    pooled socket and makes the next call connect (and handshake) again.
+    Retries are left to ebay_guard, so the session's own are turned off."""
+
+    def __init__(self, **kwargs):
+        super(KeepAliveFinding, self).__init__(**kwargs)
+        self.session.mount('http://', HTTPAdapter(max_retries=0))
+        self.session.mount('https://', HTTPAdapter(max_retries=0))
+
+    def process_response(self, parse_response=True):
+        close = self.session.close
+        self.session.close = lambda: None
+        try:
+            super(KeepAliveFinding, self).process_response(parse_response)
+        finally:
+            self.session.close = close
+
+    def send(self, verb, data):
+        """Send `verb` and return the HTTP response unread, to be parsed as it streams in.
+
+        Skips the SDK's own parsing and error check; the caller closes the response."""
+
+        self._reset()
+        self.build_request(verb, data, None)
+        return self.session.send(self.request, verify=True, proxies=self.proxies,
+                                 timeout=self.timeout, allow_redirects=True, stream=True)
+
+
+def iter_listings(source):
+    """Yield a `{'title', 'condition', 'image_url'}` dict per listing with an image.
+
+    `source` is a findItemsAdvanced response as a file-like object (such as a
+    streamed HTTP body) or a path. It is read incrementally and each <item>
+    is discarded once read, so memory stays flat however long the page is.
+    Raises ConnectionError if eBay reports a failure."""
+
+    ack = None
+    errors = []
+    try:
+        for _, elem in etree.iterparse(source, events=('end',), tag=(NS + 'item', NS + 'ack', NS + 'message')):
+            if elem.tag == NS + 'item':
+                listing = _listing(elem)
+                elem.clear()
+                # Drop the items already handled, not just their contents.
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+                if listing is not None:
+                    yield listing
+            elif elem.tag == NS + 'ack':
+                ack = elem.text
+            else:
+                errors.append(elem.text)
+    except etree.XMLSyntaxError as e:
+        raise ConnectionError('findItemsAdvanced: unreadable response (%s)' % e)
+
+    if ack not in ('Success', 'Warning'):
+        raise ConnectionError('findItemsAdvanced: %s' % ', '.join(errors or [str(ack)]))
+
+
+def _listing(item):
+    image_url = (item.findtext(NS + 'galleryURL')
+                 or item.findtext(NS + 'galleryInfoContainer/' + NS + 'galleryURL')
+                 or item.findtext(NS + 'pictureURLLarge'))
+    if not image_url:
+        return None
+    return {
+        'title': item.findtext(NS + 'title'),
+        'condition': item.findtext(NS + 'condition/' + NS + 'conditionDisplayName'),
+        'image_url': image_url,
+    }
+
 
 class Ebay_24(object):
-    def __init__(self, API_KEY, st):
+    def __init__(self, API_KEY, st, cache=None, domain=None, https=None, timeout=None, parser=None, guard=None):
         self.api_key = API_KEY
         self.st = st
+        self.cache = cache
+        self.domain = domain or EBAY_DOMAIN
+        self.https = EBAY_HTTPS if https is None else https
+        self.timeout = (EBAY_CONNECT_TIMEOUT, EBAY_TIMEOUT) if timeout is None else timeout
+        self.parser = parser or EBAY_PARSER
+        # Resolved now: fetch_many and the cache call it from threads without an app context.
+        self.guard = guard or ebay_guard._get_current_object()
+
 
-    
     def fetch(self):
+        """Return the listings for the search term, or None if eBay can't be reached.
+
+        Deduplication against the database is left to Item.bulk_ingest, which
+        does it in one query instead of one per listing."""
         try:
-            api = finding(appid=self.api_key, config_file=None)
-            response = api.execute('findItemsAdvanced', {'keywords': self.st,
-                                                         'outputSelector': ['GalleryInfo', 'PictureURLLarge']})
-            
-            items = []
-            for item in response.reply.searchResult.item:
-                if len(items) >= 10:  # Limit the items list to 10
-                    break
-                
-                title = item.title
-                condition = item.condition.conditionDisplayName if hasattr(item, 'condition') else None
-                # Try multiple image sources
-                image_url = None
-                if hasattr(item, 'galleryURL'):
-                    image_url = item.galleryURL
-                elif hasattr(item, 'galleryInfoContainer') and hasattr(item.galleryInfoContainer, 'galleryURL'):
-                    image_url = item.galleryInfoContainer.galleryURL[0]  # Use the first URL in the list
-                elif hasattr(item, 'pictureURLLarge'):
-                    image_url = item.pictureURLLarge
-                
-                # Check if the item already exists in the database
-                existing_item = Item.query.filter_by(title=title, condition=condition).first()
-                if not existing_item:
-                    if image_url:
-                        items.append({
-                            'title': title,
-                            'condition': condition,
-                            'image_url': image_url
-                        })
-
-            return items
-                
+            if self.cache is not None:
+                return self.cache.get_or_load(self.st, self.find_items)
+            return self.find_items()
+
+        except requests.RequestException as e:
+            log.warning("eBay search for %r failed: %s", self.st, e)
+
         except ConnectionError as e:
-            print(e)
-            print(e.response.dict())
+            if hasattr(e.response, 'dict'):
+                log.warning("eBay search for %r failed: %s %r", self.st, e, e.response.dict())
+            else:
+                log.warning("eBay search for %r failed: %s", self.st, e)
+
+    def find_items(self, keywords=None, page=None, per_page=None):
+        """Call findItemsAdvanced and return the parsed listings.
+
+        Searches for `keywords` (default: this search term), optionally for
+        one page of `per_page` results. Doesn't touch the database, so it is
+        safe to run outside a request (e.g. from the cache's background refresh).
+
+        Goes through the guard: failed calls are retried, and while eBay is
+        down this raises CircuitOpen without calling it."""
+        request = {'keywords': keywords or self.st,
+                   'outputSelector': ['GalleryInfo', 'PictureURLLarge']}
+        if page is not None:
+            request['paginationInput'] = {'pageNumber': page, 'entriesPerPage': per_page or 100}
+        return self.guard.call(self._find_items, request)
+
+    def _find_items(self, request):
+        if self.parser == 'sdk':
+            response = self.connection().execute('findItemsAdvanced', request)
+            return self.parse(response)
+
+        response = self.connection().send('findItemsAdvanced', request)
+        try:
+            if response.status_code != 200:
+                raise ConnectionError('findItemsAdvanced: %s' % response.reason, response)
+            response.raw.decode_content = True
+            return list(iter_listings(response.raw))
+        finally:
+            response.close()
+
+    def fetch_many(self, keywords=None, pages=1, per_page=100, max_workers=4):
+        """Yield listings for each of `keywords` (default: this search term) over `pages` result pages.
+
+        The keyword/page calls run on a pool of `max_workers` threads that is
+        kept for the life of the process, so each thread's connection is
+        reused from one call to the next. Listings are yielded as each page
+        arrives, so the order isn't fixed. A listing that turns up on several pages or keywords is yielded once. A call
+        that fails or takes longer than the timeout is skipped; if every call
+        fails, the last error is raised."""
+        calls = [(keyword, page) for keyword in (keywords or [self.st]) for page in range(1, pages + 1)]
+        seen = set()
+        succeeded = 0
+        error = None
+
+        futures = {_executor(max_workers).submit(self.find_items, keyword, page, per_page): (keyword, page)
+                   for keyword, page in calls}
+        try:
+            for future in as_completed(futures):
+                try:
+                    listings = future.result()
+                except (ConnectionError, requests.RequestException) as e:
+                    log.warning("eBay call for %r page %d failed: %s", *futures[future], e)
+                    error = e
+                    continue
+
+                succeeded += 1
+                for listing in listings:
+                    key = (listing['title'], listing['condition'])
+                    if key not in seen:
+                        seen.add(key)
+                        yield listing
+        finally:
+            # Drop calls that haven't started if the caller stops reading early.
+            for future in futures:
+                future.cancel()
+
+        if not succeeded and error is not None:
+            raise error
+
+    def connection(self):
+        """This thread's finding connection for our app id, domain and timeout."""
+        connections = getattr(_local, 'connections', None)
+        if connections is None:
+            connections = _local.connections = {}
+
+        key = (self.api_key, self.domain, self.https, self.timeout)
+        if key not in connections:
+            api = KeepAliveFinding(appid=self.api_key, config_file=None, domain=self.domain, timeout=self.timeout)
+            # The finding connection forces https; undo that when told to.
+            api.config.set('https', self.https, force=True)
+            connections[key] = api
+        return connections[key]
+
+    def parse(self, response):
+        """Turn a findItemsAdvanced response into a list of item dicts."""
+        listings = []
+        for item in response.reply.searchResult.item:
+            title = item.title
+            condition = item.condition.conditionDisplayName if hasattr(item, 'condition') else None
+            # Try multiple image sources
+            image_url = None
+            if hasattr(item, 'galleryURL'):
+                image_url = item.galleryURL
+            elif hasattr(item, 'galleryInfoContainer') and hasattr(item.galleryInfoContainer, 'galleryURL'):
+                image_url = item.galleryInfoContainer.galleryURL[0]  # Use the first URL in the list
+                # galleryURL carries a gallerySize attribute, so the text is under .value
+                image_url = getattr(image_url, 'value', image_url)
+            elif hasattr(item, 'pictureURLLarge'):
+                image_url = item.pictureURLLarge
+
+            if image_url:
+                listings.append({
+                    'title': title,
+                    'condition': condition,
+                    'image_url': image_url
+                })
 
-    def parse(self):
-        pass
+        return listings
 
 # main driver
 
 if __name__=='__main__':
     st = sys.argv[1]
     e = Ebay_24(API_KEY, st)
-    e.fetch()
-    e.parse()
\ No newline at end of file
+    print(e.find_items())
@@ -0,0 +1,194 @@
+"""Live trade notifications.
+
+Routes record a TradeEvent row in the same transaction as the trade change.
+Each worker process runs one poller thread, started when its first client
+connects and stopped when the last one leaves, that reads the new rows
+every `poll_interval` seconds and hands each to the queues of that user's
+connected clients. However many clients a worker serves, that is one query
+per interval, and since every worker reads the same table it works across
+gunicorn workers, on Postgres and SQLite alike.
+
+Every open stream holds one of its worker's threads until the browser goes
+away, so each worker takes at most `max_streams` of them and turns the rest
+away with TooManyStreams (see gunicorn.conf.py for the thread sizing).
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from extensions import AppLocal
+from models import db, TradeEvent
+
+log = logging.getLogger(__name__)
+
+
+class TooManyStreams(Exception):
+    """This worker already serves as many streams as it is allowed."""
+
+
+class Subscription(object):
+    """One connected client's queue of events."""
+
+    def __init__(self, user_id, max_size=100):
+        self.user_id = user_id
+        self.closed = False
+        self._events = queue.Queue(maxsize=max_size)
+
+    def get(self, timeout):
+        """The next event dict, or None if none came within `timeout` seconds."""
+
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put(self, event):
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            # Too slow to keep up: end its stream, and let it catch up with Last-Event-ID.
+            self.closed = True
+
+
+class TradeEvents(object):
+    """Per-process fan-out of TradeEvent rows to subscribed clients."""
+
+    # Postgres ids can commit out of order, so rows this recent are looked at
+    # again even if a higher id was already seen.
+    GRACE = timedelta(seconds=10)
+
+    def __init__(self, poll_interval=1.0, retention=86400, queue_size=100, max_streams=8):
+        self.app = None
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.queue_size = queue_size
+        self.max_streams = max_streams
+        self.last_id = None
+        self._recent = {}       # id -> created_at of events delivered within GRACE
+        self._subscribers = {}  # user id -> set of Subscriptions
+        self._lock = threading.Lock()
+        self._poller = None
+        self._pruned_at = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.get('EVENTS_POLL_INTERVAL', self.poll_interval)
+        self.retention = app.config.get('EVENTS_RETENTION', self.retention)
+        self.max_streams = app.config.get('EVENTS_MAX_STREAMS', self.max_streams)
+
+    def publish(self, user_id, trade, kind):
+        """Tell `user_id` about `trade`. Goes out once the caller commits."""
+
+        if kind not in TradeEvent.KINDS:
+            raise ValueError(f"Unknown trade event {kind!r}.")
+        db.session.add(TradeEvent(user_id=user_id, trade=trade, kind=kind))
+
+    def backlog(self, user_id, after):
+        """`user_id`'s events with ids above `after`, oldest first, for a reconnecting client."""
+
+        events = db.session.execute(
+            db.select(TradeEvent)
+            .where(TradeEvent.user_id == user_id, TradeEvent.id > after)
+            .order_by(TradeEvent.id)
+            .limit(self.queue_size)
+        ).scalars()
+        return [event.to_dict() for event in events]
+
+    def subscribe(self, user_id):
+        """Start queueing `user_id`'s new events. Needs an app context.
+
+        Raises TooManyStreams if the worker already has `max_streams` subscriptions."""
+
+        # Read every time: the poller may stop, and forget last_id, before the lock is taken.
+        latest = db.session.execute(db.select(db.func.max(TradeEvent.id))).scalar()
+        subscription = Subscription(user_id, self.queue_size)
+
+        with self._lock:
+            if sum(map(len, self._subscribers.values())) >= self.max_streams:
+                raise TooManyStreams()
+            if self.last_id is None:
+                # Only events from now on; older ones are what backlog() is for.
+                self.last_id = latest or 0
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_forever, name='trade-events', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def poll(self):
+        """Hand events that arrived since the last poll to their subscribers, in one query.
+
+        Returns how many events were delivered."""
+
+        if self.last_id is None:
+            return 0
+
+        cutoff = datetime.now() - self.GRACE
+        rows = db.session.execute(
+            db.select(TradeEvent)
+            .where(db.or_(TradeEvent.id > self.last_id, TradeEvent.created_at >= cutoff))
+            .order_by(TradeEvent.id)
+        ).scalars().all()
+
+        delivered = 0
+        with self._lock:
+            for row in rows:
+                if row.id in self._recent:
+                    continue
+                self._recent[row.id] = row.created_at
+                self.last_id = max(self.last_id, row.id)
+                event = row.to_dict()
+                for subscription in self._subscribers.get(row.user_id, ()):
+                    subscription.put(event)
+                delivered += 1
+            self._recent = {id: created_at for id, created_at in self._recent.items()
+                            if created_at is None or created_at >= cutoff}
+        return delivered
+
+    def prune(self):
+        """Delete events older than `retention` seconds."""
+
+        db.session.execute(db.delete(TradeEvent).where(
+            TradeEvent.created_at < datetime.now() - timedelta(seconds=self.retention)))
+        db.session.commit()
+
+    def _poll_forever(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._subscribers:
+                    # The next subscribe() starts a fresh poller from the latest event.
+                    self._poller = None
+                    self.last_id = None
+                    self._recent = {}
+                    return
+
+            try:
+                with self.app.app_context():
+                    self.poll()
+                    if time.monotonic() - self._pruned_at > 60:
+                        self._pruned_at = time.monotonic()
+                        self.prune()
+            except Exception:
+                log.exception("Polling for trade events failed")
+
+
+def format_event(event):
+    """`event` as a text/event-stream message."""
+
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (event['id'], event['kind'], json.dumps(event))
+
+
+trade_events = AppLocal('trade_events', TradeEvents)
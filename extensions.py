@@ -0,0 +1,54 @@
+"""Per-app instances of the shared helpers.
+
+Views import one module-level object per helper (ebay_cache, trade_events,
+...). Each is an AppLocal: init_app(app) builds a fresh instance for that
+app and keeps it in app.extensions, and attribute lookups go to the
+instance of the app in context. A second app, like the ones the tests
+build, gets its own settings, caches and threads instead of reconfiguring
+the first. Outside an app context lookups fall back to an unconfigured
+instance of the helper's own.
+"""
+
+import threading
+
+from flask import current_app, has_app_context
+
+
+class AppLocal(object):
+    """Proxy to the `name` instance of the app in context, made by `factory()`."""
+
+    def __init__(self, name, factory):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_default', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def init_app(self, app):
+        instance = self._factory()
+        instance.init_app(app)
+        app.extensions[self._name] = instance
+        return instance
+
+    def _get_current_object(self):
+        """The instance itself, for code that outlives the app context (e.g. a background thread)."""
+
+        if has_app_context():
+            instance = current_app.extensions.get(self._name)
+            if instance is not None:
+                return instance
+        with self._lock:
+            if self._default is None:
+                object.__setattr__(self, '_default', self._factory())
+            return self._default
+
+    def __getattr__(self, name):
+        return getattr(self._get_current_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_current_object(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._get_current_object(), name)
+
+    def __repr__(self):
+        return '<AppLocal %s>' % self._name
@@ -0,0 +1,89 @@
+"""Cached template fragments.
+
+    {% cache 'item-card', item.id, item.updated_at %} ... {% endcache %}
+
+renders the block once and reuses its HTML for as long as the version (the
+last argument) stays the same. An entry is stored under the fragment name
+and key along with the version it was rendered for, so a newer version
+replaces it instead of leaving the old HTML behind to be evicted. Routes
+that change what a fragment shows also drop it right away with
+invalidate(); other workers notice the new version on their next render.
+
+A fragment must look the same to everyone: nothing from g.user, no CSRF
+tokens. The backend is a bounded MemoryBackend per process, or one
+SQLiteBackend shared by the workers on a host when FRAGMENT_CACHE_PATH is set.
+"""
+
+import time
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import MemoryBackend, SQLiteBackend
+from extensions import AppLocal
+
+
+class FragmentCache(object):
+    """Rendered HTML by fragment name and key, tagged with its version. Disabled with a size of 0."""
+
+    def __init__(self, backend=None, clock=time.time):
+        self.backend = backend if backend is not None else MemoryBackend(max_size=1024)
+        self.clock = clock
+        self.enabled = True
+
+    def init_app(self, app):
+        """Configure from FRAGMENT_CACHE_* and enable `{% cache %}` in the app's templates."""
+
+        config = app.config
+        self.enabled = config['FRAGMENT_CACHE_SIZE'] > 0
+        if config.get('FRAGMENT_CACHE_PATH'):
+            self.backend = SQLiteBackend(config['FRAGMENT_CACHE_PATH'], max_size=config['FRAGMENT_CACHE_SIZE'])
+        else:
+            self.backend = MemoryBackend(max_size=config['FRAGMENT_CACHE_SIZE'])
+
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.extend(fragment_cache=self)
+
+    def render(self, name, key, version, render):
+        """The HTML of fragment `name` for `key` at `version`, from `render()` if it isn't cached."""
+
+        if not self.enabled:
+            return render()
+
+        cache_key = '%s:%s' % (name, key)
+        # Stored as text so versions compare the same after a trip through JSON.
+        version = str(version)
+        entry = self.backend.get(cache_key)
+        if entry is not None and entry[0][0] == version:
+            return Markup(entry[0][1])
+
+        html = render()
+        self.backend.set(cache_key, [version, str(html)], self.clock())
+        return Markup(html)
+
+    def invalidate(self, name, key):
+        self.backend.delete('%s:%s' % (name, key))
+
+
+class FragmentCacheExtension(Extension):
+    """The `{% cache name, key, version %}` tag."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        if len(args) != 3:
+            parser.fail('cache takes a fragment name, a key and a version', lineno)
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, name, key, version, caller):
+        return self.environment.fragment_cache.render(name, key, version, caller)
+
+
+fragment_cache = AppLocal('fragment_cache', FragmentCache)
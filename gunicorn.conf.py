@@ -0,0 +1,39 @@
+"""gunicorn settings: `gunicorn -c gunicorn.conf.py app:app`.
+
+The app is imported once in the master (preload_app) and workers are
+forked from it, so each starts in milliseconds and shares the imported
+modules copy-on-write instead of importing them again.
+"""
+
+import multiprocessing
+import os
+
+bind = '0.0.0.0:%s' % os.getenv('PORT', '8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+# Threads per worker. An open /user/events stream holds a thread until the
+# browser leaves, and each worker keeps at most EVENTS_MAX_STREAMS of them
+# (config.py; more get a 503 and retry later). Those threads come on top of
+# GUNICORN_THREADS, which stay free for ordinary requests however many
+# pending-trades pages are open. Defaults: 8 + 8 threads per worker, so
+# 8 * workers live streams in all. An idle stream costs memory, not CPU.
+threads = int(os.getenv('GUNICORN_THREADS', 8)) + int(os.getenv('EVENTS_MAX_STREAMS', 8))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+preload_app = True
+
+
+def on_starting(server):
+    # Totals in METRICS_DIR are per server run (see metrics.py).
+    directory = os.getenv('METRICS_DIR')
+    if directory:
+        from metrics import Registry
+        Registry(directory).clear()
+
+
+def post_fork(server, worker):
+    # Don't let a worker reuse a database connection opened in the master.
+    import database
+    from app import app
+    with app.app_context():
+        for engine in database.engines(app):
+            engine.dispose(close=False)
@@ -0,0 +1,88 @@
+"""Loading the logged-in user.
+
+IdentityCache keeps the column values of recently loaded users for a short
+TTL so most requests can rebuild g.user without a query. Each process has
+its own cache, so a change made through one worker can take up to the TTL
+to reach the others. Users marked with User.touch are dropped from the local
+cache as soon as the change commits. Code that can't work with an old copy
+checks is_cached() and reads what it needs from the database.
+
+Password hashes are left out of the cache and loaded on the rare occasions
+they are needed.
+"""
+
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+
+from cache import MemoryBackend
+from database import RoutingSession
+from extensions import AppLocal
+from models import db, User
+
+UNCACHED = {'password'}
+
+# session.info key: ids of the users this session got from the cache.
+CACHED = 'cached_users'
+
+
+class IdentityCache(object):
+    """Per-process cache of User rows by id. A TTL of 0 disables it."""
+
+    def __init__(self, ttl=0, max_size=1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.backend = MemoryBackend(max_size=max_size)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+
+    def load(self, user_id):
+        """Return the User for `user_id`, attached to the current session, or None.
+
+        A user the session has already loaded is returned as it is, never
+        overwritten with the possibly older cached values."""
+
+        key = db.inspect(User).identity_key_from_primary_key((user_id,))
+        user = db.session.identity_map.get(key)
+        if user is not None:
+            return user
+
+        if self.ttl > 0:
+            entry = self.backend.get(user_id)
+            if entry is not None and self.clock() - entry[1] < self.ttl:
+                user = User(**entry[0])
+                make_transient_to_detached(user)
+                db.session.info.setdefault(CACHED, set()).add(user_id)
+                # load=False attaches the row as-is instead of SELECTing it again.
+                return db.session.merge(user, load=False)
+
+        user = db.session.get(User, user_id)
+        if user is not None and self.ttl > 0:
+            values = {attr.key: getattr(user, attr.key) for attr in db.inspect(User).column_attrs
+                      if attr.key not in UNCACHED}
+            self.backend.set(user_id, values, self.clock())
+        return user
+
+    def is_cached(self, user):
+        """Whether this session's `user` came from the cache and may be out of date."""
+
+        return user.id in db.session.info.get(CACHED, ())
+
+    def invalidate(self, user_id):
+        self.backend.delete(user_id)
+
+
+identity_cache = AppLocal('identity_cache', IdentityCache)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def forget_touched_users(session):
+    for user_id in session.info.pop(User.TOUCHED, ()):
+        identity_cache.invalidate(user_id)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def keep_touched_users(session):
+    session.info.pop(User.TOUCHED, None)
@@ -0,0 +1,171 @@
+"""Background eBay ingestion.
+
+The search view no longer calls eBay itself. It serves whatever is already
+in the database and calls enqueue_refresh(), which queues an IngestJob when
+the term hasn't been fetched within the refresh TTL. `flask ingest-worker`
+runs work(): it claims queued jobs one at a time, fetches the listings with
+Ebay_24 and stores them with Item.bulk_ingest.
+
+The queue is the ingest_job table, so no broker is needed. Several workers
+can share it: on Postgres a claim skips rows another worker has locked, and
+everywhere a claim is a conditional UPDATE that only one worker can win.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+import requests
+from ebaysdk.exception import ConnectionError
+
+from cache import normalize_term
+from ebay_24 import Ebay_24, ebay_guard
+from models import db, Item, IngestJob, SearchTerm, insert_ignoring_conflicts
+
+log = logging.getLogger(__name__)
+
+# A job still "running" after this many seconds is assumed to belong to a dead worker.
+STUCK_AFTER = 600
+
+
+class RefreshFailed(Exception):
+    """eBay couldn't be reached (or refused) while refreshing a term."""
+
+
+def is_fresh(term, max_age):
+    """Whether `term` was fetched from eBay within the last `max_age` seconds."""
+
+    refreshed = db.session.execute(
+        db.select(SearchTerm.last_refreshed).where(SearchTerm.term == normalize_term(term))
+    ).scalar()
+    return refreshed is not None and datetime.now() - refreshed < timedelta(seconds=max_age)
+
+
+def enqueue_refresh(term, max_age):
+    """Queue a refresh of `term` unless it is fresh. The caller commits.
+
+    Returns True if the term is stale or missing (whether or not a job for it
+    was already waiting), False if it is fresh."""
+
+    if is_fresh(term, max_age):
+        return False
+
+    # The partial unique index turns a second enqueue of the same term into a no-op.
+    db.session.execute(insert_ignoring_conflicts(IngestJob).values(
+        term=normalize_term(term), status='queued', attempts=0, created_at=datetime.now()))
+    return True
+
+
+def refresh(term, api_key, cache=None, pages=1):
+    """Fetch `term` from eBay and store any new listings. The caller commits.
+
+    More than one page is fetched in parallel with Ebay_24.fetch_many.
+    Either way the listings go through `cache`, keyed on the term and the
+    page count, so repeat and concurrent refreshes share one eBay fetch.
+    Returns the number of new items. Raises RefreshFailed if the eBay
+    request fails."""
+
+    term = normalize_term(term)
+    ebay = Ebay_24(api_key, term, cache=cache)
+    if pages > 1:
+        fetch = lambda: list(ebay.fetch_many(pages=pages))
+        try:
+            # NUL survives normalize_term and can't be typed into a search, so no term shares the key.
+            records = cache.get_or_load('%s\0%d' % (term, pages), fetch) if cache is not None else fetch()
+        except (ConnectionError, requests.RequestException) as e:
+            raise RefreshFailed(f"eBay request failed: {e}")
+    else:
+        records = ebay.fetch()
+    if records is None:
+        raise RefreshFailed("eBay request failed")
+
+    added = Item.bulk_ingest(records)
+    db.session.merge(SearchTerm(term=term, last_refreshed=datetime.now(), item_count=len(records)))
+    return added
+
+
+def claim_job():
+    """Mark the oldest queued job as running and return it, or None if there is none."""
+
+    while True:
+        job_id = db.session.execute(
+            db.select(IngestJob.id)
+            .where(IngestJob.status == 'queued')
+            .order_by(IngestJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            db.update(IngestJob)
+            .where(IngestJob.id == job_id, IngestJob.status == 'queued')
+            .values(status='running', started_at=datetime.now(), attempts=IngestJob.attempts + 1)
+        ).rowcount
+        db.session.commit()
+
+        # Another worker got there first; try the next one.
+        if claimed:
+            return db.session.get(IngestJob, job_id)
+
+
+def run_job(job, api_key, cache=None, max_attempts=3, pages=1):
+    """Fetch and store the listings for `job`. Returns the number of new items.
+
+    A failed job goes back on the queue until it has been tried
+    `max_attempts` times, then stays behind with status 'failed'."""
+
+    try:
+        added = refresh(job.term, api_key, cache=cache, pages=pages)
+        db.session.delete(job)
+        db.session.commit()
+        return added
+
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'queued' if job.attempts < max_attempts else 'failed'
+        job.error = str(e)
+        db.session.commit()
+        if job.status == 'failed':
+            log.error("Ingest of %r failed for good (attempt %d)", job.term, job.attempts, exc_info=True)
+        else:
+            log.warning("Ingest of %r failed (attempt %d), requeued: %s", job.term, job.attempts, e)
+        return 0
+
+
+def requeue_stuck(older_than=STUCK_AFTER):
+    """Put jobs whose worker died mid-run back on the queue. Returns how many."""
+
+    cutoff = datetime.now() - timedelta(seconds=older_than)
+    count = db.session.execute(
+        db.update(IngestJob)
+        .where(IngestJob.status == 'running', IngestJob.started_at < cutoff)
+        .values(status='queued')
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def work(api_key, cache=None, once=False, poll_interval=1.0, max_attempts=3, pages=1):
+    """Process jobs until interrupted, or until the queue is empty if `once`.
+
+    Jobs are left queued while ebay_guard's circuit is open.
+
+    Returns the number of jobs processed."""
+
+    processed = 0
+    requeue_stuck()
+    while True:
+        # While eBay's circuit is open, jobs would only burn their attempts.
+        job = claim_job() if ebay_guard.allows_calls() else None
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            requeue_stuck()
+            continue
+
+        run_job(job, api_key, cache=cache, max_attempts=max_attempts, pages=pages)
+        processed += 1
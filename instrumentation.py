@@ -0,0 +1,141 @@
+"""Per-request SQL instrumentation.
+
+SQLInstrumentation listens to SQLAlchemy's cursor events and, for each
+request, counts the statements run, their total time and the slowest one.
+Every response gets a Server-Timing header with those numbers. Requests
+over the configured thresholds are logged, as are statements repeated
+often enough to look like an N+1 (the same SELECT run once per row).
+
+Views can declare how many queries they should need with @query_budget(n).
+With SQL_STRICT on (the test config), going over a budget or repeating a
+statement SQL_REPEAT_WARN times raises QueryBudgetExceeded, so the test
+that hit the route fails.
+"""
+
+import logging
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """A route ran more queries than it declared, or repeated one per row."""
+
+
+def query_budget(limit):
+    """Declare that a view should run at most `limit` SQL statements."""
+
+    def decorate(view):
+        view.query_budget = limit
+        return view
+    return decorate
+
+
+class RequestQueries(object):
+    """The statements one request has run so far."""
+
+    def __init__(self, started):
+        self.started = started
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+
+    def add(self, statement, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.statements[statement] += 1
+        if elapsed >= self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+    def repeated(self, limit):
+        """Statements run at least `limit` times, most frequent first."""
+
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= limit]
+
+
+class SQLInstrumentation(object):
+    """Flask extension recording the SQL each request runs.
+
+    Reads SQL_SLOW_REQUEST_MS and SQL_QUERY_WARN (log requests slower or
+    chattier than these), SQL_REPEAT_WARN (log statements repeated this
+    often) and SQL_STRICT (raise instead of only logging).
+    """
+
+    def __init__(self, app=None, clock=time.perf_counter):
+        self.clock = clock
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_SLOW_REQUEST_MS', 500)
+        app.config.setdefault('SQL_QUERY_WARN', 30)
+        app.config.setdefault('SQL_REPEAT_WARN', 5)
+        app.config.setdefault('SQL_STRICT', False)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+        # Listening on the Engine class covers every engine the app creates.
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            self._listening = True
+
+    def _start(self):
+        g._sql = RequestQueries(self.clock())
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # A connection runs one statement at a time, so one slot is enough.
+        conn.info['query_started'] = self.clock()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('query_started', None)
+        if started is not None and has_request_context() and g.get('_sql') is not None:
+            g._sql.add(statement, self.clock() - started)
+
+    def _finish(self, response):
+        queries = g.pop('_sql', None)
+        if queries is None:
+            return response
+
+        config = current_app.config
+        elapsed = (self.clock() - queries.started) * 1000
+        db_ms = queries.total * 1000
+
+        response.headers.add('Server-Timing', 'db;dur=%.1f;desc="%d queries"' % (db_ms, queries.count))
+        response.headers.add('Server-Timing', 'app;dur=%.1f' % elapsed)
+
+        route = '%s %s' % (request.method, request.path)
+        if elapsed > config['SQL_SLOW_REQUEST_MS'] or queries.count > config['SQL_QUERY_WARN']:
+            log.warning("%s ran %d queries (%.1f ms in the database, %.1f ms total); slowest %.1f ms: %s",
+                        route, queries.count, db_ms, elapsed, queries.slowest * 1000,
+                        _shorten(queries.slowest_statement))
+
+        problems = []
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None and queries.count > budget:
+            problems.append("%s ran %d queries, over its budget of %d" % (route, queries.count, budget))
+        for statement, n in queries.repeated(config['SQL_REPEAT_WARN']):
+            problems.append("%s ran the same statement %d times (N+1?): %s" % (route, n, _shorten(statement)))
+
+        for problem in problems:
+            log.warning(problem)
+        if problems and config['SQL_STRICT']:
+            raise QueryBudgetExceeded('; '.join(problems))
+
+        return response
+
+
+def _shorten(statement, length=200):
+    statement = ' '.join((statement or '').split())
+    return statement if len(statement) <= length else statement[:length] + '...'
@@ -0,0 +1,234 @@
+"""Barter matching over the offered and requested lists.
+
+MatchIndex keeps, per item, who offers it and who requests it, plus the
+same lists per user. Routes update it as items are added or removed, and it
+is rebuilt from the database every `ttl` seconds to pick up changes made
+through other workers. Only one request rebuilds it at a time; the others
+keep using the old index meanwhile, and changes made while the rebuild
+reads the database are applied again on top of what it read.
+
+A user A "gets from" B when B offers something A requests. A direct match is
+a pair that each get from the other. A trade cycle is a longer loop
+A -> B -> C -> A where everyone gets an item from the next user and gives
+one to the previous.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from extensions import AppLocal
+from models import db, OfferedItem, RequestedItem
+
+
+class MatchIndex(object):
+    """In-memory bipartite index of items to the users offering and requesting them."""
+
+    def __init__(self, ttl=300, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._pending = None  # changes made while load() reads, or None
+        self._reset()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('MATCH_INDEX_TTL', self.ttl)
+
+    def _reset(self):
+        self.offerers = defaultdict(set)    # item id -> ids of users offering it
+        self.requesters = defaultdict(set)  # item id -> ids of users requesting it
+        self.offers = defaultdict(set)      # user id -> ids of items they offer
+        self.requests = defaultdict(set)    # user id -> ids of items they request
+
+    def load(self):
+        """Rebuild the index from the database (two queries)."""
+
+        with self._lock:
+            self._pending = []
+        try:
+            offers = db.session.execute(db.select(OfferedItem.user_id, OfferedItem.item_id)).tuples().all()
+            requests = db.session.execute(db.select(RequestedItem.user_id, RequestedItem.item_id)).tuples().all()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        # Built aside, so matching carries on against the old index until the swap.
+        fresh = MatchIndex()
+        for user_id, item_id in offers:
+            fresh.add_offer(user_id, item_id)
+        for user_id, item_id in requests:
+            fresh.add_request(user_id, item_id)
+
+        with self._lock:
+            # The reads may have missed these.
+            for change, user_id, item_id in self._pending:
+                getattr(fresh, change)(user_id, item_id)
+            self._pending = None
+            self.offerers, self.requesters = fresh.offerers, fresh.requesters
+            self.offers, self.requests = fresh.offers, fresh.requests
+            self.loaded_at = self.clock()
+
+    def ensure_loaded(self):
+        """Load the index if it is empty or older than the TTL.
+
+        Only the first caller to find it stale reloads it. The others go on
+        with the old index, or wait if there is none yet."""
+
+        if not self._stale():
+            return
+        if not self._load_lock.acquire(blocking=self.loaded_at is None):
+            return
+        try:
+            # Someone else may have reloaded it while this caller waited.
+            if self._stale():
+                self.load()
+        finally:
+            self._load_lock.release()
+
+    def _stale(self):
+        return self.loaded_at is None or self.clock() - self.loaded_at >= self.ttl
+
+    def _record(self, change, user_id, item_id):
+        if self._pending is not None:
+            self._pending.append((change, user_id, item_id))
+
+    def add_offer(self, user_id, item_id):
+        with self._lock:
+            self._record('add_offer', user_id, item_id)
+            self.offerers[item_id].add(user_id)
+            self.offers[user_id].add(item_id)
+
+    def remove_offer(self, user_id, item_id):
+        with self._lock:
+            self._record('remove_offer', user_id, item_id)
+            _discard(self.offerers, item_id, user_id)
+            _discard(self.offers, user_id, item_id)
+
+    def add_request(self, user_id, item_id):
+        with self._lock:
+            self._record('add_request', user_id, item_id)
+            self.requesters[item_id].add(user_id)
+            self.requests[user_id].add(item_id)
+
+    def remove_request(self, user_id, item_id):
+        with self._lock:
+            self._record('remove_request', user_id, item_id)
+            _discard(self.requesters, item_id, user_id)
+            _discard(self.requests, user_id, item_id)
+
+    def direct_matches(self, user_id):
+        """Users who offer something `user_id` requests and request something `user_id` offers.
+
+        Returns a list of `{'user_id', 'you_get', 'they_get'}` dicts, where the
+        last two are sorted item id lists."""
+
+        with self._lock:
+            you_get = self._suppliers(user_id)
+            offered = self.offers.get(user_id, ())
+            matches = []
+            for other, items in you_get.items():
+                they_get = self.requests.get(other, set()).intersection(offered)
+                if they_get:
+                    matches.append({'user_id': other, 'you_get': sorted(items), 'they_get': sorted(they_get)})
+
+        return sorted(matches, key=lambda match: match['user_id'])
+
+    def trade_cycles(self, user_id, max_length=3, limit=20, budget=20000):
+        """Find trade loops through `user_id` of 3 to `max_length` users.
+
+        Each cycle is a list of `{'user_id', 'gets', 'from'}` steps starting
+        with `user_id`: that user gets item `gets` from user `from`. Two-user
+        loops are direct matches and are left out. At most `limit` cycles are
+        returned, shortest first. `budget` caps how many users the search may
+        visit, so a user wanting very popular items can't stall the request."""
+
+        cycles = []
+        with self._lock:
+            # Only users who want something `user_id` offers can close a loop.
+            closers = sorted(self._consumers(user_id))
+            if not closers:
+                return cycles
+
+            remaining = [budget]
+            # Iterative deepening returns the shortest loops first and stops early.
+            for length in range(3, max_length + 1):
+                self._walk([user_id], length, closers, cycles, limit, remaining)
+                if len(cycles) >= limit or remaining[0] <= 0:
+                    break
+
+        return cycles
+
+    def _walk(self, path, length, closers, cycles, limit, remaining):
+        current = path[-1]
+        if len(path) == length - 1:
+            # Last hop: check the (usually short) closer list instead of
+            # expanding everyone who supplies `current`.
+            wanted = self.requests.get(current, ())
+            for closer in closers:
+                if len(cycles) >= limit or remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                if closer not in path and not self.offers.get(closer, set()).isdisjoint(wanted):
+                    cycles.append(self._describe(path + [closer]))
+            return
+
+        for supplier in self._iter_suppliers(current):
+            if len(cycles) >= limit or remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+            if supplier in path:
+                continue
+            path.append(supplier)
+            self._walk(path, length, closers, cycles, limit, remaining)
+            path.pop()
+
+    def _describe(self, path):
+        steps = []
+        for position, user in enumerate(path):
+            supplier = path[(position + 1) % len(path)]
+            gets = min(self.requests[user] & self.offers[supplier])
+            steps.append({'user_id': user, 'gets': gets, 'from': supplier})
+        return steps
+
+    def _iter_suppliers(self, user_id):
+        """Yield each other user who offers something `user_id` requests, once."""
+
+        seen = {user_id}
+        for item_id in sorted(self.requests.get(user_id, ())):
+            for other in sorted(self.offerers.get(item_id, ())):
+                if other not in seen:
+                    seen.add(other)
+                    yield other
+
+    def _consumers(self, user_id):
+        """Ids of other users who request something `user_id` offers."""
+
+        consumers = set()
+        for item_id in self.offers.get(user_id, ()):
+            consumers.update(self.requesters.get(item_id, ()))
+        consumers.discard(user_id)
+        return consumers
+
+    def _suppliers(self, user_id):
+        """Map each other user who offers something `user_id` requests to those items."""
+
+        suppliers = defaultdict(set)
+        for item_id in self.requests.get(user_id, ()):
+            for other in self.offerers.get(item_id, ()):
+                if other != user_id:
+                    suppliers[other].add(item_id)
+        return suppliers
+
+
+def _discard(index, key, value):
+    members = index.get(key)
+    if members is not None:
+        members.discard(value)
+        if not members:
+            del index[key]
+
+
+match_index = AppLocal('match_index', MatchIndex)
@@ -0,0 +1,277 @@
+"""Prometheus-style metrics shared across worker processes.
+
+Each process keeps its counters and histograms in memory and, when
+METRICS_DIR is set, writes them to its own `<pid>.json` file there about
+once a second (each file has a single writer, and is replaced atomically).
+/metrics merges every file in the directory, so whichever worker answers
+the scrape reports totals for all of them. Without METRICS_DIR the numbers
+cover only the process serving /metrics.
+
+The directory should be emptied when the server (not a worker) starts, or
+totals from the previous run carry over.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric(object):
+    def __init__(self, registry, kind, name, help, labelnames, buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(Metric):
+    def inc(self, amount=1, **labels):
+        self.registry._update(self, self._key(labels), amount)
+
+
+class Histogram(Metric):
+    def observe(self, value, **labels):
+        self.registry._update(self, self._key(labels), value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Registry(object):
+    """The metrics of this process, plus the files of its sibling workers."""
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._values = {}
+        self._dirty = False
+        self._flusher = None
+
+    def init_app(self, app):
+        """Record the latency and status of every request. The app serves render() itself.
+
+        The values belong to the process, not the app, so every app in it
+        has to agree on METRICS_DIR; a second app can't point them elsewhere."""
+
+        directory = app.config.get('METRICS_DIR')
+        if directory and self.directory and directory != self.directory:
+            raise ValueError("Metrics already go to %s, not %s" % (self.directory, directory))
+        self.directory = directory or self.directory
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(_start_timer)
+        app.after_request(self._record_request)
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, 'counter', name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, 'histogram', name, help, labelnames, buckets))
+
+    def render(self):
+        """All metrics, summed over every worker, in the Prometheus text format."""
+
+        totals = {}
+        for values in self._collect():
+            for key, value in values.items():
+                if isinstance(value, list):
+                    current = totals.setdefault(key, [0] * len(value))
+                    totals[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            samples = sorted((key[1], value) for key, value in totals.items() if key[0] == metric.name)
+            for labelvalues, value in samples:
+                labels = list(zip(metric.labelnames, labelvalues))
+                if metric.kind == 'counter':
+                    lines.append('%s%s %s' % (metric.name, _labels(labels), _number(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value):
+                    cumulative += count
+                    lines.append('%s_bucket%s %s' % (metric.name, _labels(labels + [('le', _number(bound))]),
+                                                     _number(cumulative)))
+                lines.append('%s_sum%s %s' % (metric.name, _labels(labels), _number(value[-2])))
+                lines.append('%s_count%s %s' % (metric.name, _labels(labels), _number(value[-1])))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Forget this process's values and remove every worker's file."""
+
+        with self._lock:
+            self._values = {}
+            self._dirty = False
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def flush(self):
+        """Write this process's values to its file now."""
+
+        if not self.directory:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+            self._dirty = False
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp, os.path.join(self.directory, '%d.json' % os.getpid()))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _update(self, metric, labelvalues, value):
+        key = (metric.name, labelvalues)
+        with self._lock:
+            self._check_fork()
+            if metric.kind == 'counter':
+                self._values[key] = self._values.get(key, 0) + value
+            else:
+                # One slot per bucket plus +Inf, then sum and count.
+                slots = self._values.get(key)
+                if slots is None:
+                    slots = self._values[key] = [0] * (len(metric.buckets) + 3)
+                index = next((n for n, bound in enumerate(metric.buckets) if value <= bound), len(metric.buckets))
+                slots[index] += 1
+                slots[-2] += value
+                slots[-1] += 1
+            self._dirty = True
+
+    def _check_fork(self):
+        # A forked worker starts from zero (its parent's numbers are in the
+        # parent's file) and needs its own flusher thread.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._values = {}
+        if self.directory:
+            self._flusher = threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _collect(self):
+        if not self.directory:
+            with self._lock:
+                return [dict(self._values)]
+
+        self.flush()
+        collected = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as fh:
+                    data = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            collected.append({(metric, tuple(labels)): value for metric, labels, value in data})
+        return collected
+
+    def _record_request(self, response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'none'
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+            REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+
+def _start_timer():
+    g._metrics_started = time.perf_counter()
+
+
+def instrument_pool(engine):
+    """Time how long sessions wait to check a connection out of `engine`'s pool.
+
+    Swaps the pool's class for a subclass that times _do_get, which is where
+    a checkout blocks when every connection is in use. Pools the engine
+    recreates (e.g. after dispose()) keep the subclass."""
+
+    pool_class = type(engine.pool)
+    if getattr(pool_class, '_timed', False):
+        return
+
+    class TimedPool(pool_class):
+        _timed = True
+
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super(TimedPool, self)._do_get()
+            finally:
+                POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+    TimedPool.__name__ = 'Timed' + pool_class.__name__
+    engine.pool.__class__ = TimedPool
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'http_requests_total', 'Requests handled, by endpoint, method and status.',
+    ['endpoint', 'method', 'status'])
+REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Time to handle a request, by endpoint and method.',
+    ['endpoint', 'method'])
+POOL_WAIT_SECONDS = registry.histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a database connection from the pool.',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+UPSTREAM_SECONDS = registry.histogram(
+    'upstream_call_duration_seconds', 'Time per upstream call attempt, by upstream and outcome.',
+    ['upstream', 'outcome'])
+UPSTREAM_CALLS = registry.counter(
+    'upstream_calls_total', 'Upstream calls by upstream and result (ok, error, rejected by the circuit breaker).',
+    ['upstream', 'result'])
+PASSWORD_HASH_SECONDS = registry.histogram(
+    'password_hash_duration_seconds', 'Time bcrypt spends hashing or checking one password.',
+    ['operation'], buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
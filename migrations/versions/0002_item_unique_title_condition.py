@@ -0,0 +1,44 @@
+"""unique item title/condition
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-10-02 12:00:00.000000
+
+Folds existing duplicate items into the lowest id before adding the
+constraint, re-pointing offered/requested rows at the survivor.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+CANONICAL_ID = """
+    (SELECT MIN(dup.id) FROM item AS orig JOIN item AS dup
+       ON dup.title = orig.title
+      AND COALESCE(dup.condition, '') = COALESCE(orig.condition, '')
+     WHERE orig.id = {table}.item_id)
+"""
+
+
+def upgrade():
+    for table in ('offered_item', 'requested_item'):
+        op.execute(f"UPDATE {table} SET item_id = {CANONICAL_ID.format(table=table)} "
+                   f"WHERE item_id IS NOT NULL")
+    op.execute("""
+        DELETE FROM item WHERE id NOT IN (
+            SELECT MIN(id) FROM item GROUP BY title, COALESCE(condition, ''))
+    """)
+
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.create_unique_constraint('uq_item_title_condition', ['title', 'condition'],
+                                          postgresql_nulls_not_distinct=True)
+
+
+def downgrade():
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.drop_constraint('uq_item_title_condition', type_='unique')
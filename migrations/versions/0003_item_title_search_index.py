@@ -0,0 +1,44 @@
+"""item title search index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-10-03 12:00:00.000000
+
+Postgres gets a pg_trgm GIN index; SQLite gets an FTS5 trigram table kept
+in sync by triggers (see search.py).
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_item_title_trgm', 'item', ['title'], postgresql_using='gin',
+                        postgresql_ops={'title': 'gin_trgm_ops'})
+
+    elif dialect == 'sqlite':
+        from search import SQLITE_FTS_DDL
+        for statement in SQLITE_FTS_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO item_fts (item_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.drop_index('ix_item_title_trgm', table_name='item')
+
+    elif dialect == 'sqlite':
+        for trigger in ('item_fts_insert', 'item_fts_delete', 'item_fts_update'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS item_fts')
@@ -0,0 +1,52 @@
+"""offered/requested/trade indexes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-10-04 12:00:00.000000
+
+Duplicate (user_id, item_id) rows are folded into the lowest id first, with
+trades re-pointed at the survivor, so the unique indexes can be built.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+SURVIVOR_ID = """
+    (SELECT MIN(dup.id) FROM {table} AS orig JOIN {table} AS dup
+       ON dup.user_id = orig.user_id AND dup.item_id = orig.item_id
+     WHERE orig.id = trade.{column})
+"""
+
+
+def upgrade():
+    for table, column in (('offered_item', 'item_offered_id'), ('requested_item', 'item_requested_id')):
+        op.execute(f"UPDATE trade SET {column} = {SURVIVOR_ID.format(table=table, column=column)} "
+                   f"WHERE {column} IN (SELECT id FROM {table} WHERE user_id IS NOT NULL AND item_id IS NOT NULL)")
+        op.execute(f"""
+            DELETE FROM {table} WHERE user_id IS NOT NULL AND item_id IS NOT NULL AND id NOT IN (
+                SELECT MIN(id) FROM {table} GROUP BY user_id, item_id)
+        """)
+        op.create_index(f'uq_{table}_user_item', table, ['user_id', 'item_id'], unique=True)
+        op.create_index(f'ix_{table}_item_id', table, ['item_id'])
+
+    op.create_index('ix_trade_offered_status', 'trade', ['item_offered_id', 'status'])
+    op.create_index('ix_trade_requested_status', 'trade', ['item_requested_id', 'status'])
+    op.create_index('ix_trade_pending_created', 'trade', ['created_at', 'id'],
+                    postgresql_where=sa.text("status = 'Pending'"),
+                    sqlite_where=sa.text("status = 'Pending'"))
+
+
+def downgrade():
+    op.drop_index('ix_trade_pending_created', table_name='trade')
+    op.drop_index('ix_trade_requested_status', table_name='trade')
+    op.drop_index('ix_trade_offered_status', table_name='trade')
+    for table in ('requested_item', 'offered_item'):
+        op.drop_index(f'ix_{table}_item_id', table_name=table)
+        op.drop_index(f'uq_{table}_user_item', table_name=table)
@@ -0,0 +1,50 @@
+"""background ingestion queue
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-10-06 12:00:00.000000
+
+Adds search_term (when each term was last fetched from eBay) and
+ingest_job (the queue `flask ingest-worker` reads).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+ACTIVE = "status IN ('queued', 'running')"
+
+
+def upgrade():
+    op.create_table('search_term',
+    sa.Column('term', sa.String(length=200), nullable=False),
+    sa.Column('last_refreshed', sa.DateTime(), nullable=False),
+    sa.Column('item_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('term')
+    )
+    op.create_table('ingest_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('term', sa.String(length=200), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_ingest_job_active_term', 'ingest_job', ['term'], unique=True,
+                    postgresql_where=sa.text(ACTIVE), sqlite_where=sa.text(ACTIVE))
+    op.create_index('ix_ingest_job_status_id', 'ingest_job', ['status', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_ingest_job_status_id', table_name='ingest_job')
+    op.drop_index('uq_ingest_job_active_term', table_name='ingest_job')
+    op.drop_table('ingest_job')
+    op.drop_table('search_term')
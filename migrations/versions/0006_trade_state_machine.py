@@ -0,0 +1,48 @@
+"""trade state machine
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-10-13 12:00:00.000000
+
+Adds trade.version (for optimistic locking) and trade.recipient_id (who
+may accept or reject a trade), with an index for the recipient's pending
+trades. Existing trades get as recipient the (lowest id) other user who
+offers the item they ask for; one nobody offers keeps a NULL recipient,
+and nobody can answer it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Batch mode so SQLite, which can't add a foreign key in place, copies the table.
+    with op.batch_alter_table('trade') as batch_op:
+        batch_op.add_column(sa.Column('recipient_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.create_foreign_key('fk_trade_recipient_id_user', 'user', ['recipient_id'], ['id'])
+        batch_op.create_index('ix_trade_recipient_status', ['recipient_id', 'status'])
+
+    # The requested row belongs to the initiator; the recipient offers its item.
+    op.execute("""
+        UPDATE trade SET recipient_id = (
+            SELECT MIN(offered.user_id) FROM requested_item AS requested
+              JOIN offered_item AS offered ON offered.item_id = requested.item_id
+             WHERE requested.id = trade.item_requested_id
+               AND offered.user_id <> requested.user_id)
+         WHERE recipient_id IS NULL
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('trade') as batch_op:
+        batch_op.drop_index('ix_trade_recipient_status')
+        batch_op.drop_constraint('fk_trade_recipient_id_user', type_='foreignkey')
+        batch_op.drop_column('version')
+        batch_op.drop_column('recipient_id')
@@ -0,0 +1,39 @@
+"""trade events
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-10-20 12:00:00.000000
+
+Adds trade_event, the table each worker polls to push live trade
+notifications (see events.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('trade_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('trade_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['trade_id'], ['trade.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_trade_event_user_id', 'trade_event', ['user_id', 'id'])
+    op.create_index('ix_trade_event_created_at', 'trade_event', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_trade_event_created_at', table_name='trade_event')
+    op.drop_index('ix_trade_event_user_id', table_name='trade_event')
+    op.drop_table('trade_event')
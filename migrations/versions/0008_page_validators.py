@@ -0,0 +1,37 @@
+"""page validators
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-10-27 12:00:00.000000
+
+Adds user.version and item.updated_at, which conditional GETs compare
+instead of rendering the page (see conditional.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('item', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_item_updated_at', 'item', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_item_updated_at', table_name='item')
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.drop_column('updated_at')
+    if op.get_bind().dialect.name == 'sqlite':
+        # Copying the table in batch mode dropped the search triggers from 0003.
+        from search import SQLITE_FTS_DDL
+        for statement in SQLITE_FTS_DDL:
+            op.execute(statement)
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,50 @@
+"""item fingerprint
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-10-31 12:00:00.000000
+
+Adds item.fingerprint (see models.item_fingerprint). Items that turn out
+to share one are folded into the lowest id first, as in 0002. Downgrading
+drops the column but does not bring the merged items back.
+"""
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from dedup import merge
+    from models import item_fingerprint
+
+    op.add_column('item', sa.Column('fingerprint', sa.String(length=40), nullable=True))
+
+    bind = op.get_bind()
+    groups = defaultdict(list)
+    for item_id, title, condition in bind.execute(sa.text("SELECT id, title, condition FROM item")):
+        groups[item_fingerprint(title, condition)].append(item_id)
+    if groups:
+        bind.execute(sa.text("UPDATE item SET fingerprint = :fingerprint WHERE id = :id"),
+                     [{'fingerprint': fingerprint, 'id': min(ids)} for fingerprint, ids in groups.items()])
+    merge([ids for ids in groups.values() if len(ids) > 1], bind)
+
+    op.create_index('uq_item_fingerprint', 'item', ['fingerprint'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_item_fingerprint', table_name='item')
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.drop_column('fingerprint')
+    if op.get_bind().dialect.name == 'sqlite':
+        # Copying the table in batch mode dropped the search triggers from 0003.
+        from search import SQLITE_FTS_DDL
+        for statement in SQLITE_FTS_DDL:
+            op.execute(statement)
@@ -1,9 +1,32 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime
+import hashlib
+import re
+from passwords import password_hasher
+from database import RoutingSession
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+WORD = re.compile(r'\w+')
+
+
+def title_tokens(title):
+    """The words of `title`, casefolded, without punctuation."""
+
+    return WORD.findall(title.casefold().replace('_', ' '))
+
+
+def item_fingerprint(title, condition):
+    """Hash identifying an item whatever the case, spacing, punctuation or word order of its title."""
+
+    key = ' '.join(sorted(title_tokens(title))) + '|' + ' '.join(title_tokens(condition or ''))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _default_fingerprint(context):
+    params = context.get_current_parameters()
+    return item_fingerprint(params['title'], params.get('condition'))
 
 
 class User(db.Model):
@@ -12,9 +35,24 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(120), nullable=False)
     image_url = db.Column(db.String(200), nullable=True, default='/static/images/default_profile_pic.jpg')
+    # Bumped whenever the profile or the offered/requested lists change (see conditional.py).
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # Session.info key for the ids passed to touch() in the current transaction.
+    TOUCHED = 'touched_users'
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
+
+    @classmethod
+    def touch(cls, user_id):
+        """Mark `user_id`'s pages as changed. The caller commits.
+
+        The commit also drops the user from the identity cache (identity.py)."""
+
+        db.session.execute(db.update(cls).where(cls.id == user_id).values(version=cls.version + 1)
+                           .execution_options(synchronize_session=False))
+        db.session.info.setdefault(cls.TOUCHED, set()).add(user_id)
     
     @classmethod
     def signup(cls, username, email, password):
@@ -22,7 +60,7 @@ class User(db.Model):
         
         Hashes password and adds user to system."""
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_hasher.hash(password)
 
         user = User(username=username,
                     email=email,
@@ -36,51 +74,381 @@ class User(db.Model):
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
         
-        If can't find matching user (or if password is wrong), returns False."""
+        If can't find matching user (or if password is wrong), returns False.
+
+        A hash made with a different work factor than the current one is
+        replaced on success; the caller commits it."""
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = password_hasher.check(user.password, password)
             if is_auth:
+                if password_hasher.needs_rehash(user.password):
+                    user.password = password_hasher.hash(password)
                 return user
             
         return False
 
 class Item(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('title', 'condition', name='uq_item_title_condition',
+                            postgresql_nulls_not_distinct=True),
+        # Trigram index for substring search (see search.py); SQLite uses an FTS5 table instead.
+        db.Index('ix_item_title_trgm', 'title', postgresql_using='gin',
+                 postgresql_ops={'title': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_item_updated_at', 'updated_at'),
+        db.Index('uq_item_fingerprint', 'fingerprint', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     condition = db.Column(db.String(50))
     image_url = db.Column(db.String(500))
+    # When the item, or who offers it, last changed; search pages are validated against the latest.
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+    # item_fingerprint(title, condition); one row per fingerprint (see dedup.py for near-duplicates).
+    fingerprint = db.Column(db.String(40), default=_default_fingerprint)
+
+    @classmethod
+    def touch(cls, item_ids):
+        """Mark the items in `item_ids` (ids or a SELECT of them) as changed. The caller commits."""
+
+        db.session.execute(db.update(cls).where(cls.id.in_(item_ids)).values(updated_at=datetime.now())
+                           .execution_options(synchronize_session=False))
+
+    @classmethod
+    def bulk_ingest(cls, records, limit=None):
+        """Store the items in `records` that aren't in the database yet.
+
+        Items are compared by fingerprint, so "Nintendo Switch - OLED" and
+        "nintendo switch oled" are the same item. Existing rows are found with
+        one IN query on the fingerprint index and the rest are written with a
+        single INSERT ... ON CONFLICT DO NOTHING, so another worker ingesting
+        the same term at the same time can't cause a duplicate or an
+        IntegrityError. At most `limit` new items are inserted.
+
+        Returns the number of rows sent to the INSERT."""
+
+        if not records:
+            return 0
+
+        fingerprints = [item_fingerprint(record['title'], record['condition']) for record in records]
+        seen = set(db.session.execute(
+            db.select(cls.fingerprint).where(cls.fingerprint.in_(set(fingerprints)))
+        ).scalars())
+
+        new_rows = []
+        for record, fingerprint in zip(records, fingerprints):
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            new_rows.append({
+                'title': record['title'],
+                'condition': record['condition'],
+                'image_url': record['image_url'],
+                'fingerprint': fingerprint,
+            })
+            if limit and len(new_rows) >= limit:
+                break
+
+        if new_rows:
+            db.session.execute(insert_ignoring_conflicts(cls).values(new_rows))
+
+        return len(new_rows)
     
 
+
 class OfferedItem(db.Model):
+    __table_args__ = (
+        # Also serves the per-user lookups, since user_id leads.
+        db.Index('uq_offered_item_user_item', 'user_id', 'item_id', unique=True),
+        db.Index('ix_offered_item_item_id', 'item_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
     user = db.relationship('User', backref=db.backref('offered_items', lazy=True))
     item = db.relationship('Item')  
 
+    @classmethod
+    def for_user(cls, user_id):
+        """The user's entries, with their items loaded in the same query."""
+
+        return cls.query.options(db.joinedload(cls.item)).filter_by(user_id=user_id).all()
+
+    @classmethod
+    def offerers_for(cls, item_ids, limit=5):
+        """Map each item id to `(users offering it, number not shown)`.
+
+        Runs one query however many items or offerers there are: a window
+        function numbers the offers per item, and only the first `limit` of
+        each are joined to their users."""
+
+        offerers = {item_id: ([], 0) for item_id in item_ids}
+        if not offerers:
+            return offerers
+
+        ranked = (db.select(cls.item_id, cls.user_id,
+                            db.func.row_number().over(partition_by=cls.item_id, order_by=cls.id).label('position'),
+                            db.func.count().over(partition_by=cls.item_id).label('total'))
+                  .where(cls.item_id.in_(offerers))
+                  .subquery())
+        rows = db.session.execute(
+            db.select(ranked.c.item_id, ranked.c.total, User)
+            .join(User, User.id == ranked.c.user_id)
+            .where(ranked.c.position <= limit)
+            .order_by(ranked.c.item_id, ranked.c.position)
+        ).tuples()
+
+        for item_id, total, user in rows:
+            users, _ = offerers[item_id]
+            users.append(user)
+            offerers[item_id] = (users, total - len(users))
+
+        return offerers
+
 
 class RequestedItem(db.Model):
+    __table_args__ = (
+        db.Index('uq_requested_item_user_item', 'user_id', 'item_id', unique=True),
+        db.Index('ix_requested_item_item_id', 'item_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
     user = db.relationship('User', backref=db.backref('requested_items', lazy=True))
     item = db.relationship('Item')
+
+    @classmethod
+    def for_user(cls, user_id):
+        """The user's entries, with their items loaded in the same query."""
+
+        return cls.query.options(db.joinedload(cls.item)).filter_by(user_id=user_id).all()
     
 
 class Trade(db.Model):
+    """A proposal to swap the initiator's offered item for one the recipient offers.
+
+    Only a Pending trade can change, and only once: see transition()."""
+
+    __table_args__ = (
+        db.Index('ix_trade_offered_status', 'item_offered_id', 'status'),
+        db.Index('ix_trade_requested_status', 'item_requested_id', 'status'),
+        db.Index('ix_trade_recipient_status', 'recipient_id', 'status'),
+        # Only pending trades are ever listed, so index just those.
+        db.Index('ix_trade_pending_created', 'created_at', 'id',
+                 postgresql_where=db.text("status = 'Pending'"),
+                 sqlite_where=db.text("status = 'Pending'")),
+    )
+
+    PENDING = 'Pending'
+    # Where a pending trade can go. Invalidated: another trade for one of its items was accepted.
+    OUTCOMES = ('Accepted', 'Rejected', 'Invalidated')
+
     id = db.Column(db.Integer, primary_key=True)
     item_offered_id = db.Column(db.Integer, db.ForeignKey('offered_item.id'))
     item_requested_id = db.Column(db.Integer, db.ForeignKey('requested_item.id'))
+    # The user asked to trade (NULL only for old trades nobody could answer, see migration 0006).
+    recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     status = db.Column(db.String(50), default='Pending')
+    # Bumped on every status change, so a stale read can't overwrite a newer decision.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
     offered_item = db.relationship('OfferedItem', foreign_keys=[item_offered_id])
     requested_item = db.relationship('RequestedItem', foreign_keys=[item_requested_id])
 
+    @classmethod
+    def transition(cls, trade_id, version, status):
+        """Move a pending trade to `status`, unless it changed since `version` was read.
+
+        A single conditional UPDATE, so of two concurrent calls at most one
+        matches. Returns whether this call made the change. The caller commits."""
+
+        if status not in cls.OUTCOMES:
+            raise ValueError(f"A pending trade can't become {status!r}.")
+
+        changed = db.session.execute(
+            db.update(cls)
+            .where(cls.id == trade_id, cls.status == cls.PENDING, cls.version == version)
+            .values(status=status, version=cls.version + 1, updated_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        return changed == 1
+
+    def can_respond(self, user_id):
+        """Whether `user_id` may accept or reject this trade: the recipient only."""
+
+        return self.recipient_id is not None and self.recipient_id == user_id
+
+    def respond(self, status, user_id):
+        """Accept or reject this trade as `user_id`, the recipient. The caller commits.
+
+        Accepting also invalidates, in one statement, every other pending
+        trade that would give away either of the two items. Returns False if
+        the trade was changed by someone else since it was loaded."""
+
+        if not Trade.transition(self.id, self.version, status):
+            return False
+
+        if status == 'Accepted':
+            initiator_id = self.offered_item.user_id
+            given_item_id = self.offered_item.item_id
+            received_item_id = self.requested_item.item_id
+            # Offers of either item by its owner, and requests to its owner for it.
+            offers = db.select(OfferedItem.id).where(db.or_(
+                db.and_(OfferedItem.user_id == initiator_id, OfferedItem.item_id == given_item_id),
+                db.and_(OfferedItem.user_id == user_id, OfferedItem.item_id == received_item_id)))
+            competing = db.or_(
+                Trade.item_offered_id.in_(offers),
+                db.and_(Trade.recipient_id == user_id, Trade.item_requested_id.in_(
+                    db.select(RequestedItem.id).where(RequestedItem.item_id == received_item_id))),
+                db.and_(Trade.recipient_id == initiator_id, Trade.item_requested_id.in_(
+                    db.select(RequestedItem.id).where(RequestedItem.item_id == given_item_id))),
+            )
+            db.session.execute(
+                db.update(Trade)
+                .where(Trade.status == Trade.PENDING, Trade.id != self.id, competing)
+                .values(status='Invalidated', version=Trade.version + 1, updated_at=datetime.now())
+                .execution_options(synchronize_session=False))
+
+        db.session.expire(self)
+        return True
+
+    @classmethod
+    def pending_for_user(cls, user_id, after=None, limit=20):
+        """Return a page of pending trades involving `user_id`, newest first.
+
+        `after` is the `(created_at, id)` of the last trade on the previous
+        page. Paging by that key instead of OFFSET keeps every page the same
+        cost, however long the user's history is. Each trade comes back with
+        its offered and requested items already loaded.
+
+        Returns `(trades, more)` where `more` says whether another page exists."""
+
+        offered = db.aliased(OfferedItem)
+        requested = db.aliased(RequestedItem)
+        query = (db.select(cls)
+                 .outerjoin(offered, cls.offered_item.of_type(offered))
+                 .outerjoin(requested, cls.requested_item.of_type(requested))
+                 .where(cls.status == 'Pending',
+                        db.or_(offered.user_id == user_id, requested.user_id == user_id,
+                               cls.recipient_id == user_id))
+                 .options(db.contains_eager(cls.offered_item.of_type(offered)).joinedload(offered.item),
+                          db.contains_eager(cls.requested_item.of_type(requested)).joinedload(requested.item))
+                 .order_by(cls.created_at.desc(), cls.id.desc())
+                 .limit(limit + 1))
+
+        if after is not None:
+            query = query.where(db.tuple_(cls.created_at, cls.id) < db.tuple_(*after))
+
+        trades = db.session.execute(query).scalars().all()
+        return trades[:limit], len(trades) > limit
+
+    def to_dict(self):
+        def listing(entry):
+            if entry is None or entry.item is None:
+                return None
+            return {
+                'id': entry.id,
+                'item_id': entry.item_id,
+                'title': entry.item.title,
+                'condition': entry.item.condition,
+                'image_url': entry.item.image_url,
+            }
+
+        return {
+            'id': self.id,
+            'status': self.status,
+            'version': self.version,
+            'recipient_id': self.recipient_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'offered_item': listing(self.offered_item),
+            'requested_item': listing(self.requested_item),
+        }
+
+
+class TradeEvent(db.Model):
+    """Something that happened to a trade, for `user_id` to hear about (see events.py).
+
+    Written in the same transaction as the trade change, and read back by
+    each worker's poller, so a user hears about it whichever worker they're on."""
+
+    __table_args__ = (
+        db.Index('ix_trade_event_user_id', 'user_id', 'id'),
+        db.Index('ix_trade_event_created_at', 'created_at'),
+    )
+
+    KINDS = ('created', 'accepted', 'rejected')
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    trade = db.relationship('Trade')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'trade_id': self.trade_id,
+            'kind': self.kind,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class SearchTerm(db.Model):
+    """When each search term was last fetched from eBay (see ingest.py)."""
+
+    # Longest normalized term that can be stored here or in ingest_job.
+    MAX_LENGTH = 200
+
+    term = db.Column(db.String(MAX_LENGTH), primary_key=True)
+    last_refreshed = db.Column(db.DateTime, nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class IngestJob(db.Model):
+    """A queued eBay refresh for one search term.
+
+    Jobs are deleted once they succeed; failed ones are kept for inspection."""
+
+    __table_args__ = (
+        # At most one queued or running job per term, however many searches ask for it.
+        db.Index('uq_ingest_job_active_term', 'term', unique=True,
+                 postgresql_where=db.text("status IN ('queued', 'running')"),
+                 sqlite_where=db.text("status IN ('queued', 'running')")),
+        db.Index('ix_ingest_job_status_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(SearchTerm.MAX_LENGTH), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+
+
+def insert_ignoring_conflicts(model):
+    """INSERT for `model` that skips rows hitting a unique constraint.
+
+    Postgres and SQLite both spell this ON CONFLICT DO NOTHING, but each
+    needs its own dialect construct. It is built on the table rather than
+    the model: column defaults that read the row (Item.fingerprint) can't
+    see it in a multi-row insert of an ORM entity."""
+
+    table = model.__table__
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return postgresql.insert(table).on_conflict_do_nothing()
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
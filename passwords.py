@@ -0,0 +1,105 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt releases the GIL while it works, so a small thread pool lets several
+hashes run on separate cores while the number of hashes in flight stays
+capped. Once the pool and its queue are full, new work is refused with
+HasherBusy instead of piling up behind the requests already waiting.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from extensions import AppLocal
+from metrics import PASSWORD_HASH_SECONDS
+
+
+class HasherBusy(Exception):
+    """Every worker and queue slot is taken."""
+
+
+class PasswordHasher(object):
+    """bcrypt hashing and checking on a bounded thread pool.
+
+    Configured from the app with init_app(): BCRYPT_LOG_ROUNDS is the work
+    factor for new hashes, PASSWORD_HASH_WORKERS the pool size,
+    PASSWORD_HASH_QUEUE how many more hashes may wait for a worker, and
+    PASSWORD_HASH_QUEUE_TIMEOUT how long (seconds) a caller waits for a slot
+    before HasherBusy is raised.
+    """
+
+    def __init__(self, rounds=12, workers=4, max_queue=16, queue_timeout=0.5):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.max_queue = app.config.get('PASSWORD_HASH_QUEUE', self.max_queue)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', self.queue_timeout)
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost, as text."""
+
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, hashed, password):
+        """Return whether `password` matches `hashed`."""
+
+        try:
+            return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+        except ValueError:
+            # Not a bcrypt hash at all.
+            return False
+
+    def needs_rehash(self, hashed):
+        """Whether `hashed` was made with a different cost than the current one."""
+
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            self._executor = None
+            self._slots = None
+
+    def _pool(self):
+        # Built on first use rather than at import, so a pool is never
+        # inherited across a fork.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+            return self._executor, self._slots
+
+    def _run(self, fn, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusy()
+
+        try:
+            future = executor.submit(_timed, fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future.result()
+
+
+def _timed(fn, *args):
+    with PASSWORD_HASH_SECONDS.time(operation=fn.__name__):
+        return fn(*args)
+
+
+password_hasher = AppLocal('password_hasher', PasswordHasher)
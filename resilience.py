@@ -0,0 +1,174 @@
+"""Retries, circuit breaking and call stats for an upstream service.
+
+UpstreamGuard.call() runs one upstream request. Retryable failures are
+retried with jittered exponential backoff. After `failure_threshold` calls
+in a row have failed, the circuit opens and calls fail at once with
+CircuitOpen for `reset_timeout` seconds. After that, one trial call is let
+through, and its result either closes the circuit or opens it again.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from ebaysdk.exception import ConnectionError
+
+from metrics import UPSTREAM_CALLS, UPSTREAM_SECONDS
+
+
+class CircuitOpen(ConnectionError):
+    """The upstream has been failing; the call was not attempted."""
+
+
+def is_retryable(error):
+    """Network errors, timeouts, 5xx and 429 are worth another try; bad requests aren't."""
+
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, requests.RequestException):
+        return True
+    if isinstance(error, ConnectionError):
+        status = getattr(error.response, 'status_code', None)
+        return status is not None and (status >= 500 or status == 429)
+    return False
+
+
+class UpstreamGuard(object):
+    """Retry policy, circuit breaker and latency/error counters around one upstream.
+
+    Configured from the app with init_app(), reading `<PREFIX>_RETRIES`,
+    `<PREFIX>_BACKOFF` and `<PREFIX>_MAX_BACKOFF` (seconds),
+    `<PREFIX>_BREAKER_THRESHOLD` and `<PREFIX>_BREAKER_RESET` (seconds).
+    """
+
+    def __init__(self, prefix, retries=2, backoff=0.2, max_backoff=2.0, failure_threshold=5,
+                 reset_timeout=30, clock=time.monotonic, sleep=time.sleep, jitter=random.uniform):
+        self.prefix = prefix
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self.reset()
+
+    def init_app(self, app):
+        config = app.config
+        self.retries = config.get(self.prefix + '_RETRIES', self.retries)
+        self.backoff = config.get(self.prefix + '_BACKOFF', self.backoff)
+        self.max_backoff = config.get(self.prefix + '_MAX_BACKOFF', self.max_backoff)
+        self.failure_threshold = config.get(self.prefix + '_BREAKER_THRESHOLD', self.failure_threshold)
+        self.reset_timeout = config.get(self.prefix + '_BREAKER_RESET', self.reset_timeout)
+        self.reset()
+
+    def reset(self):
+        """Close the circuit and zero the counters."""
+
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_running = False
+            self.counts = {'calls': 0, 'attempts': 0, 'successes': 0, 'failures': 0,
+                           'retries': 0, 'rejected': 0}
+            self.latencies = deque(maxlen=1000)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def allows_calls(self):
+        """Whether a call now would be attempted rather than rejected."""
+
+        return self.state != 'open'
+
+    def call(self, fn, *args, **kwargs):
+        """Run `fn`, retrying retryable errors. Raises CircuitOpen without calling it if the circuit is open."""
+
+        with self._lock:
+            self.counts['calls'] += 1
+            if not self._admit():
+                self.counts['rejected'] += 1
+                UPSTREAM_CALLS.inc(upstream=self.prefix.lower(), result='rejected')
+                raise CircuitOpen('%s: circuit open after %d failures' % (self.prefix, self.consecutive_failures))
+
+        attempt = 0
+        while True:
+            start = self.clock()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retry = is_retryable(e) and attempt < self.retries
+                self._record(self.clock() - start, ok=False, final=not retry, counts=is_retryable(e))
+                if not retry:
+                    raise
+                attempt += 1
+                self.sleep(self.jitter(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+                continue
+
+            self._record(self.clock() - start, ok=True, final=True)
+            return result
+
+    def snapshot(self):
+        """Circuit state, counters and recent latency percentiles (ms), for /health."""
+
+        with self._lock:
+            latencies = sorted(self.latencies)
+            stats = dict(self.counts, state=self._state(), consecutive_failures=self.consecutive_failures)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+        stats['latency_ms'] = {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99)}
+        return stats
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def _admit(self):
+        state = self._state()
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.trial_running:
+            # Let exactly one call find out whether the upstream is back.
+            self.trial_running = True
+            return True
+        return False
+
+    def _record(self, elapsed, ok, final, counts=True):
+        upstream = self.prefix.lower()
+        UPSTREAM_SECONDS.observe(elapsed, upstream=upstream, outcome='ok' if ok else 'error')
+        if final:
+            UPSTREAM_CALLS.inc(upstream=upstream, result='ok' if ok else 'error')
+
+        with self._lock:
+            self.counts['attempts'] += 1
+            self.latencies.append(elapsed)
+            if not final:
+                self.counts['retries'] += 1
+                return
+
+            self.trial_running = False
+            if ok:
+                self.counts['successes'] += 1
+                self.consecutive_failures = 0
+                self.opened_at = None
+                return
+
+            self.counts['failures'] += 1
+            # Errors that say nothing about the upstream's health (e.g. a bad
+            # request) don't move the breaker.
+            if not counts:
+                return
+            self.consecutive_failures += 1
+            if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = self.clock()
@@ -0,0 +1,738 @@
+"""The app's views, registered on the `main` blueprint by create_app()."""
+
+from collections import deque
+from datetime import datetime, timedelta
+
+import click
+from flask import (Blueprint, current_app, render_template, request, flash, redirect, session, g, url_for,
+                   jsonify, Response)
+from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.local import LocalProxy
+
+import assets
+import dedup
+import ingest
+import metrics
+from cache import ebay_cache, normalize_term
+from conditional import conditional, user_versions
+from database import read_only
+from ebay_24 import ebay_guard
+from events import trade_events, format_event, TooManyStreams
+from forms import UserAddForm, LoginForm, EditProfileForm
+from fragments import fragment_cache
+from identity import identity_cache
+from instrumentation import query_budget
+from matching import match_index
+from models import db, User, Item, OfferedItem, RequestedItem, Trade, SearchTerm, insert_ignoring_conflicts
+from passwords import HasherBusy
+from search import search_items
+
+CURR_USER_KEY = "curr_user"
+TRADES_PER_PAGE = 20
+MAX_TRADES_PER_PAGE = 100
+# Endpoints that never need the logged-in user.
+ANONYMOUS_ENDPOINTS = {'static', 'main.health', 'main.metrics'}
+
+# cli_group=None puts the commands at the top level: `flask ingest-worker`.
+bp = Blueprint('main', __name__, cli_group=None)
+
+
+def load_current_user():
+    """Return the logged-in user, querying for it at most once per request."""
+
+    if '_current_user' not in g:
+        user_id = session.get(CURR_USER_KEY)
+        g._current_user = identity_cache.load(user_id) if user_id is not None else None
+    return g._current_user
+
+
+@bp.before_app_request
+def add_user_to_g():
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a proxy, so the user is only loaded if the view or template
+    actually uses it."""
+
+    g.pop('_current_user', None)
+    if request.endpoint in ANONYMOUS_ENDPOINTS:
+        g.user = None
+    else:
+        g.user = LocalProxy(load_current_user)
+
+
+def do_login(user):
+    """Log in user."""
+
+    session[CURR_USER_KEY] = user.id
+
+
+def do_logout():
+    """Logout user."""
+
+    if CURR_USER_KEY in session:
+        del session[CURR_USER_KEY]
+
+
+@bp.route('/health')
+def health():
+    """Liveness check for the load balancer, with the eBay client's circuit state and call stats.
+
+    Stays 200 while eBay is down: searches still work from the database."""
+
+    ebay = ebay_guard.snapshot()
+    return jsonify({"status": "ok" if ebay['state'] == 'closed' else "degraded", "ebay": ebay})
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Request, database pool, eBay and bcrypt metrics for every worker, in Prometheus text format."""
+
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/')
+def homepage():
+    """Displays the homepage of Tradebay."""
+
+    return render_template('index.html')
+
+@bp.route('/signup', methods=["GET", "POST"])
+def signup():
+    """Handle user signup.
+    
+    Create new user and add to DB. Redirect to home page.
+    
+    If form not valid, present form.
+    
+    If there already is a user with that username: flash message and re-present form."""
+
+    form = UserAddForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.signup(
+                username=form.username.data,
+                password=form.password.data,
+                email=form.email.data,
+            )
+            db.session.commit()
+
+        except IntegrityError:
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+        except HasherBusy:
+            db.session.rollback()
+            flash("We're very busy right now. Please try again in a moment.", 'danger')
+            return render_template('users/signup.html', form=form), 503
+        
+        do_login(user)
+
+        return redirect("/")
+    
+    else: 
+        current_app.logger.debug("Signup form is invalid: %s", form.errors)
+        return render_template('users/signup.html', form=form)
+    
+
+@bp.route('/login', methods=["GET", "POST"])
+def login():
+    """Handle user login."""
+
+    form = LoginForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except HasherBusy:
+            flash("We're very busy right now. Please try again in a moment.", 'danger')
+            return render_template('users/login.html', form=form), 503
+
+        if user:
+            # Saves the password if authenticate() rehashed it at the current cost.
+            db.session.commit()
+            do_login(user)
+            flash(f"Hello, {user.username}!", "success")
+            return redirect(f"/user/{user.id}")
+
+        flash("Invalid credentials.", 'danger')
+
+    return render_template('users/login.html', form=form)
+
+
+@bp.route('/logout')
+def logout():
+    """Handle logout of user."""
+
+    flash('Goodbye!')
+    session.pop('curr_user')
+    return redirect('/login')
+
+
+@bp.route('/add-offered-item', methods=['POST'])
+def add_offered_item():
+    """Add an item to the user's offered items list."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+
+    data = request.get_json()
+    item_id = data.get('item_id')
+
+    if not item_id:
+        return jsonify({"success": False, "error": "Item not found."}), 400
+
+    # Fetch the item and add it to the offered items list
+    item = Item.query.get(item_id)
+    if not item:
+        return jsonify({"success": False, "error": "Item does not exist."}), 404
+    
+    offered_item = OfferedItem(user_id=g.user.id, item_id=item_id)
+    db.session.add(offered_item)
+
+    # The unique (user_id, item_id) index rejects duplicates, even from concurrent requests.
+    try:
+        User.touch(g.user.id)
+        Item.touch([item.id])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"success": False, "error": "Item already in your offered items list."}), 400
+
+    match_index.add_offer(g.user.id, item.id)
+    fragment_cache.invalidate('offered-items', g.user.id)
+    fragment_cache.invalidate('item-card', item.id)
+
+    return jsonify({"success": True})
+
+
+@bp.route('/add-requested-item', methods=['POST'])
+def add_requested_item():
+    """Add an item to the user's requested items list."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+    
+    data = request.get_json()
+    item_id = data.get('item_id')
+
+    if not item_id:
+        return jsonify({"success": False, "error": "Item not found."}), 400
+
+    # Fetch the item and add it to the requested items list
+    item = Item.query.get(item_id)
+    if not item:
+        return jsonify({"success": False, "error": "Item does not exist."}), 404
+    
+    requested_item = RequestedItem(user_id=g.user.id, item_id=item_id)
+    db.session.add(requested_item)
+
+    # The unique (user_id, item_id) index rejects duplicates, even from concurrent requests.
+    try:
+        User.touch(g.user.id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"success": False, "error": "Item already in your requested items list."}), 400
+
+    match_index.add_request(g.user.id, item.id)
+    fragment_cache.invalidate('requested-items', g.user.id)
+
+    return jsonify({"success": True})
+
+
+def search_validator():
+    """The search page changes with a refresh of its term, with who offers what, and with the viewer."""
+
+    term = request.args.get('q')
+    if not term:
+        return None
+
+    refreshed, items_changed, viewer_version = db.session.execute(db.select(
+        db.select(SearchTerm.last_refreshed).where(SearchTerm.term == normalize_term(term)).scalar_subquery(),
+        db.select(db.func.max(Item.updated_at)).scalar_subquery(),
+        db.select(User.version).where(User.id == session.get(CURR_USER_KEY)).scalar_subquery(),
+    )).one()
+
+    # A missing or stale term makes the view queue a refresh and say so.
+    max_age = timedelta(seconds=current_app.config['SEARCH_REFRESH_TTL'])
+    if refreshed is None or datetime.now() - refreshed >= max_age:
+        return None
+    return refreshed, items_changed, viewer_version
+
+
+@bp.route('/items/search', methods=['GET'])
+@read_only
+@query_budget(7)
+@conditional(search_validator, max_age_setting='SEARCH_CACHE_MAX_AGE')
+def search():
+    term = request.args.get('q')
+    if not term:
+        flash("You must enter a search term.", "danger")
+        return redirect(request.referrer)
+    if len(normalize_term(term)) > SearchTerm.MAX_LENGTH:
+        flash("Search terms can be at most %d characters long." % SearchTerm.MAX_LENGTH, "danger")
+        return redirect(request.referrer or "/")
+    
+    # Serve what's already stored; a worker fetches from eBay in the background.
+    max_age = current_app.config['SEARCH_REFRESH_TTL']
+    refreshing = False
+    if not current_app.config['INGEST_INLINE']:
+        refreshing = ingest.enqueue_refresh(term, max_age)
+        db.session.commit()
+    elif not ingest.is_fresh(term, max_age):
+        try:
+            ingest.refresh(term, current_app.config['EBAY_API_KEY'], cache=ebay_cache, pages=current_app.config['INGEST_PAGES'])
+            db.session.commit()
+        except ingest.RefreshFailed:
+            db.session.rollback()
+            flash("eBay isn't responding right now, so these are the listings we already have.", "warning")
+
+    # Query database for items matching the search term
+    items = search_items(term, limit=10)
+
+    # Users offering each item, with a count of any beyond the first few
+    item_users = OfferedItem.offerers_for([item.id for item in items])
+
+    # Render items on a template
+    return render_template('items/search.html', items=items, item_users=item_users, refreshing=refreshing)
+
+
+@bp.cli.command('ingest-worker')
+@click.option('--once', is_flag=True, help='Exit once the queue is empty.')
+@click.option('--poll-interval', default=1.0, show_default=True, help='Seconds to wait when the queue is empty.')
+def ingest_worker_command(once, poll_interval):
+    """Fetch queued search terms from eBay and store the listings."""
+
+    processed = ingest.work(current_app.config['EBAY_API_KEY'], cache=ebay_cache, once=once, poll_interval=poll_interval,
+                            max_attempts=current_app.config['INGEST_MAX_ATTEMPTS'], pages=current_app.config['INGEST_PAGES'])
+    click.echo(f"Processed {processed} ingest jobs.")
+
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Write content-hashed, precompressed copies of the static files."""
+
+    manifest = assets.build(current_app.static_folder, current_app.config['ASSETS_DIR'])
+    click.echo(f"Built {len(manifest)} static files into static/{current_app.config['ASSETS_DIR']}.")
+
+
+@bp.route('/trade-items')
+@query_budget(4)
+@conditional(user_versions)
+def list_items():
+    """Display the user's offered and requested items."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+    
+    user = g.user
+    
+    offered_items = OfferedItem.for_user(user.id)
+    requested_items = RequestedItem.for_user(user.id)
+
+    return render_template('users/item_lists.html', offered_items=offered_items, requested_items=requested_items)
+    
+
+@bp.route('/initiate-trade', methods=['POST'])
+def initiate_trade():
+    """Initiate a trade between the current user and another user."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+    
+    data = request.get_json()
+    your_item_id = data.get('your_item_id')
+    their_item_id = data.get('their_item_id')
+    current_app.logger.debug("Trade requested: item %s for item %s", your_item_id, their_item_id)
+    if not your_item_id or not their_item_id:
+        return jsonify({"success": False, "error": "Both items must be selected."}), 400
+    
+    # Ensure that 'your_item_id' belongs to the current user
+    your_item = OfferedItem.query.filter_by(user_id=g.user.id, id=your_item_id).first()
+    if not your_item:
+        return jsonify({"success": False, "error": "The item you're offering doesn't belong to you."}), 400
+
+    # Ensure that 'their_item_id' belongs to the other user (not the current user)
+    their_item = OfferedItem.query.filter(OfferedItem.id == their_item_id, OfferedItem.user_id != g.user.id).first()
+    if not their_item:
+        return jsonify({"success": False, "error": "The other user's item was not found or already traded."}), 400
+
+    # Add their item to the current user's requested list, unless it's already there.
+    # The unique (user_id, item_id) index settles concurrent requests for the same item.
+    added = db.session.execute(insert_ignoring_conflicts(RequestedItem).values(
+        user_id=g.user.id, item_id=their_item.item_id)).rowcount
+    if added:
+        User.touch(g.user.id)
+    requested_item = RequestedItem.query.filter_by(item_id=their_item.item_id, user_id=g.user.id).one()
+
+    # Create the trade record
+    trade = Trade(
+        offered_item=your_item,
+        requested_item=requested_item,
+        recipient_id=their_item.user_id,
+        status='Pending'
+    )
+    
+    db.session.add(trade)
+    trade_events.publish(their_item.user_id, trade, 'created')
+    db.session.commit()
+
+    match_index.add_request(g.user.id, their_item.item_id)
+    fragment_cache.invalidate('requested-items', g.user.id)
+
+    return jsonify({"success": True})
+
+######################################################
+# General user routes:
+
+# @bp.route('/users')
+
+@bp.route('/user/<int:user_id>')
+@read_only
+@query_budget(5)
+@conditional(lambda user_id: user_versions(user_id))
+def user_profile(user_id):
+    """Display the user's profile and their offered items."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+
+    other_user = User.query.get(user_id)
+    if not other_user:
+        return "User not found", 404
+
+    curr_user = g.user
+    offered_items = OfferedItem.for_user(user_id)
+    requested_items = RequestedItem.for_user(user_id)
+
+    return render_template('users/user_profile.html', curr_user=curr_user, other_user=other_user, offered_items=offered_items, requested_items=requested_items)
+
+
+@bp.route('/remove-item', methods=['DELETE'])
+def remove_item():
+    """Remove an item from the offered or requested list."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+
+    # Get the item ID and type from the request body
+    data = request.get_json()
+    item_id = data.get('item_id')
+    item_type = data.get('item_type')  # Expecting either "offered" or "requested"
+
+    if item_id is None or item_type is None:
+        return jsonify({"success": False, "error": "Item ID and type are required."}), 400
+
+    # Depending on the type, remove the item from the appropriate model
+    if item_type == "offered":
+        offered_item = OfferedItem.query.filter_by(item_id=item_id, user_id=g.user.id).first()
+        if offered_item:
+            match_index.remove_offer(g.user.id, offered_item.item_id)
+            db.session.delete(offered_item)
+            User.touch(g.user.id)
+            Item.touch([offered_item.item_id])
+            db.session.commit()
+            fragment_cache.invalidate('offered-items', g.user.id)
+            fragment_cache.invalidate('item-card', offered_item.item_id)
+            return jsonify({"success": True})
+
+    elif item_type == "requested":
+        requested_item = RequestedItem.query.filter_by(item_id=item_id, user_id=g.user.id).first()
+        if requested_item:
+            match_index.remove_request(g.user.id, requested_item.item_id)
+            db.session.delete(requested_item)
+            User.touch(g.user.id)
+            db.session.commit()
+            fragment_cache.invalidate('requested-items', g.user.id)
+            return jsonify({"success": True})
+
+    return jsonify({"success": False, "error": "Item not found in the specified list."}), 404
+
+
+@bp.route('/user/<int:other_user_id>/trade-items')
+@read_only
+@query_budget(5)
+@conditional(lambda other_user_id: user_versions(other_user_id))
+def trade_items(other_user_id):
+    """Display trade items for the other user."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+    
+    # Get the current user
+    current_user_id = g.user.id
+
+    # Fetch the other user based on the provided ID
+    other_user = User.query.get(other_user_id)
+
+    # Check if the other user exists
+    if not other_user:
+        return "User not found", 404
+
+    # Get offered items for the current user and the other user
+    user_offered_items = OfferedItem.for_user(current_user_id)
+    other_user_offered_items = OfferedItem.for_user(other_user_id)
+
+    # Render the trade items template with the user data
+    return render_template('users/trade_items.html', user_offered_items=user_offered_items, other_user=other_user, other_user_offered_items=other_user_offered_items)
+
+
+def encode_trade_cursor(trade):
+    """Opaque pagination cursor pointing just past `trade`."""
+
+    return f"{trade.created_at.isoformat()}_{trade.id}"
+
+
+def decode_trade_cursor(cursor):
+    """Turn a cursor back into `(created_at, id)`; None if missing or malformed."""
+
+    if not cursor:
+        return None
+    created_at, _, trade_id = cursor.rpartition('_')
+    try:
+        return datetime.fromisoformat(created_at), int(trade_id)
+    except ValueError:
+        return None
+
+
+def pending_trades_page():
+    """Load the page of pending trades named by the `after` and `limit` query args."""
+
+    limit = min(request.args.get('limit', TRADES_PER_PAGE, type=int), MAX_TRADES_PER_PAGE)
+    after = decode_trade_cursor(request.args.get('after'))
+    trades, more = Trade.pending_for_user(g.user.id, after=after, limit=max(limit, 1))
+    next_cursor = encode_trade_cursor(trades[-1]) if more else None
+    return trades, next_cursor
+
+
+@bp.route('/user/pending-trades')
+@read_only
+@query_budget(3)
+def pending_trades():
+    """Show the pending trades involving the current user, one page at a time."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+
+    trades, next_cursor = pending_trades_page()
+
+    return render_template('users/pending_trades.html', trades=trades, next_cursor=next_cursor)
+
+
+@bp.route('/user/pending-trades.json')
+@read_only
+@query_budget(3)
+def pending_trades_json():
+    """JSON version of the pending trades page."""
+    if (g.user == None):
+        return jsonify({"success": False, "error": "You must log in first."}), 401
+
+    trades, next_cursor = pending_trades_page()
+
+    return jsonify({"trades": [trade.to_dict() for trade in trades], "next_cursor": next_cursor})
+
+
+def respond_to_trade(trade_id, status):
+    """Accept or reject a trade for the current user, who must be its recipient."""
+
+    trade = db.session.get(Trade, trade_id)
+
+    if not trade or trade.status != 'Pending':
+        return jsonify({"success": False, "error": "Trade not found or already processed."}), 404
+
+    if not trade.can_respond(g.user.id):
+        return jsonify({"success": False, "error": "Only the user this trade was offered to can answer it."}), 403
+
+    initiator_id = trade.offered_item.user_id
+    try:
+        changed = trade.respond(status, g.user.id)
+        if changed:
+            trade_events.publish(initiator_id, trade, status.lower())
+        db.session.commit()
+    except OperationalError:
+        # Lost a lock race (e.g. a deadlock with a competing accept); nothing was saved.
+        db.session.rollback()
+        changed = False
+
+    if not changed:
+        return jsonify({"success": False, "error": "This trade was just changed by someone else. Please reload."}), 409
+
+    return jsonify({"success": True, "message": f"Trade {status.lower()}!"})
+
+
+@bp.route('/accept-trade/<int:trade_id>', methods=['POST'])
+def accept_trade(trade_id):
+    """Accept a pending trade, invalidating the others for the same items."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+
+    return respond_to_trade(trade_id, 'Accepted')
+
+
+@bp.route('/reject-trade/<int:trade_id>', methods=['POST'])
+def reject_trade(trade_id):
+    """Reject a pending trade."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+
+    return respond_to_trade(trade_id, 'Rejected')
+
+
+@bp.route('/user/events')
+def trade_event_stream():
+    """Server-sent events for the current user's trades: created, accepted, rejected.
+
+    A reconnecting browser sends Last-Event-ID and first gets what it missed.
+    Each open stream holds a worker thread, so a worker with EVENTS_MAX_STREAMS
+    open answers 503 and the browser tries again later."""
+    if (g.user == None):
+        return jsonify({"success": False, "error": "You must log in first."}), 401
+
+    user_id = g.user.id
+    heartbeat = current_app.config['EVENTS_HEARTBEAT']
+    retry = current_app.config['EVENTS_RETRY_MS']
+    # The stream below outlives the app context, so hold on to this app's instance.
+    events = trade_events._get_current_object()
+    try:
+        subscription = events.subscribe(user_id)
+    except TooManyStreams:
+        return Response('retry: %d\n\n' % retry, status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(max(1, retry // 1000))})
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    try:
+        missed = events.backlog(user_id, last_id) if last_id is not None else []
+    except Exception:
+        events.unsubscribe(subscription)
+        raise
+
+    # The stream runs after the request has ended (and its database session
+    # is released), so it only reads the subscription's queue.
+    def stream():
+        # Ids can commit out of order, so an event may arrive after a higher
+        # one; only events already sent on this stream are skipped.
+        sent = deque(maxlen=2 * events.queue_size)
+        try:
+            yield 'retry: %d\n\n' % retry
+            for event in missed:
+                sent.append(event['id'])
+                yield format_event(event)
+            while not subscription.closed:
+                event = subscription.get(heartbeat)
+                if event is None:
+                    # Keeps proxies from timing out an idle connection.
+                    yield ': keep-alive\n\n'
+                elif event['id'] not in sent:
+                    sent.append(event['id'])
+                    yield format_event(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/user/matches')
+@query_budget(4)
+def user_matches():
+    """Direct matches and trade cycles for the current user, as JSON."""
+    if (g.user == None):
+        return jsonify({"success": False, "error": "You must log in first."}), 401
+
+    max_length = request.args.get('max_length', 3, type=int)
+    max_length = min(max_length, current_app.config['MATCH_MAX_CYCLE_LENGTH'])
+
+    match_index.ensure_loaded()
+
+    return jsonify({
+        "direct": match_index.direct_matches(g.user.id),
+        "cycles": match_index.trade_cycles(g.user.id, max_length=max_length),
+    })
+
+
+@bp.cli.command('find-matches')
+@click.argument('user_id', type=int)
+@click.option('--max-length', default=3, show_default=True, help='Longest trade cycle to look for.')
+def find_matches_command(user_id, max_length):
+    """Print direct matches and trade cycles for USER_ID."""
+
+    match_index.load()
+
+    for match in match_index.direct_matches(user_id):
+        click.echo(f"direct: user {match['user_id']} gives items {match['you_get']} "
+                   f"for items {match['they_get']}")
+
+    for cycle in match_index.trade_cycles(user_id, max_length=max_length):
+        click.echo("cycle: " + ", ".join(
+            f"user {step['user_id']} gets item {step['gets']} from user {step['from']}" for step in cycle))
+
+
+@bp.cli.command('merge-duplicates')
+@click.option('--threshold', type=float, help='Share of title words in common; defaults to ITEM_MERGE_THRESHOLD.')
+@click.option('--batch-size', default=500, show_default=True, help='Groups merged per transaction.')
+@click.option('--dry-run', is_flag=True, help='Print the groups without merging them.')
+def merge_duplicates_command(threshold, batch_size, dry_run):
+    """Merge items whose titles are near-duplicates into the oldest of them."""
+
+    if threshold is None:
+        threshold = current_app.config['ITEM_MERGE_THRESHOLD']
+    rows = db.session.execute(db.select(Item.id, Item.title, Item.condition).execution_options(yield_per=1000))
+    groups = dedup.find_duplicates(rows.tuples(), threshold=threshold)
+
+    if dry_run:
+        for group in groups:
+            click.echo("would merge items " + ", ".join(map(str, group)))
+        return
+
+    removed = 0
+    for start in range(0, len(groups), batch_size):
+        removed += dedup.merge(groups[start:start + batch_size])
+        db.session.commit()
+    click.echo(f"Merged {removed} items into {len(groups)}.")
+
+
+@bp.route('/user/<int:user_id>/edit', methods=['GET', 'POST'])
+def edit_profile(user_id):
+    """Displays the form to edit the User's Profile information."""
+    if (g.user == None):
+        flash("You must log in first.")
+        form = LoginForm()
+        return render_template('users/login.html', form=form)
+    
+    user = User.query.get_or_404(user_id)
+
+    if user_id != g.user.id:
+        flash("You dont have permission to edit this profile.", "danger")
+        return redirect(url_for('main.user_profile', user_id=g.user.id))
+
+    form = EditProfileForm(obj=user)
+
+    if form.validate_on_submit():
+        user.username = form.username.data
+        user.email = form.email.data
+        user.image_url = form.image_url.data if form.image_url.data else None
+        User.touch(user.id)
+        # Search pages show who offers each item.
+        offered_ids = db.session.scalars(db.select(OfferedItem.item_id).where(OfferedItem.user_id == user.id)).all()
+        Item.touch(offered_ids)
+        db.session.commit()
+        for item_id in offered_ids:
+            fragment_cache.invalidate('item-card', item_id)
+        flash('Profile updated successfully!', 'success')
+        return redirect(url_for('main.user_profile', user_id=user.id))
+
+    return render_template('users/edit_profile.html', form=form, user=user)
+
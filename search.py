@@ -0,0 +1,86 @@
+"""Indexed item search.
+
+search_items() is the one entry point the views use. On Postgres it runs a
+substring match backed by a pg_trgm GIN index and ranks by trigram
+similarity. On SQLite (the test config) it queries an FTS5 trigram table
+that triggers keep in sync with `item`.
+"""
+
+from sqlalchemy import DDL, event
+
+from models import db, Item
+
+# Trigram indexes can't help with terms shorter than one trigram.
+MIN_INDEXED_LENGTH = 3
+
+# Only this many index hits are ranked, so broad terms cost the same as narrow ones.
+RANK_CANDIDATES = 500
+
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    "title, content='item', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN "
+    "INSERT INTO item_fts (rowid, title) VALUES (new.id, new.title); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN "
+    "INSERT INTO item_fts (item_fts, rowid, title) VALUES ('delete', old.id, old.title); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_update AFTER UPDATE OF title ON item BEGIN "
+    "INSERT INTO item_fts (item_fts, rowid, title) VALUES ('delete', old.id, old.title); "
+    "INSERT INTO item_fts (rowid, title) VALUES (new.id, new.title); END",
+]
+
+# The GIN index itself is declared on Item; the extension has to exist first.
+event.listen(Item.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+for statement in SQLITE_FTS_DDL:
+    event.listen(Item.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+event.listen(Item.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS item_fts').execute_if(dialect='sqlite'))
+
+
+def search_items(term, limit=10):
+    """Return up to `limit` items whose title contains `term`, best matches first."""
+
+    term = term.strip()
+    dialect = db.session.get_bind().dialect.name
+
+    if len(term) < MIN_INDEXED_LENGTH:
+        return _scan(term, limit)
+    if dialect == 'postgresql':
+        return _search_postgres(term, limit)
+    if dialect == 'sqlite':
+        return _search_sqlite(term, limit)
+    return _scan(term, limit)
+
+
+def _scan(term, limit):
+    return Item.query.filter(Item.title.ilike(f'%{_escape_like(term)}%', escape='\\')).limit(limit).all()
+
+
+def _search_postgres(term, limit):
+    # ILIKE is answered from the gin_trgm_ops index; similarity() only ranks the hits.
+    candidates = (db.select(Item.id)
+                  .where(Item.title.ilike(f'%{_escape_like(term)}%', escape='\\'))
+                  .limit(RANK_CANDIDATES)
+                  .scalar_subquery())
+    return (Item.query
+            .filter(Item.id.in_(candidates))
+            .order_by(db.func.similarity(Item.title, term).desc(), Item.id)
+            .limit(limit)
+            .all())
+
+
+def _search_sqlite(term, limit):
+    # A quoted phrase over trigram tokens is a case-insensitive substring match.
+    phrase = '"%s"' % term.replace('"', '""')
+    query = db.text(
+        'SELECT item.* FROM ('
+        ' SELECT rowid, rank FROM item_fts WHERE item_fts MATCH :phrase LIMIT :candidates'
+        ') AS hit JOIN item ON item.id = hit.rowid ORDER BY hit.rank LIMIT :limit'
+    ).bindparams(phrase=phrase, candidates=RANK_CANDIDATES, limit=limit)
+    return db.session.execute(db.select(Item).from_statement(query)).scalars().all()
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
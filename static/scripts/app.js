@@ -1,94 +1,58 @@
+// Sends `body` as JSON to `url` with the page's CSRF token, and alerts on failure.
+// `onSuccess` gets the parsed response when it reports success.
+function sendJSON(url, method, body, onSuccess) {
+    const headers = { 'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content };
+    const options = { method: method, headers: headers };
+    if (body !== undefined) {
+        headers['Content-Type'] = 'application/json';
+        options.body = JSON.stringify(body);
+    }
 
-document.addEventListener('DOMContentLoaded', function () {
-    // Event listener for offer item button
-    document.querySelectorAll('.offer-item-btn').forEach(button => {
-        button.addEventListener('click', function () {
-            const itemId = this.dataset.itemId;
+    fetch(url, options)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                onSuccess(data);
+            } else {
+                alert(data.error);
+            }
+        })
+        .catch(error => console.error('Error:', error));
+}
 
-            // Send AJAX request to add-offered-item route
-            fetch('/add-offered-item', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': '{{ csrf_token() }}'
-                },
-                body: JSON.stringify({ item_id: itemId })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    alert('Item successfully added to offered items list');
-                } else {
-                    alert(data.error);
-                }
-            })
-            .catch(error => console.error('Error:', error));
+// Calls `handler` with the clicked element for clicks on anything matching `selector`.
+function onClick(selector, handler) {
+    document.querySelectorAll(selector).forEach(element => {
+        element.addEventListener('click', function () {
+            handler(this);
         });
     });
+}
 
-    // Event listener for request item button
-    document.querySelectorAll('.request-item-btn').forEach(button => {
-        button.addEventListener('click', function () {
-            const itemId = this.dataset.itemId;
-
-            // Send AJAX request to add-requested-item route
-            fetch('/add-requested-item', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': '{{ csrf_token() }}'
-                },
-                body: JSON.stringify({ item_id: itemId })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    alert('Item successfully added to requested items list');
-                } else {
-                    alert(data.error);
-                }
-            })
-            .catch(error => console.error('Error:', error));
+document.addEventListener('DOMContentLoaded', function () {
+    // Offering and requesting items
+    onClick('.offer-item-btn', button => {
+        sendJSON('/add-offered-item', 'POST', { item_id: button.dataset.itemId }, () => {
+            alert('Item successfully added to offered items list');
         });
     });
-});
-
-document.addEventListener('DOMContentLoaded', function () {
-    // Event listener for remove item button
-    document.querySelectorAll('.remove-item-btn').forEach(button => {
-        button.addEventListener('click', function () {
-            const itemId = this.dataset.itemId;
-            const itemType = this.dataset.itemType;
 
-            fetch('/remove-item', {
-                method: 'DELETE',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': '{{ csrf_token() }}'
-                },
-                body: JSON.stringify({ item_id: itemId, item_type: itemType })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    alert('Item successfully removed from list!');
-                    // Optionally refresh the page or remove the item from the DOM
-                    window.location.reload();  // Reload to see the updated list
-                } else {
-                    alert(data.error);
-                }
-            })
-            .catch(error => console.error('Error:', error));
+    onClick('.request-item-btn', button => {
+        sendJSON('/add-requested-item', 'POST', { item_id: button.dataset.itemId }, () => {
+            alert('Item successfully added to requested items list');
         });
     });
-});
 
-//Initiating a Trade
-document.addEventListener('DOMContentLoaded', function () {
-    const tradeButton = document.getElementById('initiate-trade-btn');
+    onClick('.remove-item-btn', button => {
+        const body = { item_id: button.dataset.itemId, item_type: button.dataset.itemType };
+        sendJSON('/remove-item', 'DELETE', body, () => {
+            alert('Item successfully removed from list!');
+            window.location.reload();  // Reload to see the updated list
+        });
+    });
 
-    tradeButton.addEventListener('click', function () {
-        // Get the selected item IDs
+    // Initiating a trade
+    onClick('#initiate-trade-btn', () => {
         const yourItemId = document.querySelector('input[name="your_item"]:checked')?.value;
         const theirItemId = document.querySelector('input[name="their_item"]:checked')?.value;
 
@@ -97,73 +61,44 @@ document.addEventListener('DOMContentLoaded', function () {
             return;
         }
 
-        // Send trade initiation request
-        fetch('/initiate-trade', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': '{{ csrf_token() }}'
-            },
-            body: JSON.stringify({ your_item_id: yourItemId, their_item_id: theirItemId })
-        })
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                alert('Trade initiated successfully!');
-                document.getElementById('trade-feedback').innerText = 'Trade initiated successfully!';
-            } else {
-                alert(data.error);
-            }
-        })
-        .catch(error => console.error('Error:', error));
+        sendJSON('/initiate-trade', 'POST', { your_item_id: yourItemId, their_item_id: theirItemId }, () => {
+            alert('Trade initiated successfully!');
+            document.getElementById('trade-feedback').innerText = 'Trade initiated successfully!';
+        });
     });
-});
 
-//Accepting and Rejecting Pending Trades
-document.addEventListener('DOMContentLoaded', function () {
-    document.querySelectorAll('.accept-trade-btn').forEach(button => {
-        button.addEventListener('click', function () {
-            const tradeId = this.dataset.tradeId;
-
-            fetch(`/accept-trade/${tradeId}`, {
-                method: 'POST',
-                headers: {
-                    'X-CSRFToken': '{{ csrf_token() }}'
-                }
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    alert('Trade accepted!');
-                    window.location.reload();
-                } else {
-                    alert(data.error);
-                }
-            })
-            .catch(error => console.error('Error:', error));
+    // Accepting and rejecting pending trades
+    onClick('.accept-trade-btn', button => {
+        sendJSON(`/accept-trade/${button.dataset.tradeId}`, 'POST', undefined, () => {
+            alert('Trade accepted!');
+            window.location.reload();
         });
     });
 
-    document.querySelectorAll('.reject-trade-btn').forEach(button => {
-        button.addEventListener('click', function () {
-            const tradeId = this.dataset.tradeId;
-
-            fetch(`/reject-trade/${tradeId}`, {
-                method: 'POST',
-                headers: {
-                    'X-CSRFToken': '{{ csrf_token() }}'
-                }
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    alert('Trade rejected!');
-                    window.location.reload();
-                } else {
-                    alert(data.error);
-                }
-            })
-            .catch(error => console.error('Error:', error));
+    onClick('.reject-trade-btn', button => {
+        sendJSON(`/reject-trade/${button.dataset.tradeId}`, 'POST', undefined, () => {
+            alert('Trade rejected!');
+            window.location.reload();
         });
     });
-});
\ No newline at end of file
+
+    // Live updates to the pending trades list
+    const pendingTrades = document.getElementById('pending-trades');
+    if (pendingTrades && window.EventSource) {
+        const listen = () => {
+            const source = new EventSource(pendingTrades.dataset.eventsUrl);
+            ['created', 'accepted', 'rejected'].forEach(kind => {
+                source.addEventListener(kind, function () {
+                    document.getElementById('trade-updates').hidden = false;
+                });
+            });
+            // A busy server answers 503, which browsers don't retry on their own.
+            source.addEventListener('error', () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    setTimeout(listen, Number(pendingTrades.dataset.eventsRetry));
+                }
+            });
+        };
+        listen();
+    }
+});
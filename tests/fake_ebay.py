@@ -0,0 +1,88 @@
+"""Local stand-in for the eBay Finding API, for offline tests."""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'find_items_advanced.xml')
+
+
+class FakeEbayServer(object):
+    """Serves a recorded findItemsAdvanced response on localhost.
+
+    Counts every upstream call in `hits` and records the client port of each
+    in `clients`, so tests can tell whether connections were reused. `delay`
+    slows each response down so concurrent callers overlap. `body` may be a
+    function of the request body, to vary the response per keyword or page.
+    The next `errors` calls are answered with HTTP `error_status` instead.
+    """
+
+    def __init__(self, delay=0, body=None, errors=0, error_status=503):
+        self.delay = delay
+        self.errors = errors
+        self.error_status = error_status
+        self.hits = 0
+        self.requests = []
+        self.clients = []
+        if body is None:
+            with open(FIXTURE, 'rb') as fh:
+                body = fh.read()
+        self.body = body
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def domain(self):
+        return '127.0.0.1:%d' % self._server.server_address[1]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so a client can send several calls over one socket.
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request_body = self.rfile.read(length)
+                with fake._lock:
+                    fake.hits += 1
+                    fake.requests.append(request_body)
+                    fake.clients.append(self.client_address[1])
+                    failing = fake.errors > 0
+                    if failing:
+                        fake.errors -= 1
+                if fake.delay:
+                    time.sleep(fake.delay)
+
+                if failing:
+                    status, body = fake.error_status, b'Service Unavailable'
+                else:
+                    status = 200
+                    body = fake.body(request_body) if callable(fake.body) else fake.body
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml;charset=UTF-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (e.g. timed out) before we answered.
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
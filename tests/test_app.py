@@ -0,0 +1,46 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from config import TestingConfig, DevelopmentConfig
+from events import trade_events
+from identity import identity_cache
+
+
+def test_create_app_does_not_touch_the_database(tmp_path):
+    """Safe to build in a gunicorn master: no connection, no DDL."""
+    path = tmp_path / 'app.db'
+
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % path
+
+    app = create_app(FileConfig)
+
+    assert app.config['TESTING']
+    assert not path.exists()
+    assert 'main.search' in app.view_functions
+
+
+def test_debug_toolbar_only_in_debug():
+    assert 'debugtoolbar' not in create_app('testing').blueprints
+    assert 'debugtoolbar' in create_app(DevelopmentConfig).blueprints
+
+
+def test_apps_keep_their_own_extensions():
+    """Building a second app leaves the first one's settings and state alone."""
+
+    class SlowPollConfig(TestingConfig):
+        EVENTS_POLL_INTERVAL = 3600
+        USER_CACHE_TTL = 60
+
+    first = create_app('testing')
+    second = create_app(SlowPollConfig)
+
+    with first.app_context():
+        assert trade_events.poll_interval == TestingConfig.EVENTS_POLL_INTERVAL
+        assert identity_cache.ttl == TestingConfig.USER_CACHE_TTL
+    with second.app_context():
+        assert trade_events.poll_interval == 3600
+        assert identity_cache.ttl == 60
+    assert first.extensions['ebay_cache'] is not second.extensions['ebay_cache']
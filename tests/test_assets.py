@@ -0,0 +1,79 @@
+import gzip
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask, url_for
+
+from app import app as main_app
+from assets import Assets, build, fingerprint
+
+
+@pytest.fixture
+def static(tmp_path):
+    (tmp_path / 'scripts').mkdir()
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'stylesheets').mkdir()
+    (tmp_path / 'scripts' / 'app.js').write_text('console.log("hello");\n' * 50)
+    (tmp_path / 'images' / 'logo.png').write_bytes(b'\x89PNG not really')
+    (tmp_path / 'stylesheets' / 'style.css').write_text(
+        'body { background: url("/static/images/logo.png"); }\n' + '.a { color: red; }\n' * 50)
+    return tmp_path
+
+
+@pytest.fixture
+def app(static):
+    build(str(static))
+    app = Flask(__name__, static_folder=str(static), static_url_path='/static')
+    app.config.update(ASSETS_DIR='build', ASSETS_MAX_AGE=31536000)
+    Assets().init_app(app)
+    return app
+
+
+def test_build_hashes_and_compresses(static):
+    manifest = build(str(static))
+
+    script = manifest['scripts/app.js']
+    assert script == 'scripts/app.%s.js' % fingerprint((static / 'scripts' / 'app.js').read_bytes())
+    assert gzip.decompress((static / 'build' / (script + '.gz')).read_bytes()) == \
+        (static / 'scripts' / 'app.js').read_bytes()
+    # Images aren't worth compressing again.
+    assert not (static / 'build' / (manifest['images/logo.png'] + '.gz')).exists()
+
+    stylesheet = (static / 'build' / manifest['stylesheets/style.css']).read_text()
+    assert 'url("/static/build/%s")' % manifest['images/logo.png'] in stylesheet
+
+
+def test_hashed_urls_are_served_compressed_and_immutable(app):
+    with app.test_request_context():
+        url = url_for('static', filename='scripts/app.js')
+    assert url.startswith('/static/build/scripts/app.')
+
+    client = app.test_client()
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/javascript'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data).startswith(b'console.log')
+    response.close()
+
+    response = client.get(url)
+    assert 'Content-Encoding' not in response.headers
+    assert response.data.startswith(b'console.log')
+    response.close()
+
+    # The original names still work, without the long cache lifetime.
+    response = client.get('/static/scripts/app.js')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+    response.close()
+
+
+def test_pages_carry_the_csrf_token_and_one_script():
+    page = main_app.test_client().get('/login').data.decode()
+
+    assert '<meta name="csrf-token" content="' in page
+    assert '<meta name="csrf-token" content="">' not in page
+    assert page.count('scripts/app') == 1
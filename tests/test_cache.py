@@ -0,0 +1,209 @@
+import os
+import sys
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cache import ResponseCache, MemoryBackend, SQLiteBackend, SingleFlight, normalize_term
+from ebay_24 import Ebay_24
+from fake_ebay import FakeEbayServer
+
+
+class FakeClock(object):
+    """Clock the tests can move forward by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def counting_loader(value='result'):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [value, len(calls)]
+
+    loader.calls = calls
+    return loader
+
+
+def test_normalize_term():
+    """Case and extra whitespace don't produce separate entries."""
+    assert normalize_term("  Nintendo   SWITCH ") == "nintendo switch"
+
+
+def test_cache_hit_within_ttl():
+    """A second lookup inside the TTL doesn't call the loader again."""
+    clock = FakeClock()
+    cache = ResponseCache(ttl=60, stale_ttl=0, clock=clock)
+    loader = counting_loader()
+
+    first = cache.get_or_load("Switch", loader)
+    clock.now += 30
+    second = cache.get_or_load("switch", loader)
+
+    assert first == second
+    assert len(loader.calls) == 1
+
+
+def test_cache_reloads_after_expiry():
+    """Past TTL and the stale window the loader runs inline."""
+    clock = FakeClock()
+    cache = ResponseCache(ttl=60, stale_ttl=0, clock=clock)
+    loader = counting_loader()
+
+    cache.get_or_load("switch", loader)
+    clock.now += 61
+    value = cache.get_or_load("switch", loader)
+
+    assert value == ['result', 2]
+    assert len(loader.calls) == 2
+
+
+def test_stale_while_revalidate():
+    """A stale entry is returned immediately and refreshed in the background."""
+    clock = FakeClock()
+    cache = ResponseCache(ttl=60, stale_ttl=600, clock=clock)
+    loader = counting_loader()
+    cache.get_or_load("switch", loader)
+
+    refreshed = threading.Event()
+
+    def slow_loader():
+        refreshed.wait(5)
+        return ['fresh']
+
+    clock.now += 120
+    assert cache.get_or_load("switch", slow_loader) == ['result', 1]
+
+    refreshed.set()
+    for _ in range(100):
+        if cache.backend.get("switch")[0] == ['fresh']:
+            break
+        threading.Event().wait(0.01)
+
+    assert cache.get_or_load("switch", loader) == ['fresh']
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_size=2)
+    backend.set("a", 1, 0)
+    backend.set("b", 2, 0)
+    backend.get("a")
+    backend.set("c", 3, 0)
+
+    assert backend.get("b") is None
+    assert backend.get("a") == (1, 0)
+    assert len(backend) == 2
+
+
+def test_sqlite_backend_is_shared(tmp_path):
+    """Two caches on the same file (e.g. two workers) share entries."""
+    path = str(tmp_path / "cache.db")
+    worker1 = ResponseCache(SQLiteBackend(path, max_size=2), ttl=60)
+    worker2 = ResponseCache(SQLiteBackend(path, max_size=2), ttl=60)
+    loader = counting_loader()
+
+    worker1.get_or_load("switch", loader)
+    assert worker2.get_or_load("switch", loader) == ['result', 1]
+    assert len(loader.calls) == 1
+
+    worker1.get_or_load("xbox", loader)
+    worker1.get_or_load("ps5", loader)
+    assert len(worker2.backend) == 2
+
+
+def test_sqlite_backend_connects_on_first_use(tmp_path):
+    """Nothing is opened up front, so a preloaded app forks without a connection."""
+    path = tmp_path / "cache.db"
+    backend = SQLiteBackend(str(path))
+    assert not path.exists()
+
+    backend.set("a", 1, 0)
+    assert backend.get("a") == (1, 0)
+
+    # A connection inherited from the parent process is replaced.
+    conn = backend._connect()
+    backend._local.pid = -1
+    assert backend._connect() is not conn
+    assert backend.get("a") == (1, 0)
+
+
+def search_concurrently(caches, server, term, n):
+    """Fire `n` threads at once, spread over `caches`, each doing an Ebay_24 lookup."""
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        cache = caches[i % len(caches)]
+        ebay = Ebay_24('test-key', term, domain=server.domain, https=False)
+        barrier.wait()
+        results[i] = cache.get_or_load(term, ebay.find_items)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_searches_make_one_upstream_call():
+    """N concurrent searches for the same term share a single eBay call."""
+    cache = ResponseCache(ttl=60)
+
+    with FakeEbayServer(delay=0.3) as server:
+        results = search_concurrently([cache], server, "Nintendo Switch", 20)
+
+    assert server.hits == 1
+    assert len(results[0]) == 14
+    assert all(result == results[0] for result in results)
+
+
+def test_concurrent_searches_across_workers(tmp_path):
+    """Caches sharing a SQLite file and lock dir (one per worker) still make one call."""
+    path = str(tmp_path / "cache.db")
+    caches = [
+        ResponseCache(SQLiteBackend(path), ttl=60, flight=SingleFlight(lock_dir=str(tmp_path)))
+        for _ in range(3)
+    ]
+
+    with FakeEbayServer(delay=0.3) as server:
+        results = search_concurrently(caches, server, "nintendo switch", 12)
+
+    assert server.hits == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_single_flight_shares_errors():
+    """Waiters see the leader's exception instead of retrying upstream."""
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    def call():
+        try:
+            flight.do("switch", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    threading.Event().wait(0.1)  # let the follower reach the wait
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
@@ -0,0 +1,98 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import insert, select
+from sqlalchemy.pool import NullPool
+
+import database
+from app import create_app
+from config import TestingConfig
+from models import db, User, Item, OfferedItem
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Two SQLite files standing in for a primary and a lagging replica."""
+
+    class ReplicaConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % (tmp_path / 'primary.db')
+        DATABASE_REPLICA_URL = 'sqlite:///%s' % (tmp_path / 'replica.db')
+        DB_REPLICA_STICKY = 60
+
+    app = create_app(ReplicaConfig)
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(app.extensions['replica'])
+
+        def user(n):
+            return {'id': n, 'username': 'user%d' % n, 'email': 'user%d@example.com' % n, 'password': 'x'}
+
+        # User 3 hasn't reached the replica yet; user 4 only exists there.
+        with db.engines[None].begin() as conn:
+            conn.execute(insert(User), [user(1), user(2), user(3)])
+            conn.execute(insert(Item), [{'id': 1, 'title': 'Lamp', 'condition': 'Used'}])
+        with app.extensions['replica'].begin() as conn:
+            conn.execute(insert(User), [user(1), user(2), user(4)])
+            conn.execute(insert(Item), [{'id': 1, 'title': 'Lamp', 'condition': 'Used'}])
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['curr_user'] = 1
+    return client
+
+
+def test_read_only_views_read_from_the_replica(client):
+    assert client.get('/user/4').status_code == 200
+    assert client.get('/user/3').status_code == 404
+    assert client.get('/user/pending-trades.json').status_code == 200
+
+
+def test_other_views_read_from_the_primary(client):
+    # Found, so the view redirects: only the owner may edit a profile.
+    assert client.get('/user/3/edit').status_code == 302
+    assert client.get('/user/4/edit').status_code == 404
+
+
+def test_writes_go_to_the_primary_and_later_reads_follow(app, client):
+    response = client.post('/add-offered-item', json={'item_id': 1})
+    assert response.json['success']
+
+    with app.app_context():
+        with db.engines[None].connect() as conn:
+            assert len(conn.execute(select(OfferedItem.id)).all()) == 1
+        with app.extensions['replica'].connect() as conn:
+            assert conn.execute(select(OfferedItem.id)).all() == []
+
+    # For a while after writing, this browser reads its own writes from the primary.
+    assert client.get('/user/3').status_code == 200
+    assert client.get('/user/4').status_code == 404
+
+
+def test_read_detection():
+    assert database._is_read(select(User))
+    assert database._is_read(db.text('  select 1'))
+    assert not database._is_read(select(User).with_for_update())
+    assert not database._is_read(db.text('UPDATE user SET email = NULL'))
+    assert not database._is_read(insert(User))
+
+
+def test_engine_options():
+    config = dict({key: getattr(TestingConfig, key) for key in dir(TestingConfig) if key.isupper()},
+                  DB_POOL_SIZE=7, DB_STATEMENT_TIMEOUT_MS=5000, DB_PGBOUNCER=False)
+
+    direct = database.engine_options(config, 'postgresql://db/trade_bay')
+    assert direct['pool_size'] == 7
+    assert direct['pool_pre_ping']
+    assert direct['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+    pgbouncer = database.engine_options(dict(config, DB_PGBOUNCER=True), 'postgresql://bouncer/trade_bay')
+    assert pgbouncer == {'poolclass': NullPool}
+
+    assert database.engine_options(config, 'sqlite:///app.db') == {'pool_pre_ping': True}
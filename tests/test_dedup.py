@@ -0,0 +1,97 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from dedup import find_duplicates, merge
+from models import db as _db, User, Item, OfferedItem, RequestedItem, Trade, item_fingerprint
+
+
+@pytest.fixture
+def db():
+    with app.app_context():
+        _db.create_all()
+        yield _db
+        _db.session.remove()
+        _db.drop_all()
+
+
+def test_fingerprint_ignores_case_punctuation_and_word_order():
+    assert item_fingerprint("Nintendo Switch - OLED", "New") == item_fingerprint("oled  nintendo SWITCH", "new")
+    assert item_fingerprint("Nintendo Switch OLED", "New") != item_fingerprint("Nintendo Switch OLED", "Used")
+    assert item_fingerprint("Lamp", None) == item_fingerprint("lamp", "")
+
+
+def test_find_duplicates_groups_near_matching_titles():
+    rows = [
+        (1, "Nintendo Switch OLED White Console Bundle", "Used"),
+        (2, "Nintendo Switch OLED White Console Bundle Edition", "Used"),
+        (3, "Nintendo Switch OLED White Console Bundle Edition", "New"),
+        (4, "Sony PlayStation 5 Digital Edition", "Used"),
+        (5, "Nintendo Switch Lite Blue", "Used"),
+        (6, "nintendo switch oled white console bundle edition!", "Used"),
+    ]
+
+    assert find_duplicates(rows) == [[1, 2, 6]]
+    assert find_duplicates(rows, threshold=1.0) == [[2, 6]]
+
+
+def test_bulk_ingest_skips_titles_with_the_same_fingerprint(db):
+    db.session.add(Item(title="Desk Lamp", condition="Used"))
+    db.session.commit()
+
+    records = [{"title": "desk lamp!", "condition": "used", "image_url": None},
+               {"title": "Lamp, Desk", "condition": "Used", "image_url": None},
+               {"title": "Desk Lamp", "condition": "New", "image_url": None}]
+    assert Item.bulk_ingest(records) == 1
+    db.session.commit()
+
+    assert Item.query.count() == 2
+
+
+def test_merge_repoints_lists_and_trades(db):
+    alice = User.signup("alice", "alice@test.com", "password")
+    bob = User.signup("bob", "bob@test.com", "password")
+    lamp, lamp_copy, chair = (Item(title=title, condition="Used") for title in ("Desk Lamp", "Desk Lamp Black", "Chair"))
+    db.session.add_all([alice, bob, lamp, lamp_copy, chair])
+    db.session.flush()
+
+    kept = OfferedItem(user_id=alice.id, item_id=lamp.id)
+    duplicate = OfferedItem(user_id=alice.id, item_id=lamp_copy.id)
+    moved = OfferedItem(user_id=bob.id, item_id=lamp_copy.id)
+    requested = RequestedItem(user_id=bob.id, item_id=lamp_copy.id)
+    bob_chair = OfferedItem(user_id=bob.id, item_id=chair.id)
+    db.session.add_all([kept, duplicate, moved, requested, bob_chair])
+    db.session.flush()
+    trade = Trade(item_offered_id=duplicate.id, item_requested_id=requested.id, recipient_id=bob.id, status="Pending")
+    db.session.add(trade)
+    db.session.commit()
+    bob_version = bob.version
+
+    assert merge([[lamp.id, lamp_copy.id]]) == 1
+    db.session.commit()
+    db.session.expire_all()
+
+    assert Item.query.count() == 2
+    assert {(row.user_id, row.item_id) for row in OfferedItem.query} == {
+        (alice.id, lamp.id), (bob.id, lamp.id), (bob.id, chair.id)}
+    assert RequestedItem.query.one().item_id == lamp.id
+    assert db.session.get(Trade, trade.id).item_offered_id == kept.id
+    assert db.session.get(User, bob.id).version == bob_version + 1
+
+
+def test_merge_duplicates_command(db):
+    db.session.add_all([Item(title="Blue Office Chair Mesh", condition="Used"),
+                        Item(title="Blue Office Chair Mesh Back", condition="Used"),
+                        Item(title="Standing Desk", condition="Used")])
+    db.session.commit()
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["merge-duplicates", "--dry-run"])
+    assert "would merge items 1, 2" in result.output
+    assert Item.query.count() == 3
+
+    result = runner.invoke(args=["merge-duplicates"])
+    assert "Merged 1 items into 1." in result.output
+    assert [item.title for item in Item.query.order_by(Item.id)] == ["Blue Office Chair Mesh", "Standing Desk"]
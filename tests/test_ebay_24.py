@@ -0,0 +1,120 @@
+import os
+import pytest
+import re
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from io import BytesIO
+
+from ebaysdk.exception import ConnectionError
+
+from ebay_24 import Ebay_24, ebay_guard, iter_listings
+from fake_ebay import FakeEbayServer, FIXTURE
+
+with open(FIXTURE, 'rb') as fh:
+    BODY = fh.read()
+
+
+@pytest.fixture(autouse=True)
+def reset_guard():
+    ebay_guard.reset()
+    yield
+    ebay_guard.reset()
+
+
+def paged_body(request_body):
+    """The fixture with each title tagged with the requested keyword and page."""
+    keyword = re.search(rb'<keywords>(.*?)</keywords>', request_body).group(1)
+    page = re.search(rb'<pageNumber>(\d+)</pageNumber>', request_body).group(1)
+    return BODY.replace(b'<title>', b'<title>' + keyword + b' p' + page + b' ')
+
+
+def test_fetch_many_pages_and_keywords():
+    with FakeEbayServer(body=paged_body) as server:
+        ebay = Ebay_24('test-key', 'switch', domain=server.domain, https=False)
+        listings = list(ebay.fetch_many(['switch', 'xbox'], pages=3, per_page=15))
+
+    assert server.hits == 6
+    assert len(listings) == 6 * 14
+    assert sum(listing['title'].startswith('xbox p3 ') for listing in listings) == 14
+    assert all(b'<entriesPerPage>15</entriesPerPage>' in body for body in server.requests)
+
+
+def test_fetch_many_runs_calls_in_parallel_and_reuses_connections():
+    """Eight slow calls on two threads take four rounds over two sockets."""
+    with FakeEbayServer(delay=0.2) as server:
+        ebay = Ebay_24('test-key', 'switch', domain=server.domain, https=False)
+        start = time.monotonic()
+        listings = list(ebay.fetch_many(pages=8, max_workers=2))
+        elapsed = time.monotonic() - start
+
+    # Every page repeats the fixture, so duplicates collapse to its 14 items.
+    assert len(listings) == 14
+    assert server.hits == 8
+    assert elapsed < 8 * 0.2
+    assert len(set(server.clients)) == 2
+
+
+def test_fetch_many_reuses_connections_across_calls():
+    """The pool's threads and their connections outlive a single fetch_many."""
+    with FakeEbayServer(delay=0.05) as server:
+        ebay = Ebay_24('test-key', 'switch', domain=server.domain, https=False)
+        list(ebay.fetch_many(pages=4, max_workers=3))
+        list(ebay.fetch_many(['xbox'], pages=4, max_workers=3))
+
+    assert server.hits == 8
+    assert len(set(server.clients)) <= 3
+
+
+def test_fetch_many_streams_results():
+    """The first page's listings arrive before the slowest call finishes."""
+    def body(request_body):
+        if b'<keywords>slow</keywords>' in request_body:
+            time.sleep(0.5)
+        return BODY
+
+    with FakeEbayServer(body=body) as server:
+        ebay = Ebay_24('test-key', 'switch', domain=server.domain, https=False)
+        start = time.monotonic()
+        listings = ebay.fetch_many(['fast', 'slow'])
+        next(listings)
+        assert time.monotonic() - start < 0.4
+        listings.close()
+
+
+def test_fetch_many_timeouts():
+    with FakeEbayServer(delay=1) as server:
+        ebay = Ebay_24('test-key', 'switch', domain=server.domain, https=False, timeout=0.2)
+        with pytest.raises(requests.Timeout):
+            list(ebay.fetch_many(pages=2))
+
+
+FAILURE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<findItemsAdvancedResponse xmlns="http://www.ebay.com/marketplace/search/v1/services">
+<ack>Failure</ack><errorMessage><error><errorId>11002</errorId><severity>Error</severity>
+<message>Authentication failed : Invalid Application: test-key</message></error></errorMessage>
+</findItemsAdvancedResponse>"""
+
+
+def test_stream_parser_matches_sdk_parser():
+    with FakeEbayServer() as server:
+        sdk = Ebay_24('test-key', 'switch', domain=server.domain, https=False, parser='sdk').find_items()
+        stream = Ebay_24('test-key', 'switch', domain=server.domain, https=False, parser='stream').find_items()
+
+    assert len(stream) == 14
+    assert stream == sdk
+    assert list(iter_listings(BytesIO(BODY))) == stream
+
+
+def test_stream_parser_errors(caplog):
+    with pytest.raises(ConnectionError, match="Invalid Application"):
+        list(iter_listings(BytesIO(FAILURE)))
+    with pytest.raises(ConnectionError, match="unreadable"):
+        list(iter_listings(BytesIO(b"<html>Service Unavailable")))
+
+    with FakeEbayServer(body=FAILURE) as server:
+        assert Ebay_24('test-key', 'switch', domain=server.domain, https=False).fetch() is None
+    assert "eBay search for 'switch' failed" in caplog.text
+    assert "Invalid Application" in caplog.text
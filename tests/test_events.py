@@ -0,0 +1,141 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+
+from app import create_app
+from config import TestingConfig
+from events import trade_events
+from models import db, User, Item, OfferedItem, Trade, TradeEvent
+
+
+@pytest.fixture
+def app(tmp_path):
+    class EventsConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % (tmp_path / 'events.db')
+        # The tests poll by hand.
+        EVENTS_POLL_INTERVAL = 3600
+        EVENTS_MAX_STREAMS = 100
+
+    app = create_app(EventsConfig)
+    with app.app_context():
+        db.create_all()
+        alice, bob = User(username='alice', email='alice@example.com', password='x'), \
+            User(username='bob', email='bob@example.com', password='x')
+        lamp, chair = Item(title='Lamp', condition='Used'), Item(title='Chair', condition='Used')
+        db.session.add_all([OfferedItem(user=alice, item=lamp), OfferedItem(user=bob, item=chair)])
+        db.session.commit()
+    return app
+
+
+def client_for(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['curr_user'] = user_id
+    return client
+
+
+def test_one_poll_serves_every_client(app):
+    with app.app_context():
+        alices = [trade_events.subscribe(1) for _ in range(50)]
+        bobs = [trade_events.subscribe(2) for _ in range(50)]
+
+        trade = Trade(status='Pending')
+        trade_events.publish(1, trade, 'created')
+        trade_events.publish(2, trade, 'accepted')
+        db.session.commit()
+
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        assert trade_events.poll() == 2
+        assert len(statements) == 1
+
+        assert {sub.get(0)['kind'] for sub in alices} == {'created'}
+        assert {sub.get(0)['kind'] for sub in bobs} == {'accepted'}
+        assert all(sub.get(0) is None for sub in alices + bobs)
+
+        # Nothing new: nothing delivered twice.
+        assert trade_events.poll() == 0
+        for sub in alices + bobs:
+            trade_events.unsubscribe(sub)
+
+
+def test_trade_changes_reach_the_stream(app):
+    alice, bob = client_for(app, 1), client_for(app, 2)
+    stream = bob.get('/user/events')
+    assert stream.mimetype == 'text/event-stream'
+    chunks = iter(stream.response)
+    assert next(chunks) == b'retry: 3000\n\n'
+
+    response = alice.post('/initiate-trade', json={'your_item_id': 1, 'their_item_id': 2})
+    assert response.json['success']
+    with app.app_context():
+        trade_events.poll()
+    message = next(chunks).decode()
+    assert message.startswith('id: 1\nevent: created\n')
+
+    # Alice hears back when bob answers, even if she reconnects after missing it.
+    assert bob.post('/accept-trade/1').status_code == 200
+    stream.close()
+    caught_up = alice.get('/user/events', headers={'Last-Event-ID': '1'})
+    chunks = iter(caught_up.response)
+    next(chunks)
+    assert next(chunks).decode().startswith('id: 2\nevent: accepted\n')
+    caught_up.close()
+
+    with app.app_context():
+        assert [(e.user_id, e.kind) for e in TradeEvent.query.order_by(TradeEvent.id)] == \
+            [(2, 'created'), (1, 'accepted')]
+        # Closed streams leave nothing subscribed.
+        assert trade_events._subscribers == {}
+
+
+def test_events_need_a_login(app):
+    assert app.test_client().get('/user/events').status_code == 401
+
+
+def test_late_events_with_lower_ids_are_sent(app):
+    """An event committed after one with a higher id still reaches the stream, once."""
+    stream = client_for(app, 2).get('/user/events')
+    chunks = iter(stream.response)
+    next(chunks)
+    subscription, = app.extensions['trade_events']._subscribers[2]
+
+    for event_id in (6, 5, 6):
+        subscription.put({'id': event_id, 'kind': 'created'})
+    subscription.put(None)
+    assert next(chunks).decode().startswith('id: 6\n')
+    assert next(chunks).decode().startswith('id: 5\n')
+    assert next(chunks) == b': keep-alive\n\n'
+    stream.close()
+
+
+def test_streams_are_capped_per_worker(app, monkeypatch):
+    monkeypatch.setattr(app.extensions['trade_events'], 'max_streams', 1)
+    first = client_for(app, 1).get('/user/events')
+
+    busy = client_for(app, 2).get('/user/events')
+    assert busy.status_code == 503
+    assert busy.data == b'retry: 3000\n\n'
+
+    first.close()
+    assert client_for(app, 2).get('/user/events').status_code == 200
+
+
+def test_subscribe_while_the_poller_stops(app, monkeypatch):
+    """The poller forgetting last_id between subscribe()'s read and its lock is harmless."""
+    with app.app_context():
+        trade_events.last_id = 3
+        execute = db.session.execute
+
+        def execute_then_stop_poller(*args, **kwargs):
+            result = execute(*args, **kwargs)
+            trade_events.last_id = None
+            return result
+
+        monkeypatch.setattr(db.session, 'execute', execute_then_stop_poller)
+        subscription = trade_events.subscribe(1)
+        assert trade_events.last_id == 0
+        trade_events.unsubscribe(subscription)
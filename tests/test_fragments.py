@@ -0,0 +1,94 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from jinja2 import Environment
+
+from app import create_app
+from cache import SQLiteBackend
+from config import TestingConfig
+from fragments import FragmentCache, FragmentCacheExtension
+from models import db, User, Item
+
+
+TEMPLATE = "{% cache 'card', item.id, item.version %}<b>{{ item.title }}</b> {{ render() }}{% endcache %}"
+
+
+def environment(cache):
+    env = Environment(autoescape=True, extensions=[FragmentCacheExtension])
+    env.extend(fragment_cache=cache)
+    return env
+
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+
+def test_fragment_is_reused_until_its_version_changes():
+    cache = FragmentCache()
+    template = environment(cache).from_string(TEMPLATE)
+    render = Counter()
+
+    item = {'id': 1, 'version': 1, 'title': 'Lamp & Shade'}
+    assert template.render(item=item, render=render) == '<b>Lamp &amp; Shade</b> 1'
+    assert template.render(item=item, render=render) == '<b>Lamp &amp; Shade</b> 1'
+
+    item['version'] = 2
+    assert template.render(item=item, render=render) == '<b>Lamp &amp; Shade</b> 2'
+    assert len(cache.backend) == 1
+
+    cache.invalidate('card', 1)
+    assert template.render(item=item, render=render) == '<b>Lamp &amp; Shade</b> 3'
+
+
+def test_workers_share_an_on_disk_backend(tmp_path):
+    path = str(tmp_path / 'fragments.db')
+    first = environment(FragmentCache(SQLiteBackend(path))).from_string(TEMPLATE)
+    second = environment(FragmentCache(SQLiteBackend(path))).from_string(TEMPLATE)
+    render = Counter()
+
+    item = {'id': 1, 'version': '2024-01-01 00:00:00', 'title': 'Lamp'}
+    first.render(item=item, render=render)
+    assert second.render(item=item, render=render) == '<b>Lamp</b> 1'
+
+
+def test_cache_tag_needs_name_key_and_version():
+    with pytest.raises(Exception, match='fragment name, a key and a version'):
+        environment(FragmentCache()).from_string("{% cache 'card', 1 %}x{% endcache %}")
+
+
+@pytest.fixture
+def app():
+    class CachedConfig(TestingConfig):
+        FRAGMENT_CACHE_SIZE = 100
+
+    app = create_app(CachedConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_profile_lists_follow_changes(app):
+    user = User(username='alice', email='alice@example.com', password='x')
+    db.session.add_all([user, Item(title='Lamp', condition='Used'), Item(title='Chair', condition='Used')])
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['curr_user'] = user.id
+
+    assert "You haven't offered any items yet." in client.get('/user/1').data.decode()
+    client.post('/add-offered-item', json={'item_id': 1})
+    assert 'Lamp' in client.get('/user/1').data.decode()
+    client.post('/add-offered-item', json={'item_id': 2})
+    page = client.get('/user/1').data.decode()
+    assert 'Lamp' in page and 'Chair' in page
+    assert len(app.jinja_env.fragment_cache.backend) == 2
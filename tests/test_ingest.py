@@ -0,0 +1,119 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import datetime, timedelta
+
+import ebay_24
+import ingest
+from app import app
+from models import Item, IngestJob, SearchTerm, db as _db
+from fake_ebay import FakeEbayServer
+
+
+@pytest.fixture
+def db():
+    with app.app_context():
+        _db.create_all()
+        yield _db
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def fake_ebay(monkeypatch):
+    with FakeEbayServer() as server:
+        monkeypatch.setattr(ebay_24, 'EBAY_DOMAIN', server.domain)
+        monkeypatch.setattr(ebay_24, 'EBAY_HTTPS', False)
+        with app.app_context():
+            ebay_24.ebay_guard.reset()
+        yield server
+
+
+def queued_terms():
+    return [job.term for job in IngestJob.query.filter_by(status='queued').order_by(IngestJob.id)]
+
+
+def test_enqueue_once_per_term(db):
+    """Repeat searches for a missing term share one queued job."""
+    assert ingest.enqueue_refresh("Switch", 60)
+    assert ingest.enqueue_refresh("  switch ", 60)
+    assert ingest.enqueue_refresh("xbox", 60)
+    db.session.commit()
+
+    assert queued_terms() == ["switch", "xbox"]
+
+
+def test_fresh_terms_are_not_queued(db):
+    db.session.add(SearchTerm(term="switch", last_refreshed=datetime.now() - timedelta(seconds=30)))
+    db.session.add(SearchTerm(term="xbox", last_refreshed=datetime.now() - timedelta(hours=2)))
+    db.session.commit()
+
+    assert not ingest.enqueue_refresh("Switch", 60)
+    assert ingest.enqueue_refresh("xbox", 60)
+
+
+def test_worker_ingests_and_marks_term_fresh(db, fake_ebay):
+    ingest.enqueue_refresh("nintendo switch", 60)
+    db.session.commit()
+
+    assert ingest.work('test-key', once=True) == 1
+    assert Item.query.count() == 14
+    assert IngestJob.query.count() == 0
+    assert db.session.get(SearchTerm, "nintendo switch").item_count == 14
+    assert ingest.is_fresh("Nintendo Switch", 60)
+
+
+def test_multi_page_refresh_goes_through_the_cache(db, fake_ebay):
+    from cache import ResponseCache
+
+    cache = ResponseCache()
+    assert ingest.refresh("nintendo switch", 'test-key', cache=cache, pages=2) == 14
+    assert ingest.refresh("Nintendo  Switch", 'test-key', cache=cache, pages=2) == 0
+    assert fake_ebay.hits == 2
+
+    # A different page count is a different fetch.
+    ingest.refresh("nintendo switch", 'test-key', cache=cache, pages=3)
+    assert fake_ebay.hits == 5
+
+
+def test_claim_is_exclusive(db):
+    """A job another worker already took can't be claimed again."""
+    ingest.enqueue_refresh("switch", 60)
+    ingest.enqueue_refresh("xbox", 60)
+    db.session.commit()
+
+    first = ingest.claim_job()
+    second = ingest.claim_job()
+    assert (first.term, second.term) == ("switch", "xbox")
+    assert first.status == second.status == 'running'
+    assert ingest.claim_job() is None
+
+
+def test_failed_jobs_retry_then_stop(db, monkeypatch, caplog):
+    monkeypatch.setattr(ebay_24.Ebay_24, 'fetch', lambda self: None)
+    ingest.enqueue_refresh("switch", 60)
+    db.session.commit()
+
+    assert ingest.work('test-key', once=True, max_attempts=2) == 2
+    job = IngestJob.query.one()
+    assert (job.status, job.attempts, job.error) == ('failed', 2, "eBay request failed")
+    assert [(record.name, record.levelname) for record in caplog.records] == [
+        ('ingest', 'WARNING'), ('ingest', 'ERROR')]
+
+    # A failed job doesn't block a later search from queueing the term again.
+    assert ingest.enqueue_refresh("switch", 60)
+    db.session.commit()
+    assert queued_terms() == ["switch"]
+
+
+def test_stuck_jobs_are_requeued(db):
+    ingest.enqueue_refresh("switch", 60)
+    db.session.commit()
+    job = ingest.claim_job()
+    job.started_at = datetime.now() - timedelta(seconds=ingest.STUCK_AFTER + 1)
+    db.session.commit()
+
+    assert ingest.requeue_stuck() == 1
+    assert queued_terms() == ["switch"]
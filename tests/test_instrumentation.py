@@ -0,0 +1,82 @@
+import os
+import logging
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask, jsonify
+from flask_sqlalchemy import SQLAlchemy
+
+from instrumentation import SQLInstrumentation, QueryBudgetExceeded, query_budget
+
+
+@pytest.fixture
+def app():
+    """A small app with one model, so the counts below are exact."""
+    app = Flask(__name__)
+    app.config.update(TESTING=True, SQLALCHEMY_DATABASE_URI='sqlite:///:memory:', SQL_STRICT=True,
+                      SQL_REPEAT_WARN=3, SQL_QUERY_WARN=4, SQL_SLOW_REQUEST_MS=10000)
+    db = SQLAlchemy(app)
+
+    class Thing(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    SQLInstrumentation(app)
+
+    @app.route('/fixed')
+    @query_budget(2)
+    def fixed():
+        return jsonify(db.session.scalars(db.select(Thing.id)).all())
+
+    @app.route('/per-row')
+    def per_row():
+        ids = db.session.scalars(db.select(Thing.id)).all()
+        return jsonify([db.session.get(Thing, thing_id).id for thing_id in ids])
+
+    @app.route('/chatty')
+    @query_budget(2)
+    def chatty():
+        for n in range(2):
+            db.session.execute(db.select(Thing.id).where(Thing.id == n)).all()
+            db.session.execute(db.select(Thing).where(Thing.id == n)).all()
+        return 'ok'
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Thing() for _ in range(3)])
+        db.session.commit()
+
+    return app
+
+
+def test_server_timing_header(app):
+    response = app.test_client().get('/fixed')
+
+    assert response.get_json() == [1, 2, 3]
+    db_timing, app_timing = response.headers.getlist('Server-Timing')
+    assert db_timing.startswith('db;dur=') and db_timing.endswith(';desc="1 queries"')
+    assert app_timing.startswith('app;dur=')
+
+
+def test_strict_mode_catches_n_plus_one(app):
+    with pytest.raises(QueryBudgetExceeded, match="same statement 3 times"):
+        app.test_client().get('/per-row')
+
+
+def test_strict_mode_enforces_budgets(app, caplog):
+    with pytest.raises(QueryBudgetExceeded, match="ran 4 queries, over its budget of 2"):
+        app.test_client().get('/chatty')
+
+    app.config['SQL_STRICT'] = False
+    with caplog.at_level(logging.WARNING, logger='instrumentation'):
+        assert app.test_client().get('/chatty').status_code == 200
+    assert "over its budget of 2" in caplog.text
+
+
+def test_chatty_requests_are_logged(app, caplog):
+    app.config.update(SQL_STRICT=False, SQL_QUERY_WARN=1)
+    with caplog.at_level(logging.WARNING, logger='instrumentation'):
+        app.test_client().get('/per-row')
+
+    assert "GET /per-row ran 4 queries" in caplog.text
+    assert "slowest" in caplog.text
@@ -0,0 +1,122 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, match_index
+from matching import MatchIndex
+from models import User, Item, OfferedItem, RequestedItem, db as _db
+
+
+@pytest.fixture
+def index():
+    """Users 1-4 and items 10-14.
+
+    1 and 2 are a direct match (1 wants 10 from 2, 2 wants 11 from 1).
+    1, 3 and 4 form a loop: 1 wants 12 from 3, 3 wants 13 from 4, 4 wants 14 from 1.
+    """
+    index = MatchIndex()
+    for user_id, item_id in [(2, 10), (1, 11), (3, 12), (4, 13), (1, 14)]:
+        index.add_offer(user_id, item_id)
+    for user_id, item_id in [(1, 10), (2, 11), (1, 12), (3, 13), (4, 14)]:
+        index.add_request(user_id, item_id)
+    return index
+
+
+def test_direct_matches(index):
+    assert index.direct_matches(1) == [{'user_id': 2, 'you_get': [10], 'they_get': [11]}]
+    assert index.direct_matches(2) == [{'user_id': 1, 'you_get': [11], 'they_get': [10]}]
+    assert index.direct_matches(3) == []
+
+
+def test_trade_cycles(index):
+    assert index.trade_cycles(1, max_length=3) == [[
+        {'user_id': 1, 'gets': 12, 'from': 3},
+        {'user_id': 3, 'gets': 13, 'from': 4},
+        {'user_id': 4, 'gets': 14, 'from': 1},
+    ]]
+    assert index.trade_cycles(2, max_length=4) == []
+
+
+def test_cycle_length_limit(index):
+    """A four-user loop is only found when max_length allows it."""
+    index.remove_request(4, 14)
+    index.add_request(4, 15)
+    index.add_offer(5, 15)
+    index.add_request(5, 14)
+
+    assert index.trade_cycles(1, max_length=3) == []
+    assert [step['user_id'] for step in index.trade_cycles(1, max_length=4)[0]] == [1, 3, 4, 5]
+
+
+def test_removals_update_index(index):
+    index.remove_offer(2, 10)
+    assert index.direct_matches(1) == []
+    assert 10 not in index.offerers
+
+    index.remove_request(3, 13)
+    assert index.trade_cycles(1) == []
+
+
+@pytest.fixture
+def db():
+    with app.app_context():
+        _db.create_all()
+        yield _db
+        _db.session.remove()
+        _db.drop_all()
+
+
+def test_matches_endpoint_and_cli(db):
+    """The JSON endpoint and the CLI command both read from the database-built index."""
+    users = [User(username=f"user{n}", email=f"user{n}@example.com", password="x") for n in range(2)]
+    items = [Item(title=f"Item {n}", condition="New") for n in range(2)]
+    db.session.add_all(users + items)
+    db.session.add_all([
+        OfferedItem(user=users[0], item=items[0]), RequestedItem(user=users[0], item=items[1]),
+        OfferedItem(user=users[1], item=items[1]), RequestedItem(user=users[1], item=items[0]),
+    ])
+    db.session.commit()
+    match_index.loaded_at = None
+
+    client = app.test_client()
+    assert client.get("/user/matches").status_code == 401
+
+    with client.session_transaction() as session:
+        session["curr_user"] = users[0].id
+    data = client.get("/user/matches").get_json()
+    assert data == {"direct": [{"user_id": users[1].id, "you_get": [items[1].id], "they_get": [items[0].id]}],
+                    "cycles": []}
+
+    result = app.test_cli_runner().invoke(args=["find-matches", str(users[1].id)])
+    assert f"direct: user {users[0].id} gives items [{items[0].id}]" in result.output
+
+
+def test_reload_keeps_changes_made_while_reading(db, monkeypatch):
+    """An offer added while load() is reading survives the rebuild."""
+    index = MatchIndex()
+    execute = db.session.execute
+
+    def execute_during_change(*args, **kwargs):
+        result = execute(*args, **kwargs)
+        index.add_offer(7, 70)
+        return result
+
+    monkeypatch.setattr(db.session, "execute", execute_during_change)
+    index.load()
+
+    assert index.offerers[70] == {7}
+
+
+def test_only_one_caller_reloads(db):
+    """A stale index is served as it is while another caller reloads it."""
+    index = MatchIndex(ttl=0)
+    index.load()
+    index.add_offer(1, 10)
+
+    with index._load_lock:
+        index.ensure_loaded()
+    assert index.offers[1] == {10}
+
+    index.ensure_loaded()
+    assert 1 not in index.offers
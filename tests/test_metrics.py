@@ -0,0 +1,86 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from metrics import Registry, instrument_pool, POOL_WAIT_SECONDS, registry as default_registry
+
+
+def test_counter_and_histogram_text_format():
+    registry = Registry()
+    hits = registry.counter('hits_total', 'Hits.', ['path'])
+    latency = registry.histogram('latency_seconds', 'Latency.', ['path'], buckets=(0.1, 1))
+
+    hits.inc(path='/a')
+    hits.inc(2, path='/a')
+    latency.observe(0.05, path='/a')
+    latency.observe(0.5, path='/a')
+    latency.observe(3, path='/a')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE hits_total counter' in lines
+    assert 'hits_total{path="/a"} 3' in lines
+    assert '# TYPE latency_seconds histogram' in lines
+    assert 'latency_seconds_bucket{path="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{path="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{path="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{path="/a"} 3.55' in lines
+    assert 'latency_seconds_count{path="/a"} 3' in lines
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('errors_total', 'Errors.', ['message']).inc(message='say "hi"')
+
+    assert 'errors_total{message="say \\"hi\\""} 1' in registry.render()
+
+
+def test_workers_are_summed_from_their_files(tmp_path):
+    """Each process writes its own file; any of them can render the total."""
+    workers = [Registry(str(tmp_path)) for _ in range(2)]
+    for n, worker in enumerate(workers):
+        worker.counter('jobs_total', 'Jobs.').inc(n + 1)
+        worker.flush()
+        # Both registries live in this process, so give them separate files.
+        os.rename(tmp_path / ('%d.json' % os.getpid()), tmp_path / ('worker-%d.json' % n))
+
+    assert 'jobs_total 3' in workers[0].render().splitlines()
+
+    workers[0].clear()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_request_metrics():
+    app = Flask(__name__)
+    default_registry.init_app(app)
+
+    @app.route('/ok')
+    def ok():
+        return 'ok'
+
+    app.test_client().get('/ok')
+    app.test_client().get('/missing')
+    rendered = default_registry.render()
+
+    assert 'http_requests_total{endpoint="ok",method="GET",status="200"} 1' in rendered
+    assert 'http_requests_total{endpoint="none",method="GET",status="404"}' in rendered
+    assert 'http_request_duration_seconds_count{endpoint="ok",method="GET"} 1' in rendered
+
+
+def test_instrument_pool_times_checkouts(tmp_path):
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'pool.db'))
+    instrument_pool(engine)
+    instrument_pool(engine)
+
+    def count():
+        return sum(value[-1] for (name, _), value in default_registry._values.items()
+                   if name == POOL_WAIT_SECONDS.name)
+
+    before = count()
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+    assert count() == before + 1
+    assert type(engine.pool).__name__.startswith('Timed')
+    engine.dispose()
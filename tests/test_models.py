@@ -128,4 +128,76 @@ def test_trade_model(init_database, db):
     assert saved_trade is not None
     assert saved_trade.offered_item.item.title == "Item 1"
     assert saved_trade.requested_item.item.title == "Item 2"
-    assert saved_trade.status == "Pending"
\ No newline at end of file
+    assert saved_trade.status == "Pending"
+
+def test_item_bulk_ingest(init_database, db):
+    """bulk_ingest skips stored items and duplicates within the batch."""
+    records = [
+        {"title": "Item 1", "condition": "New", "image_url": "https://example.com/image1.jpg"},
+        {"title": "Item 3", "condition": "New", "image_url": "https://example.com/image3.jpg"},
+        {"title": "Item 3", "condition": "New", "image_url": "https://example.com/image3.jpg"},
+        {"title": "Item 4", "condition": None, "image_url": "https://example.com/image4.jpg"},
+    ]
+
+    assert Item.bulk_ingest(records) == 2
+    db.session.commit()
+
+    assert Item.query.count() == 4
+    assert Item.query.filter_by(title="Item 3").count() == 1
+
+
+def test_item_bulk_ingest_limit(init_database, db):
+    """Only `limit` new items are inserted; existing ones don't count."""
+    records = [{"title": f"Item {n}", "condition": "New", "image_url": None} for n in range(1, 8)]
+
+    assert Item.bulk_ingest(records, limit=3) == 3
+    db.session.commit()
+
+    assert Item.query.count() == 5
+
+
+def test_item_bulk_ingest_ignores_concurrent_insert(init_database, db):
+    """A row inserted by another worker between the lookup and the insert is skipped."""
+    from models import insert_ignoring_conflicts
+
+    row = {"title": "Item 1", "condition": "New", "image_url": None}
+    db.session.execute(insert_ignoring_conflicts(Item).values([row]))
+    db.session.commit()
+
+    assert Item.query.filter_by(title="Item 1").count() == 1
+
+
+def test_user_authenticate_rehashes(init_database, db, monkeypatch):
+    """A hash made at an old cost is replaced on successful login."""
+    from passwords import password_hasher
+
+    old_hash = User.query.filter_by(username="testuser").first().password
+    monkeypatch.setattr(password_hasher, "rounds", password_hasher.rounds + 1)
+
+    user = User.authenticate(username="testuser", password="password")
+    db.session.commit()
+
+    assert user.password != old_hash
+    assert not password_hasher.needs_rehash(user.password)
+    assert User.authenticate(username="testuser", password="password")
+
+
+def test_password_hasher_backpressure():
+    """Once the pool and queue are full, more work is refused instead of queued."""
+    import threading
+    from passwords import PasswordHasher, HasherBusy
+
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=0, queue_timeout=0)
+    release = threading.Event()
+    blocker = threading.Thread(target=hasher._run, args=(release.wait, 5))
+    blocker.start()
+    while hasher._slots is None or hasher._slots._value:
+        threading.Event().wait(0.01)
+
+    with pytest.raises(HasherBusy):
+        hasher.hash("password")
+
+    release.set()
+    blocker.join()
+    assert hasher.check(hasher.hash("password"), "password")
+    hasher.shutdown()
@@ -0,0 +1,146 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from ebaysdk.exception import ConnectionError
+
+import ebay_24
+from app import app
+from ebay_24 import Ebay_24, ebay_guard
+from models import Item, db as _db
+from resilience import UpstreamGuard, CircuitOpen
+from fake_ebay import FakeEbayServer
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_guard(**kwargs):
+    """A guard that records its backoff sleeps instead of taking them."""
+    guard = UpstreamGuard('TEST', clock=FakeClock(), sleep=lambda seconds: guard.sleeps.append(seconds),
+                          jitter=lambda low, high: high, **kwargs)
+    guard.sleeps = []
+    return guard
+
+
+def ebay(server, guard, **kwargs):
+    return Ebay_24('test-key', 'switch', domain=server.domain, https=False, guard=guard, **kwargs)
+
+
+def test_retries_with_backoff():
+    guard = make_guard(retries=3, backoff=0.1, max_backoff=0.3)
+    with FakeEbayServer(errors=3) as server:
+        assert len(ebay(server, guard).find_items()) == 14
+
+    assert server.hits == 4
+    assert guard.sleeps == [0.1, 0.2, 0.3]
+    stats = guard.snapshot()
+    assert (stats['calls'], stats['attempts'], stats['retries'], stats['successes']) == (1, 4, 3, 1)
+    assert stats['latency_ms']['p50'] is not None
+
+
+def test_errors_that_are_not_retried():
+    """eBay refusing the request is not a reason to retry or to open the circuit."""
+    guard = make_guard(retries=3, failure_threshold=1)
+    failure = (b'<findItemsAdvancedResponse xmlns="http://www.ebay.com/marketplace/search/v1/services">'
+               b'<ack>Failure</ack></findItemsAdvancedResponse>')
+
+    with FakeEbayServer(body=failure) as server:
+        with pytest.raises(ConnectionError):
+            ebay(server, guard).find_items()
+    with FakeEbayServer(errors=1, error_status=400) as server:
+        with pytest.raises(ConnectionError):
+            ebay(server, guard).find_items()
+
+    assert guard.sleeps == []
+    assert guard.state == 'closed'
+    assert guard.snapshot()['failures'] == 2
+
+
+def test_circuit_breaker_fails_fast_then_recovers():
+    guard = make_guard(retries=1, failure_threshold=2, reset_timeout=30)
+    with FakeEbayServer(errors=100) as server:
+        client = ebay(server, guard)
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                client.find_items()
+        assert server.hits == 4
+        assert guard.state == 'open'
+
+        # Open: no call reaches eBay.
+        with pytest.raises(CircuitOpen):
+            client.find_items()
+        assert server.hits == 4
+
+        # Half-open: one trial call; it fails, so the circuit opens again.
+        guard.clock.now += 30
+        assert guard.state == 'half-open'
+        with pytest.raises(ConnectionError):
+            client.find_items()
+        assert guard.state == 'open'
+
+        # eBay recovers; the next trial closes the circuit.
+        server.errors = 0
+        guard.clock.now += 30
+        assert len(client.find_items()) == 14
+        assert guard.state == 'closed'
+
+    assert guard.snapshot()['rejected'] == 1
+
+
+def test_slow_upstream_times_out():
+    guard = make_guard(retries=1)
+    with FakeEbayServer(delay=0.5) as server:
+        with pytest.raises(requests.Timeout):
+            ebay(server, guard, timeout=0.1).find_items()
+        assert ebay(server, guard, timeout=0.1).fetch() is None
+    assert guard.snapshot()['failures'] == 2
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app.config['TESTING'] = True
+    monkeypatch.setitem(app.config, 'INGEST_INLINE', True)
+    with FakeEbayServer(errors=100) as server:
+        monkeypatch.setattr(ebay_24, 'EBAY_DOMAIN', server.domain)
+        monkeypatch.setattr(ebay_24, 'EBAY_HTTPS', False)
+        monkeypatch.setitem(app.config, 'EBAY_API_KEY', 'test-key')
+        monkeypatch.setattr(app.extensions['ebay_guard'], 'sleep', lambda seconds: None)
+        with app.app_context():
+            ebay_guard.reset()
+            _db.create_all()
+            yield app.test_client(), server
+            _db.session.remove()
+            _db.drop_all()
+            ebay_guard.reset()
+
+
+def test_search_falls_back_to_local_results(client):
+    """With eBay down, searches still answer from the database and /health says so."""
+    client, server = client
+    _db.session.add(Item(title="Nintendo Switch Lite", condition="Used"))
+    _db.session.commit()
+
+    for _ in range(ebay_guard.failure_threshold):
+        response = client.get("/items/search?q=switch")
+        assert response.status_code == 200
+        page = response.data.decode()
+        assert "Nintendo Switch Lite" in page
+        assert "eBay isn&#39;t responding" in page
+
+    # The circuit is open now, so searching doesn't wait on eBay at all.
+    hits = server.hits
+    assert client.get("/items/search?q=switch").status_code == 200
+    assert server.hits == hits
+
+    health = client.get("/health").get_json()
+    assert health['status'] == 'degraded'
+    assert health['ebay']['state'] == 'open'
+    assert health['ebay']['rejected'] > 0
@@ -3,9 +3,16 @@ import pytest
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app import app
-from models import User, Item, Trade, db as _db
-from flask import session
+from contextlib import contextmanager
+from sqlalchemy import event
+
+import ebay_24
+import ingest
+from ebay_24 import ebay_guard
+from app import app, ebay_cache, identity_cache
+from datetime import datetime, timedelta
+from models import User, Item, OfferedItem, RequestedItem, Trade, SearchTerm, IngestJob, db as _db
+from fake_ebay import FakeEbayServer
 
 @pytest.fixture(scope='function')
 def client():
@@ -27,6 +34,34 @@ def db():
         _db.drop_all()  # Drop tables after the test
 
 
+@pytest.fixture
+def fake_ebay(monkeypatch):
+    """Point Ebay_24 at a local stand-in server with an empty cache."""
+    with FakeEbayServer() as server:
+        monkeypatch.setattr(ebay_24, 'EBAY_DOMAIN', server.domain)
+        monkeypatch.setattr(ebay_24, 'EBAY_HTTPS', False)
+        monkeypatch.setitem(app.config, 'EBAY_API_KEY', 'test-key')
+        with app.app_context():
+            ebay_cache.backend.clear()
+            ebay_guard.reset()
+        yield server
+
+
+@contextmanager
+def count_queries():
+    """Collect every SQL statement run inside the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(_db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(_db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
 @pytest.fixture
 def auth(client):
     """A fixture for simulating user authentication."""
@@ -165,6 +200,26 @@ def test_add_offered_item_logged_in(client, auth, db):
     assert b"success" in response.data
 
 
+def test_add_offered_item_twice(client, auth, db):
+    """The unique index turns a duplicate add into a 400 instead of a second row."""
+
+    auth.signup()
+
+    item = Item(title="Test Item", condition="New", image_url="http://example.com/test.jpg")
+    db.session.add(item)
+    db.session.commit()
+
+    client.post("/add-offered-item", json={"item_id": item.id})
+    response = client.post("/add-offered-item", json={"item_id": item.id})
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Item already in your offered items list."
+    assert OfferedItem.query.filter_by(item_id=item.id).count() == 1
+
+    # The failed insert mustn't leave the session unusable.
+    assert client.post("/add-requested-item", json={"item_id": item.id}).status_code == 200
+
+
 def test_add_offered_item_not_logged_in(client, db):
     """Test that adding an offered item redirects when not logged in."""
     
@@ -181,16 +236,34 @@ def test_add_offered_item_not_logged_in(client, db):
     assert b"You must log in first." in response.data
 
 
+def propose_trade(db, initiator, recipient, give, receive):
+    """Create a pending trade of `initiator`'s `give` for `recipient`'s `receive`."""
+    db.session.flush()
+    offered = OfferedItem.query.filter_by(user_id=initiator.id, item_id=give.id).first() \
+        or OfferedItem(user=initiator, item=give)
+    db.session.add(offered)
+    if not OfferedItem.query.filter_by(user_id=recipient.id, item_id=receive.id).first():
+        db.session.add(OfferedItem(user=recipient, item=receive))
+    trade = Trade(offered_item=offered, requested_item=RequestedItem(user=initiator, item=receive),
+                  recipient_id=recipient.id, status="Pending")
+    db.session.add(trade)
+    db.session.commit()
+    return trade
+
+
 def test_accept_trade_logged_in(client, auth, db):
     """Test accepting a trade while logged in."""
     
     # Signup the user and log in.
     auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+    other = User(username="trader", email="trader@example.com", password="x")
+    lamp = Item(title="Lamp", condition="Used")
+    chair = Item(title="Chair", condition="Used")
+    db.session.add_all([other, lamp, chair])
 
-    # Create a trade in 'Pending' status
-    trade = Trade(item_offered_id=1, item_requested_id=2, status="Pending")
-    db.session.add(trade)
-    db.session.commit()
+    # Create a trade in 'Pending' status, offered to the current user
+    trade = propose_trade(db, other, user, lamp, chair)
 
     # Send a request to accept the trade
     response = client.post(f"/accept-trade/{trade.id}", follow_redirects=True)
@@ -201,8 +274,94 @@ def test_accept_trade_logged_in(client, auth, db):
     assert json_data["success"] == True
 
     # Verify the trade status is updated to 'Accepted'
-    updated_trade = Trade.query.get(trade.id)
+    updated_trade = db.session.get(Trade, trade.id)
     assert updated_trade.status == "Accepted"
+    assert updated_trade.version == 2
+
+    # It can't be answered twice
+    assert client.post(f"/reject-trade/{trade.id}").status_code == 404
+
+
+def test_only_the_recipient_answers_a_trade(client, auth, db):
+    auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+    other = User(username="trader", email="trader@example.com", password="x")
+    lamp = Item(title="Lamp", condition="Used")
+    chair = Item(title="Chair", condition="Used")
+    db.session.add_all([other, lamp, chair])
+
+    # The current user proposed this one, so it's the other user's to answer.
+    trade = propose_trade(db, user, other, chair, lamp)
+
+    assert client.post(f"/accept-trade/{trade.id}").status_code == 403
+    assert client.post(f"/reject-trade/{trade.id}").status_code == 403
+    assert db.session.get(Trade, trade.id).status == "Pending"
+
+
+def test_trades_without_a_recipient(client, auth, db):
+    """Old trades nobody offers the item for can't be answered, and list without extra queries."""
+    auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+    items = [Item(title=f"Old item {n}", condition="Used") for n in range(6)]
+    db.session.add_all(items)
+    trades = [Trade(offered_item=OfferedItem(user=user, item=item), requested_item=RequestedItem(user=user, item=item),
+                    status="Pending") for item in items]
+    db.session.add_all(trades)
+    db.session.commit()
+
+    assert client.get("/user/pending-trades").status_code == 200
+    assert client.post(f"/accept-trade/{trades[0].id}").status_code == 403
+
+
+def test_initiating_twice_reuses_the_request(client, auth, db):
+    auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+    other = User(username="trader", email="trader@example.com", password="x")
+    lamp, chair, desk = (Item(title=title, condition="Used") for title in ("Lamp", "Chair", "Desk"))
+    mine = [OfferedItem(user=user, item=chair), OfferedItem(user=user, item=desk)]
+    theirs = OfferedItem(user=other, item=lamp)
+    db.session.add_all(mine + [theirs])
+    db.session.commit()
+
+    for offered in mine:
+        response = client.post("/initiate-trade", json={"your_item_id": offered.id, "their_item_id": theirs.id})
+        assert response.json["success"]
+
+    requested = RequestedItem.query.filter_by(user_id=user.id).one()
+    assert [trade.item_requested_id for trade in Trade.query] == [requested.id, requested.id]
+
+
+def test_accepting_invalidates_competing_trades(client, auth, db):
+    """Every other pending trade that would give away either item is invalidated."""
+    auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+    alice, bob = (User(username=name, email=f"{name}@example.com", password="x") for name in ("alice", "bob"))
+    lamp, chair, desk, rug = (Item(title=title, condition="Used") for title in ("Lamp", "Chair", "Desk", "Rug"))
+    db.session.add_all([alice, bob, lamp, chair, desk, rug])
+
+    trade = propose_trade(db, alice, user, lamp, chair)
+    same_request = propose_trade(db, bob, user, desk, chair)    # bob also wants the chair
+    same_offer = propose_trade(db, alice, bob, lamp, rug)       # alice also offers the lamp to bob
+    asks_for_lamp = propose_trade(db, bob, alice, desk, lamp)   # bob wants alice's lamp
+    unrelated = propose_trade(db, bob, user, rug, desk)
+
+    assert client.post(f"/accept-trade/{trade.id}").status_code == 200
+
+    statuses = {t.id: t.status for t in Trade.query}
+    assert statuses == {trade.id: "Accepted", same_request.id: "Invalidated", same_offer.id: "Invalidated",
+                        asks_for_lamp.id: "Invalidated", unrelated.id: "Pending"}
+
+
+def test_stale_trade_version_is_refused(db):
+    alice, bob = (User(username=name, email=f"{name}@example.com", password="x") for name in ("alice", "bob"))
+    lamp, chair = Item(title="Lamp", condition="Used"), Item(title="Chair", condition="Used")
+    db.session.add_all([alice, bob, lamp, chair])
+    trade = propose_trade(db, alice, bob, lamp, chair)
+
+    assert Trade.transition(trade.id, 1, "Rejected")
+    assert not Trade.transition(trade.id, 1, "Accepted")
+    with pytest.raises(ValueError):
+        Trade.transition(trade.id, 2, "Pending")
 
 
 def test_accept_trade_not_logged_in(client, db):
@@ -219,3 +378,308 @@ def test_accept_trade_not_logged_in(client, db):
     # Check if it redirects to the login page
     assert response.status_code == 200
     assert b"You must log in first." in response.data
+
+
+def add_offers(db, title, count):
+    """Create an item offered by `count` new users."""
+    item = Item(title=title, condition="New", image_url="http://example.com/widget.jpg")
+    db.session.add(item)
+    for n in range(count):
+        user = User(username=f"{title}-{n}", email=f"{title}-{n}@example.com", password="x")
+        db.session.add(OfferedItem(user=user, item=item))
+    db.session.commit()
+
+
+def test_search_offered_by_query_count(client, db, fake_ebay):
+    """The "Offered by" lists cost the same number of queries however many there are."""
+    client.get("/items/search?q=widget")
+    ingest.work('test-key', once=True)
+
+    add_offers(db, "Widget A", 1)
+    with count_queries() as few:
+        response = client.get("/items/search?q=widget")
+    assert response.status_code == 200
+
+    add_offers(db, "Widget B", 7)
+    add_offers(db, "Widget C", 3)
+    with count_queries() as many:
+        response = client.get("/items/search?q=widget")
+
+    assert response.status_code == 200
+    assert len(many) == len(few)
+    assert fake_ebay.hits == 1
+
+    page = response.data.decode()
+    assert "Widget B-4" in page
+    assert "Widget B-5" not in page
+    assert "+2 more" in page
+
+
+def test_search_does_not_wait_for_ebay(client, db, fake_ebay):
+    """A new term is served from the database at once and fetched by the worker."""
+    response = client.get("/items/search?q=Nintendo  Switch")
+    assert response.status_code == 200
+    assert "Fetching the latest listings" in response.data.decode()
+    assert fake_ebay.hits == 0
+
+    result = app.test_cli_runner().invoke(args=["ingest-worker", "--once"])
+    assert "Processed 1 ingest jobs." in result.output
+    assert fake_ebay.hits == app.config['INGEST_PAGES']
+
+    response = client.get("/items/search?q=nintendo switch")
+    page = response.data.decode()
+    assert "Fetching the latest listings" not in page
+    assert page.count('class="card-title"') == 10
+    assert fake_ebay.hits == app.config['INGEST_PAGES']
+
+
+def test_search_rejects_terms_too_long_to_store(client, db, fake_ebay):
+    """A term longer than the term columns is turned away before anything is queued."""
+    response = client.get("/items/search?q=" + "a" * 201, headers={"Referer": "/items"})
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/items"
+    assert IngestJob.query.count() == 0
+
+    # Length counts after normalizing, so extra spaces don't matter.
+    assert client.get("/items/search?q=" + " a" * 100 + "   ").status_code == 200
+    assert [job.term for job in IngestJob.query] == [" ".join(["a"] * 100)]
+    assert fake_ebay.hits == 0
+
+
+def make_trades(db, user, statuses):
+    """Create one trade per status, offered to `user`, a minute apart."""
+    other = User(username="trader", email="trader@example.com", password="x")
+    start = datetime(2024, 1, 1)
+    trades = []
+    for n, status in enumerate(statuses):
+        item = Item(title=f"Trade item {n}", condition="New")
+        offered = OfferedItem(user=other, item=item)
+        requested = RequestedItem(user=other, item=item)
+        trade = Trade(offered_item=offered, requested_item=requested, recipient_id=user.id, status=status,
+                      created_at=start + timedelta(minutes=n))
+        db.session.add(trade)
+        trades.append(trade)
+    db.session.commit()
+    return trades
+
+
+def test_pending_trades_json_pages(client, auth, db):
+    """Pages only hold pending trades, newest first, and the cursor walks all of them."""
+    auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+    trades = make_trades(db, user, ["Pending", "Accepted", "Pending", "Pending", "Rejected", "Pending", "Pending"])
+    pending_ids = [trade.id for trade in reversed(trades) if trade.status == "Pending"]
+
+    seen = []
+    query_counts = []
+    url = "/user/pending-trades.json?limit=2"
+    while url:
+        with count_queries() as statements:
+            data = client.get(url).get_json()
+        query_counts.append(len([statement for statement in statements if "FROM trade" in statement]))
+        seen.extend(trade["id"] for trade in data["trades"])
+        assert all(trade["status"] == "Pending" for trade in data["trades"])
+        url = data["next_cursor"] and f"/user/pending-trades.json?limit=2&after={data['next_cursor']}"
+
+    assert seen == pending_ids
+    assert query_counts == [1, 1, 1]
+    assert data["trades"][0]["offered_item"]["title"] == "Trade item 0"
+
+
+def test_pending_trades_page(client, auth, db):
+    auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+    make_trades(db, user, ["Accepted"] + ["Pending"] * 21)
+
+    response = client.get("/user/pending-trades")
+    page = response.data.decode()
+
+    assert response.status_code == 200
+    assert page.count("accept-trade-btn") == 20
+    assert "Trade item 0<" not in page
+    assert "Older trades" in page
+
+
+def test_pending_trades_json_not_logged_in(client, db):
+    assert client.get("/user/pending-trades.json").status_code == 401
+
+
+def user_queries(statements):
+    return [statement for statement in statements if "FROM user" in statement]
+
+
+def test_user_loaded_at_most_once(client, auth, db):
+    """Pages load the logged-in user once; static files and /health never do."""
+    auth.signup()
+
+    with count_queries() as statements:
+        client.get("/")
+    assert len(user_queries(statements)) == 1
+
+    with count_queries() as statements:
+        assert client.get("/health").status_code == 200
+        client.get("/static/stylesheets/style.css").close()
+        client.get("/logout")
+    assert statements == []
+
+
+def test_identity_cache(client, auth, db, monkeypatch):
+    """With a TTL, repeat requests reuse the user; editing the profile refreshes it."""
+    monkeypatch.setattr(identity_cache, "ttl", 60)
+    identity_cache.backend.clear()
+    auth.signup()
+    user = User.query.filter_by(username="testuser").first()
+
+    client.get(f"/user/{user.id}")
+    with count_queries() as statements:
+        page = client.get(f"/user/{user.id}").data.decode()
+    assert user_queries(statements) == []
+    assert "testuser" in page
+
+    csrf_token = client.get(f"/user/{user.id}/edit").data.decode().split('name="csrf_token" type="hidden" value="')[1].split('"')[0]
+    client.post(f"/user/{user.id}/edit", data={
+        "username": "renamed",
+        "email": "renamed@example.com",
+        "image_url": "",
+        "csrf_token": csrf_token,
+    })
+
+    page = client.get("/").data.decode()
+    assert "renamed" in page
+
+
+def test_identity_cache_never_overwrites_a_loaded_user(client, auth, db, monkeypatch):
+    """A cached copy doesn't replace a fresher row in the session, and touch() drops it."""
+    monkeypatch.setattr(identity_cache, "ttl", 60)
+    identity_cache.backend.clear()
+    auth.signup()
+    user_id = User.query.filter_by(username="testuser").one().id
+
+    with app.test_request_context():
+        version = identity_cache.load(user_id).version
+    # Another worker changes the user behind this one's cache.
+    db.session.execute(db.text("UPDATE user SET version = version + 1 WHERE id = :id"), {"id": user_id})
+    db.session.commit()
+
+    with app.test_request_context():
+        fresh = db.session.get(User, user_id)
+        assert identity_cache.load(user_id) is fresh
+        assert fresh.version == version + 1
+        db.session.remove()
+
+    with app.test_request_context():
+        User.touch(user_id)
+        db.session.commit()
+        assert identity_cache.backend.get(user_id) is None
+        db.session.remove()
+
+
+def test_profile_loads_items_with_their_entries(client, auth, db):
+    """A long list on a profile page is still a fixed number of queries (strict mode checks)."""
+    auth.signup()
+    user = User.query.filter_by(username="testuser").one()
+    user_id = user.id
+    for n in range(12):
+        item = Item(title=f"Thing {n}", condition="New")
+        db.session.add_all([OfferedItem(user=user, item=item), RequestedItem(user=user, item=item)])
+    db.session.commit()
+    db.session.expunge_all()
+
+    response = client.get(f"/user/{user_id}")
+    assert response.status_code == 200
+    assert "Thing 11" in response.data.decode()
+    assert 'desc="3 queries"' in response.headers['Server-Timing']
+
+
+def test_metrics_endpoint(client, fake_ebay, monkeypatch):
+    """/metrics needs no login and reports requests and eBay calls."""
+    monkeypatch.setitem(app.config, 'INGEST_INLINE', True)
+    client.get('/search?q=laptop')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="main.search",method="GET",status="200"}' in body
+    assert 'upstream_calls_total{upstream="ebay",result="ok"}' in body
+    assert '# TYPE db_pool_checkout_wait_seconds histogram' in body
+
+
+def test_profile_not_modified(client, auth, db):
+    """A revisit with a current ETag gets a 304 for one small query; a change gets a new page."""
+    auth.signup()
+    user_id = User.query.filter_by(username="testuser").one().id
+    item = Item(title="Lamp", condition="Used")
+    db.session.add(item)
+    db.session.commit()
+    item_id = item.id
+
+    response = client.get(f"/user/{user_id}")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    with count_queries() as statements:
+        response = client.get(f"/user/{user_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert len(statements) == 1
+
+    client.post("/add-offered-item", json={"item_id": item_id})
+    response = client.get(f"/user/{user_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert "Lamp" in response.data.decode()
+
+
+def test_not_modified_sees_changes_made_by_other_workers(client, auth, db, monkeypatch):
+    """A viewer the identity cache serves gets a new page once another worker changes them."""
+    monkeypatch.setattr(identity_cache, "ttl", 60)
+    identity_cache.backend.clear()
+    auth.signup()
+    user_id = User.query.filter_by(username="testuser").one().id
+
+    # Each request gets a fresh session, as it would in a worker.
+    db.session.remove()
+    etag = client.get(f"/user/{user_id}").headers["ETag"]
+    db.session.remove()
+    assert client.get(f"/user/{user_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    db.session.execute(db.text("UPDATE user SET version = version + 1 WHERE id = :id"), {"id": user_id})
+    db.session.commit()
+    db.session.remove()
+    assert identity_cache.backend.get(user_id) is not None
+    assert client.get(f"/user/{user_id}", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_search_not_modified(client, auth, db, fake_ebay):
+    """Search pages are revalidated against the term's last refresh and the latest change to any item."""
+    auth.signup()
+    db.session.add(SearchTerm(term="widget", last_refreshed=datetime.now(), item_count=0))
+    db.session.commit()
+    add_offers(db, "Widget A", 1)
+
+    response = client.get("/items/search?q=Widget")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, max-age=60"
+
+    with count_queries() as statements:
+        response = client.get("/items/search?q=Widget", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert len(statements) == 1
+
+    # Someone else now offers a widget too, so the "Offered by" list changed.
+    other = User(username="other", email="other@example.com", password="x")
+    db.session.add(other)
+    db.session.commit()
+    item_id = Item.query.filter_by(title="Widget A").one().id
+    with client.session_transaction() as session:
+        session["curr_user"], user_id = other.id, session["curr_user"]
+    client.post("/add-offered-item", json={"item_id": item_id})
+    with client.session_transaction() as session:
+        session["curr_user"] = user_id
+
+    response = client.get("/items/search?q=Widget", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "other" in response.data.decode()
+    assert fake_ebay.hits == 0
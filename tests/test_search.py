@@ -0,0 +1,77 @@
+import os
+import pytest
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import Item, db as _db
+from search import search_items
+
+
+@pytest.fixture(scope='function')
+def db():
+    """Set up a new database for each test session."""
+    with app.app_context():
+        _db.create_all()
+        yield _db
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def items(db):
+    titles = [
+        "Nintendo Switch OLED Console",
+        "Nintendo Switch Lite",
+        "Light switch cover plate",
+        "Xbox Series X",
+        "PS5 DualSense controller",
+    ]
+    db.session.add_all([Item(title=title, condition="New") for title in titles])
+    db.session.commit()
+    return db
+
+
+def titles(results):
+    return sorted(item.title for item in results)
+
+
+def test_search_matches_substrings_case_insensitively(items):
+    assert titles(search_items("SWITCH")) == [
+        "Light switch cover plate",
+        "Nintendo Switch Lite",
+        "Nintendo Switch OLED Console",
+    ]
+    assert titles(search_items("itch lit")) == ["Nintendo Switch Lite"]
+    assert search_items("gamecube") == []
+
+
+def test_search_respects_limit(items):
+    assert len(search_items("switch", limit=2)) == 2
+
+
+def test_search_short_terms(items):
+    """Terms shorter than a trigram fall back to a plain scan."""
+    assert titles(search_items("LI")) == ["Light switch cover plate", "Nintendo Switch Lite"]
+
+
+def test_search_quotes_and_wildcards(items):
+    assert search_items('"switch') == []
+    assert search_items("100%") == []
+
+
+def test_search_index_follows_writes(items):
+    """The index picks up inserts, updates and deletes."""
+    xbox = Item.query.filter_by(title="Xbox Series X").first()
+    xbox.title = "Xbox Series S"
+    items.session.add(Item(title="Switch Pro Controller", condition="Used"))
+    items.session.delete(Item.query.filter_by(title="Light switch cover plate").first())
+    items.session.commit()
+
+    assert titles(search_items("series s")) == ["Xbox Series S"]
+    assert search_items("series x") == []
+    assert titles(search_items("switch")) == [
+        "Nintendo Switch Lite",
+        "Nintendo Switch OLED Console",
+        "Switch Pro Controller",
+    ]
@@ -0,0 +1,66 @@
+import os
+import pytest
+import sys
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from config import TestingConfig
+from models import db, User, Item, OfferedItem, RequestedItem, Trade
+
+
+@pytest.fixture
+def app(tmp_path):
+    """A file database, so requests on different threads share it."""
+
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % (tmp_path / 'trades.db')
+
+    app = create_app(FileConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def test_concurrent_accepts_trade_an_item_once(app):
+    """Of many simultaneous accepts for the same item, exactly one wins."""
+
+    with app.app_context():
+        owner = User(username='owner', email='owner@example.com', password='x')
+        chair = Item(title='Chair', condition='Used')
+        db.session.add(OfferedItem(user=owner, item=chair))
+        db.session.flush()
+        for n in range(6):
+            bidder = User(username=f'bidder{n}', email=f'bidder{n}@example.com', password='x')
+            item = Item(title=f'Lamp {n}', condition='Used')
+            db.session.add(Trade(offered_item=OfferedItem(user=bidder, item=item),
+                                 requested_item=RequestedItem(user=bidder, item=chair),
+                                 recipient_id=owner.id, status='Pending'))
+        db.session.commit()
+        owner_id = owner.id
+        trade_ids = [trade.id for trade in Trade.query]
+
+    # Every trade accepted twice at once: competing trades, and double clicks.
+    attempts = trade_ids * 2
+    barrier = threading.Barrier(len(attempts))
+    codes = []
+
+    def accept(trade_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['curr_user'] = owner_id
+        barrier.wait()
+        codes.append(client.post(f'/accept-trade/{trade_id}').status_code)
+
+    threads = [threading.Thread(target=accept, args=(trade_id,)) for trade_id in attempts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Losers see 409 (changed under them) or 404 (already answered by the time they looked).
+    assert codes.count(200) == 1
+    assert set(codes) <= {200, 404, 409}
+    with app.app_context():
+        statuses = sorted(trade.status for trade in Trade.query)
+    assert statuses == ['Accepted'] + ['Invalidated'] * 5